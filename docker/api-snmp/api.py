@@ -4,86 +4,436 @@ API REST para servir dados SNMP do SQLite para o dashboard
 """
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from array import array
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
+import queue
+import threading
 import sqlite3
+import struct
+import tempfile
 import time
+import zipfile
+import zlib
 from urllib.parse import urlparse, parse_qs
 import os
+import sys
+
+try:
+    import brotli  # opcional: sem ele a API comprime só com gzip
+except ImportError:
+    brotli = None
+
+# snmp_store fica ao lado (imagem do coletor, /app) ou em ../snmp-collector no repositório
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'snmp-collector'))
+from snmp_store import (COUNTER_FIELDS, DEFAULT_POINTS, EXPORT_BATCH, METRICS_FIELDS, TIER_SIZES,
+                        ConnectionManager, backup_status, choose_tier, column_type, current_generation, lttb,
+                        lttb_history, query_history, query_series, stream_metrics, tier_step)
 
 DB_PATH = '/data/snmp_metrics.db'
 HOSTS_FILE = '/data/hosts.json'
 PORT = 8090
 
+# Servidor: requisições atendidas num pool limitado de threads
+API_WORKERS = int(os.environ.get('API_WORKERS', 8))          # requisições simultâneas
+API_QUEUE_LIMIT = int(os.environ.get('API_QUEUE_LIMIT', 64))  # conexões aguardando um worker
+KEEPALIVE_TIMEOUT = float(os.environ.get('API_KEEPALIVE_TIMEOUT', 5))  # s ociosos antes de fechar
+
+# Cache de /api/latest: válido enquanto o coletor não gravar (TTL só como limite de segurança)
+LATEST_CACHE_TTL = float(os.environ.get('LATEST_CACHE_TTL', 300))
+LATEST_CACHE_ENTRIES = 256
+
+# Push de /api/stream (Server-Sent Events)
+STREAM_POLL = 1.0           # s entre verificações da geração dos dados (uma consulta para todos)
+STREAM_HEARTBEAT = 15       # s entre comentários que mantêm a conexão e detectam clientes mortos
+STREAM_MAX_AGE = 300        # s por conexão: o navegador reconecta sozinho (nova assinatura)
+STREAM_RETRY_MS = 3000      # espera do EventSource antes de reconectar
+# Cada cliente tem uma thread própria (parada na fila de eventos), fora do pool de workers
+STREAM_MAX_CLIENTS = int(os.environ.get('STREAM_MAX_CLIENTS', 256))
+
+# Compressão negociada por Accept-Encoding (corpos pequenos vão sem compressão)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # bytes
+COMPRESS_TYPES = ('application/json', 'text/')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+INDEX_PATHS = ['/data/index.html', '/app/index.html', '/tmp/index.html']
+
+# Intervalos aceitos em range= (segundos)
+TIME_RANGES = {
+    '5m': 300, '15m': 900, '30m': 1800, '1h': 3600,
+    '3h': 10800, '6h': 21600, '12h': 43200, '24h': 86400,
+    '2d': 172800, '7d': 604800, '30d': 2592000
+}
+
+# Conexões reaproveitadas por thread (WAL: leituras não bloqueiam o coletor)
+DB = ConnectionManager(DB_PATH)
+
+
+class ResponseCache:
+    """Respostas já serializadas, válidas enquanto a geração dos dados não mudar"""
+
+    def __init__(self, ttl=LATEST_CACHE_TTL, max_entries=LATEST_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # chave -> (geração, criado_em, status, corpo)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """(status, corpo) em cache para a geração atual, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] != generation
+                    or time.monotonic() - entry[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def put(self, key, generation, status, body):
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic(), status, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return status, body
+
+
+LATEST_CACHE = ResponseCache()
+
+
+def encode_cursor(values):
+    """Cursor opaco de paginação: a chave de ordenação da última linha da página"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('cursor inválido')
+    return values
+
+
+def last_rows(since=None):
+    """Linhas de last_metrics (como dicts) com timestamp a partir de `since`"""
+    columns = [col[1] for col in DB.query('PRAGMA table_info(last_metrics)')]
+    query = f'SELECT {", ".join(columns)} FROM last_metrics'
+    params = []
+    if since is not None:
+        query += ' WHERE timestamp >= ?'
+        params.append(since)
+    return [dict(zip(columns, row)) for row in DB.query(query + ' ORDER BY host', params)]
+
+
+class LiveHub:
+    """Distribui as linhas novas de last_metrics aos clientes de /api/stream
+
+    Uma única thread acompanha a geração dos dados (store_meta): cada gravação do
+    coletor vira uma consulta, independente do número de clientes conectados.
+    """
+
+    def __init__(self, poll=STREAM_POLL, max_clients=STREAM_MAX_CLIENTS):
+        self.poll = poll
+        self.max_clients = max_clients
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._generation = None
+        self._seen = {}  # host -> timestamp da última linha distribuída
+
+    def subscribe(self):
+        """Fila de eventos de um novo cliente, ou None se o limite de clientes foi atingido"""
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                return None
+            subscription = queue.Queue(maxsize=8)
+            self._clients.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name='live-hub', daemon=True)
+                self._thread.start()
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._clients.discard(subscription)
+
+    def _watch(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[ERRO] Falha ao verificar novas métricas: {e}")
+            time.sleep(self.poll)
+
+    def check(self):
+        """Envia aos clientes as linhas gravadas desde a última geração vista"""
+        generation = current_generation(DB)
+        if generation == self._generation:
+            return
+        first_check, self._generation = self._generation is None, generation
+        # >= e filtro por host: outro host pode gravar no mesmo segundo numa gravação seguinte
+        since = None if first_check else max(self._seen.values(), default=None)
+        rows = [row for row in last_rows(since)
+                if row['timestamp'] is not None and row['timestamp'] > self._seen.get(row['host'], -1)]
+        for row in rows:
+            self._seen[row['host']] = row['timestamp']
+        if first_check or not rows:
+            return  # no início o estado atual os clientes já têm (carregado via /api/latest)
+        event = (max(row['timestamp'] for row in rows), rows)
+        with self._lock:
+            clients = list(self._clients)
+        for subscription in clients:
+            # Cliente lento: descarta o evento mais antigo (só o estado mais recente importa)
+            while True:
+                try:
+                    subscription.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscription.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+LIVE_HUB = LiveHub()
+
+
+def accepted_encodings(accept_encoding):
+    """Codificações aceitas pelo cliente (q > 0), da preferida para a menos preferida"""
+    weights = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name.lower()] = quality
+    if '*' in weights:
+        for name in ('br', 'gzip'):
+            weights.setdefault(name, weights['*'])
+    supported = ('br', 'gzip') if brotli else ('gzip',)
+    # Empate: brotli antes de gzip (corpo menor)
+    return sorted((name for name in supported if weights.get(name, 0) > 0),
+                  key=lambda name: -weights[name])
+
+
+def compress(body, encoding, best=False):
+    """Comprime o corpo ('best' para conteúdo estático, comprimido uma só vez)"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def stream_compressor(encoding):
+    """(comprimir, finalizar) para compressão incremental de um corpo em partes"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # formato gzip
+    return compressor.compress, compressor.flush
+
+
+# ============================================================================
+# EXPORTAÇÃO COLUNAR (.npz)
+# ============================================================================
+
+# Formato .npy de cada coluna no .npz (código do módulo array -> dtype NumPy)
+NPY_DTYPES = {'q': '<i8', 'd': '<f8', 'i': '<i4', 'B': '|b1'}
+
+
+def npy_header(descr, count):
+    """Cabeçalho .npy (versão 1.0) de um vetor com `count` elementos"""
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({count},), }}"
+    # Magic + versão + tamanho (10 bytes) + dicionário, alinhado a 64 bytes e terminado em \n
+    header += ' ' * (-(10 + len(header) + 1) % 64) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class StreamSink:
+    """Arquivo só de escrita para o zipfile; os bytes saem por drain() a cada parte"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+_dashboard = {'path': None, 'mtime': None, 'variants': None, 'etag': None}
+_dashboard_lock = threading.Lock()
+
+
+def load_dashboard():
+    """index.html já reescrito e pré-comprimido; refeito só quando o arquivo muda"""
+    for index_path in INDEX_PATHS:
+        try:
+            mtime = os.stat(index_path).st_mtime
+        except OSError:
+            continue
+        with _dashboard_lock:
+            if _dashboard['path'] != index_path or _dashboard['mtime'] != mtime:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                content = content.replace(
+                    'let SNMP_API_URL = "http://localhost:8090/api"',
+                    'let SNMP_API_URL = window.location.origin + "/api"'
+                )
+                content = content.replace(
+                    'const saved = localStorage.getItem("fcaps_data_source");',
+                    'document.getElementById("dataSourceSelector").style.display = "none"; return; const saved = localStorage.getItem("fcaps_data_source");'
+                )
+                body = content.encode('utf-8')
+                variants = {None: body}
+                for encoding in ('br', 'gzip') if brotli else ('gzip',):
+                    variants[encoding] = compress(body, encoding, best=True)
+                _dashboard.update(path=index_path, mtime=mtime, variants=variants,
+                                  etag='"' + hashlib.sha1(body).hexdigest()[:20] + '"')
+            return _dashboard['variants'], _dashboard['etag']
+    raise FileNotFoundError("index.html not found in any location")
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer que atende cada conexão num pool limitado de threads
+
+    Uma exportação longa ocupa só um worker; conexões além de workers + fila
+    recebem 503 imediatamente em vez de acumular threads. Conexões de
+    /api/stream passam a uma thread própria (APIHandler.detached) e devolvem
+    o worker assim que a requisição é lida.
+    """
+
+    def __init__(self, server_address, handler_class, workers=API_WORKERS,
+                 queue_limit=API_QUEUE_LIMIT):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            # Fila cheia: recusa sem ocupar um worker
+            body = b'{"error": "Servidor ocupado"}'
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                b'Content-Type: application/json\r\n'
+                                b'Retry-After: 1\r\nConnection: close\r\n'
+                                b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        """Executa no worker: atende a conexão (várias requisições com keep-alive)"""
+        detached = False
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+            # Stream SSE: a thread própria fecha a conexão quando terminar
+            detached = handler.detached is not None
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if not detached:
+                self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 class APIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: conexões persistentes (keep-alive); toda resposta leva Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Conexão ociosa é fechada após esse tempo, liberando o worker
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers e corpo saem em writes separados: sem Nagle o corpo não espera o ACK atrasado
+    disable_nagle_algorithm = True
+    # Eventos SSE a enviar numa thread própria depois que o worker terminar (ver finish)
+    detached = None
+
     def do_GET(self):
         print(f"[LOG] Requisição recebida: {self.path}")
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         params = parse_qs(parsed_path.query)
 
-        # Servir index.html na raiz
+        # Servir index.html na raiz (reescrito e comprimido uma vez, em memória)
         if path == '/' or path == '/index.html':
             try:
-                index_paths = ['/data/index.html', '/app/index.html', '/tmp/index.html']
-                content = None
-                for index_path in index_paths:
-                    try:
-                        with open(index_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            content = content.replace(
-                                'let SNMP_API_URL = "http://localhost:8090/api"',
-                                'let SNMP_API_URL = window.location.origin + "/api"'
-                            )
-                            content = content.replace(
-                                'const saved = localStorage.getItem("fcaps_data_source");',
-                                'document.getElementById("dataSourceSelector").style.display = "none"; return; const saved = localStorage.getItem("fcaps_data_source");'
-                            )
-                            break
-                    except:
-                        continue
-                if content:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    self.wfile.write(content.encode('utf-8'))
-                else:
-                    raise FileNotFoundError("index.html not found in any location")
+                variants, etag = load_dashboard()
+                if self.not_modified(etag):
+                    return
+                self.send_body(200, variants[None], 'text/html; charset=utf-8',
+                               headers=self.validators(etag), variants=variants)
             except Exception as e:
                 print(f"[ERRO] Falha ao servir index.html: {e}")
-                self.send_response(404)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(f'Dashboard not found: {e}'.encode())
+                self.send_body(404, f'Dashboard not found: {e}'.encode(), 'text/plain')
+            return
+
+        # Push das métricas a cada gravação do coletor (Server-Sent Events)
+        if path == '/api/stream':
+            subscription = LIVE_HUB.subscribe()
+            if subscription is None:
+                # Limite de clientes: o dashboard continua por polling
+                self.send_body(503, json.dumps({'error': 'Limite de conexões de stream atingido'},
+                                               ensure_ascii=False).encode(), headers={'Retry-After': '60'})
+                return
+            # A conexão fica aberta por até STREAM_MAX_AGE: sai do pool para não prender um worker
+            self.detached = self.stream_events(subscription, self.headers.get('Last-Event-ID'))
+            self.close_connection = True
             return
 
         # Documentação Swagger/OpenAPI
         if path == '/api/docs':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
             openapi = self.get_openapi_spec()
-            self.wfile.write(json.dumps(openapi, ensure_ascii=False, indent=2).encode())
+            self.send_body(200, json.dumps(openapi, ensure_ascii=False, indent=2).encode())
             return
 
-        # Exportação CSV
+        # Exportação CSV ou .npz (em partes, sem limite de linhas)
         if path == '/api/export':
             try:
                 host = params.get('host', [None])[0]
                 metric = params.get('metric', [None])[0]
                 time_range = params.get('range', ['1h'])[0]
-                csv_data = self.export_csv(host, metric, time_range)
-                self.send_response(200)
-                self.send_header('Content-type', 'text/csv; charset=utf-8')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(csv_data.encode('utf-8'))
+                export_format = params.get('format', ['csv'])[0]
+                if export_format == 'csv':
+                    self.send_stream(200, self.export_csv(host, metric, time_range),
+                                     'text/csv; charset=utf-8')
+                elif export_format == 'npz':
+                    self.send_stream(200, self.export_npz(host, metric, time_range), 'application/octet-stream',
+                                     {'Content-Disposition': 'attachment; filename="metrics.npz"'})
+                else:
+                    raise ValueError(f'format inválido: {export_format}')
+            except ValueError as e:
+                self.send_body(400, json.dumps({'error': str(e)}, ensure_ascii=False).encode())
             except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                self.send_body(500, json.dumps({'error': str(e)}).encode())
             return
 
         # API endpoints
@@ -98,6 +448,7 @@ class APIHandler(BaseHTTPRequestHandler):
         # Definir status padrão
         status_code = 200
         response = None
+        headers = None
 
         try:
             if path == '/api/hosts':
@@ -107,63 +458,347 @@ class APIHandler(BaseHTTPRequestHandler):
             elif path == '/api/hosts/remove':
                 response = self.remove_host(data)
             elif path == '/api/latest':
-                # Filtros: host, ordenação, limite, offset
+                # Filtros: host, ordenação, limite, offset ou cursor
                 host = params.get('host', [None])[0]
                 order = params.get('order', ['host'])[0]
                 limit = int(params.get('limit', [100])[0])
                 offset = int(params.get('offset', [0])[0])
-                response = self.get_latest(host, order, limit, offset)
-                if not response['hosts']:
-                    status_code = 404
+                cursor = params.get('cursor', [None])[0]
+                # Geração muda a cada gravação do coletor: até lá a resposta é a mesma
+                key = (host, order, limit, offset, cursor)
+                generation = current_generation(DB)
+                etag = self.generation_etag(generation)
+                if self.not_modified(etag, generation[1]):
+                    return
+                cached = LATEST_CACHE.get(key, generation)
+                headers = {'X-Cache': 'HIT'}
+                if cached is None:
+                    response = self.get_latest(host, order, limit, offset, cursor)
+                    # Página vazia pedida por cursor é o fim da paginação, não "não encontrado"
+                    found = response['hosts'] or cursor
+                    cached = LATEST_CACHE.put(key, generation, 200 if found else 404,
+                                              json.dumps(response, ensure_ascii=False).encode())
+                    headers['X-Cache'] = 'MISS'
+                if cached[0] == 200:
+                    headers.update(self.validators(etag, generation[1]))
+                self.send_body(*cached, headers=headers)
+                return
             elif path == '/api/history':
                 host = params.get('host', [None])[0]
                 time_range = params.get('range', ['1h'])[0]
                 metric = params.get('metric', ['cpu'])[0]
-                limit = int(params.get('limit', [1000])[0])
+                limit = params.get('limit', [None])[0]
+                limit = int(limit) if limit else None
                 offset = int(params.get('offset', [0])[0])
-                response = self.get_history(host, time_range, metric, limit, offset)
-                if not response['data']:
+                points = int(params.get('points', [DEFAULT_POINTS])[0])
+                step = params.get('step', [None])[0]
+                tier = params.get('tier', [None])[0]
+                downsample = params.get('downsample', ['avg'])[0]
+                cursor = params.get('cursor', [None])[0]
+                step = int(step) if step else None
+                # Revalidação antes da consulta: com o ETag igual, nem consulta nem serializa
+                etag = self.history_etag(time_range, points, step, tier, downsample,
+                                         path, metric, host, limit, offset, cursor)
+                if self.not_modified(etag):
+                    return
+                response = self.get_history(host, time_range, metric, limit, offset, points,
+                                            step, tier, downsample, cursor)
+                if not response['data'] and not cursor:
+                    status_code = 404
+                else:
+                    headers = self.validators(etag)
+            elif path == '/api/query':
+                # Várias métricas e hosts numa requisição: metric=cpu&metric=memory&host=a&host=b
+                hosts = params.get('host', [])
+                metrics = params.get('metric', ['cpu'])
+                time_range = params.get('range', ['1h'])[0]
+                points = int(params.get('points', [DEFAULT_POINTS])[0])
+                step = params.get('step', [None])[0]
+                step = int(step) if step else None
+                tier = params.get('tier', [None])[0]
+                downsample = params.get('downsample', ['avg'])[0]
+                etag = self.history_etag(time_range, points, step, tier, downsample,
+                                         path, tuple(metrics), tuple(hosts))
+                if self.not_modified(etag):
+                    return
+                response = self.get_query(hosts, metrics, time_range, points, step, tier, downsample)
+                if not any(serie['points'] for serie in response['series']):
+                    status_code = 404
+                else:
+                    headers = self.validators(etag)
+            elif path == '/api/interfaces':
+                host = params.get('host', [None])[0]
+                # Interfaces são gravadas junto com as métricas: mesma geração
+                generation = current_generation(DB)
+                etag = self.generation_etag(generation)
+                if self.not_modified(etag, generation[1]):
+                    return
+                response = self.get_interfaces(host)
+                if not response['interfaces']:
+                    status_code = 404
+                else:
+                    headers = self.validators(etag, generation[1])
+            elif path == '/api/backup':
+                # Último backup do coletor (duração, tamanhos), registrado em store_meta
+                response = {'backup': backup_status(DB) or None}
+                if response['backup'] is None:
                     status_code = 404
             else:
                 status_code = 404
                 response = {'error': 'Unknown endpoint'}
 
-            self.send_response(status_code)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+            body = json.dumps(response, ensure_ascii=False).encode()
+            self.send_body(status_code, body, headers=headers)
+        except ValueError as e:
+            # Parâmetro inválido (métrica desconhecida, número malformado)
+            self.send_body(400, json.dumps({'error': str(e)}, ensure_ascii=False).encode())
         except Exception as e:
             print(f"[ERRO] Exceção na requisição {self.path}: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {'error': str(e)}
-            self.wfile.write(json.dumps(error_response).encode())
-    
-    def get_hosts(self, host=None, order='host', limit=100, offset=0):
-        """Retorna lista de hosts monitorados (todas métricas, filtrável)"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('PRAGMA table_info(last_metrics)')
-        columns = [col[1] for col in cursor.fetchall()]
+            self.send_body(500, json.dumps(error_response).encode())
+
+    def send_body(self, status, body, content_type='application/json', headers=None,
+                  variants=None):
+        """Envia a resposta completa com Content-Length (necessário para keep-alive)
+
+        Comprime com brotli/gzip conforme Accept-Encoding quando o corpo passa de
+        COMPRESS_MIN_SIZE; `variants` traz versões já comprimidas ({codificação: bytes}).
+        """
+        headers = dict(headers or {})
+        if content_type.startswith(COMPRESS_TYPES) and len(body) >= COMPRESS_MIN_SIZE:
+            headers['Vary'] = 'Accept-Encoding'
+            encodings = accepted_encodings(self.headers.get('Accept-Encoding'))
+            compressed = None
+            if encodings:
+                encoding = encodings[0]
+                compressed = (variants or {}).get(encoding) or compress(body, encoding)
+            if compressed is not None and len(compressed) < len(body):
+                body = compressed
+                headers['Content-Encoding'] = encoding
+                if 'ETag' in headers:
+                    # ETag forte muda com a representação
+                    headers['ETag'] = headers['ETag'][:-1] + '-' + encoding + '"'
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, status, chunks, content_type, headers=None, compress=True):
+        """Envia o corpo em partes (Transfer-Encoding: chunked), sem montá-lo na memória
+
+        A primeira parte é gerada antes dos headers: erros na consulta ainda viram
+        uma resposta de erro normal. Depois disso, uma falha só pode interromper a
+        conexão (sem o chunk final o cliente percebe o corte).
+        """
+        chunks = iter(chunks)
+        first = next(chunks, b'')
+        headers = dict(headers or {})
+        compress_part = finish = None
+        # (eventos não são comprimidos: o compressor seguraria cada um no buffer)
+        if compress and content_type.startswith(COMPRESS_TYPES):
+            headers['Vary'] = 'Accept-Encoding'
+            encodings = accepted_encodings(self.headers.get('Accept-Encoding'))
+            if encodings:
+                headers['Content-Encoding'] = encodings[0]
+                compress_part, finish = stream_compressor(encodings[0])
+        # Clientes HTTP/1.0 não entendem chunked: corpo até o fechamento da conexão
+        chunked = self.request_version != 'HTTP/1.0'
+
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+
+        def write(data):
+            if not data:
+                return  # chunk vazio encerraria o corpo
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            else:
+                self.wfile.write(data)
+
+        try:
+            part = first
+            while part is not None:
+                write(compress_part(part) if compress_part else part)
+                part = next(chunks, None)
+            if finish:
+                write(finish())
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            print(f"[ERRO] Resposta interrompida {self.path}: {e}")
+            self.close_connection = True
+        finally:
+            # Libera cursores/assinaturas do gerador mesmo com o cliente desconectado
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def finish(self):
+        if self.detached is None:
+            super().finish()
+            return
+        # O worker já saiu desta conexão: o stream segue numa thread só dele
+        threading.Thread(target=self.serve_detached, name='api-stream', daemon=True).start()
+
+    def serve_detached(self):
+        """Envia o stream SSE e fecha a conexão (roda fora do pool de workers)"""
+        try:
+            self.send_stream(200, self.detached, 'text/event-stream', {'Cache-Control': 'no-cache'},
+                             compress=False)
+        except Exception as e:
+            print(f"[ERRO] Stream interrompido: {e}")
+        finally:
+            try:
+                super().finish()
+            except OSError:
+                pass
+            self.server.shutdown_request(self.request)
+
+    def stream_events(self, subscription, last_event_id=None):
+        """Fluxo SSE: um evento `metrics` por host a cada gravação do coletor
+
+        O id do evento é o timestamp mais recente; ao reconectar, o navegador o
+        devolve em Last-Event-ID e recebe o que foi gravado nesse intervalo.
+        """
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'.encode()
+            if last_event_id and last_event_id.isdigit():
+                rows = last_rows(int(last_event_id))
+                if rows:
+                    yield self.sse_events(max(row['timestamp'] for row in rows), rows)
+            deadline = time.monotonic() + STREAM_MAX_AGE
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    newest, rows = subscription.get(timeout=min(STREAM_HEARTBEAT, remaining))
+                except queue.Empty:
+                    yield b': ping\n\n'
+                    continue
+                yield self.sse_events(newest, rows)
+        finally:
+            LIVE_HUB.unsubscribe(subscription)
+
+    def sse_events(self, newest, rows):
+        """Eventos SSE das linhas (mesmo formato de cada host em /api/latest)"""
+        return ''.join(
+            f'id: {newest}\nevent: metrics\ndata: {json.dumps(self.friendly_fields(row), ensure_ascii=False)}\n\n'
+            for row in rows).encode('utf-8')
+
+    def generation_etag(self, generation):
+        """ETag forte: geração dos dados + caminho e parâmetros da requisição"""
+        digest = hashlib.sha1(f'{self.path}|{generation}'.encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    def history_etag(self, time_range, points, step, tier, downsample, *key):
+        """ETag fraco de /api/history e /api/query, calculado sem consultar as séries
+
+        A resposta só muda com os dados (geração do coletor e, nas agregações, a
+        marca d'água da camada) ou quando a janela relativa entra no bucket
+        seguinte; `key` são os demais parâmetros já interpretados.
+        """
+        seconds = TIME_RANGES.get(time_range, 3600)
+        tier, step = self.resolve_resolution(seconds, points, step, tier, downsample)
+        # Início da janela alinhado como na consulta (LTTB lê a resolução nativa)
+        align = tier_step(tier) if downsample == 'lttb' else step
+        window = (int(time.time()) - seconds) // align
+        watermark = None
+        if tier != 'raw':
+            try:
+                rows = DB.query('SELECT watermark FROM rollup_state WHERE tier = ?', (tier,))
+                watermark = rows[0][0] if rows else None
+            except sqlite3.OperationalError:
+                pass  # banco ainda sem as agregações: a consulta cai nas amostras brutas
+        state = (current_generation(DB), watermark, tier, step, downsample, window) + key
+        return 'W/"' + hashlib.sha1(repr(state).encode()).hexdigest()[:20] + '"'
+
+    def validators(self, etag, newest=None):
+        """Headers de revalidação (o cliente sempre confirma com If-None-Match)"""
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if newest:
+            headers['Last-Modified'] = formatdate(newest, usegmt=True)
+        return headers
+
+    def not_modified(self, etag, newest=None):
+        """Responde 304 se o cliente já tem esta versão; True se respondeu"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-None-Match tem precedência e usa comparação fraca (RFC 9110)
+            # (sufixo da codificação ignorado: a versão dos dados é a mesma)
+            for sent in if_none_match.split(','):
+                sent = sent.strip()
+                tag = sent.removeprefix('W/')
+                base = tag
+                for suffix in ('-br"', '-gzip"'):
+                    if tag.endswith(suffix):
+                        base = tag[:-len(suffix)] + '"'
+                if tag == '*' or base == etag.removeprefix('W/'):
+                    # 304 repete o ETag da representação que o cliente guardou
+                    etag = etag if tag == '*' else sent
+                    fresh = True
+                    break
+            else:
+                fresh = False
+        else:
+            fresh = False
+            since = self.headers.get('If-Modified-Since')
+            if since and newest:
+                try:
+                    fresh = int(newest) <= parsedate_to_datetime(since).timestamp()
+                except (TypeError, ValueError):
+                    fresh = False
+        if not fresh:
+            return False
+        # 304 não tem corpo: a conexão continua utilizável (keep-alive)
+        self.send_response(304)
+        for name, value in self.validators(etag, newest).items():
+            self.send_header(name, value)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        return True
+
+    def get_hosts(self, host=None, order='host', limit=100, offset=0, cursor=None):
+        """Retorna lista de hosts monitorados (todas métricas, filtrável)
+
+        Paginação por `cursor` (próxima página a partir de `next_cursor`) ou `offset`.
+        """
+        columns = [col[1] for col in DB.query('PRAGMA table_info(last_metrics)')]
+        if order not in columns:
+            raise ValueError(f'order inválido: {order}')
         select_fields = ', '.join(columns)
-        query = f'SELECT {select_fields} FROM last_metrics'
+        query = f'SELECT {select_fields} FROM last_metrics WHERE 1'
         params = []
         if host:
-            query += ' WHERE host = ?'
+            query += ' AND host = ?'
             params.append(host)
-        query += f' ORDER BY {order} LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        hosts = []
-        for row in cursor.fetchall():
-            host_data = {col: row[idx] for idx, col in enumerate(columns)}
-            # Campos amigáveis
-            host_data = self.friendly_fields(host_data)
-            hosts.append(host_data)
-        conn.close()
-        return {'hosts': hosts}
+        if cursor:
+            # Depois do cursor na ordem ({order}, host); NULL vem antes de qualquer valor
+            value, after_host = decode_cursor(cursor)
+            if value is None:
+                query += f' AND ({order} IS NOT NULL OR host > ?)'
+                params.append(after_host)
+            else:
+                query += f' AND ({order} > ? OR ({order} = ? AND host > ?))'
+                params.extend([value, value, after_host])
+            offset = 0
+        # Uma linha além do limite: só há próxima página se ela existir
+        query += f' ORDER BY {order}, host LIMIT ? OFFSET ?'
+        params.extend([limit + 1, offset])
+        rows = [dict(zip(columns, row)) for row in DB.query(query, params)]
+        rows, more = rows[:limit], len(rows) > limit
+        next_cursor = encode_cursor([rows[-1][order], rows[-1]['host']]) if more and rows else None
+        # Campos amigáveis
+        return {'hosts': [self.friendly_fields(row) for row in rows], 'next_cursor': next_cursor}
 
     def get_hosts_list(self):
         """Retorna lista de hosts monitorados (configuração)"""
@@ -223,38 +858,120 @@ class APIHandler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'error': str(e)}
     
-    def get_latest(self, host=None, order='host', limit=100, offset=0):
+    def get_latest(self, host=None, order='host', limit=100, offset=0, cursor=None):
         """Retorna últimas métricas de todos os hosts, filtrável"""
-        return self.get_hosts(host, order, limit, offset)
+        return self.get_hosts(host, order, limit, offset, cursor)
     
-    def get_history(self, host, time_range, metric, limit=1000, offset=0):
-        """Retorna histórico de métricas detalhado, filtrável e paginado"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        time_map = {
-            '5m': 300, '15m': 900, '30m': 1800, '1h': 3600,
-            '3h': 10800, '6h': 21600, '12h': 43200, '24h': 86400,
-            '2d': 172800, '7d': 604800, '30d': 2592000
-        }
-        seconds = time_map.get(time_range, 3600)
+    def resolve_resolution(self, seconds, points, step, tier, downsample):
+        """Camada e passo (s) de uma consulta de histórico"""
+        if downsample not in ('avg', 'lttb', 'none'):
+            raise ValueError(f'downsample inválido: {downsample}')
+        if points < 1 or (step is not None and step < 1):
+            raise ValueError('points e step devem ser positivos')
+        if tier not in TIER_SIZES and tier != 'raw':
+            tier, _native = choose_tier(seconds, points)
+        native = tier_step(tier)
+        if downsample == 'none':
+            step = native
+        elif step is None:
+            step = -(-seconds // points)  # passo que rende ~points buckets
+        return tier, max(native, -(-step // native) * native)
+
+    def get_history(self, host, time_range, metric, limit=None, offset=0,
+                    points=DEFAULT_POINTS, step=None, tier=None, downsample='avg', cursor=None):
+        """Retorna histórico de métricas detalhado, filtrável e paginado
+
+        Usa a agregação mais grossa (5m/1h/1d) que ainda entrega `points` pontos
+        por série e reduz no servidor até ~`points` pontos: buckets de `step`
+        segundos com min/média/max ('avg') ou LTTB ('lttb'); 'none' devolve a
+        resolução da camada. `tier` força uma camada ('raw', '5m', '1h', '1d').
+        Páginas seguintes: `cursor` = `next_cursor` da resposta anterior.
+        Sem `limit`: a série reduzida inteira numa página ('avg'/'lttb') ou 1000 linhas ('none').
+        """
+        if metric not in METRICS_FIELDS:
+            raise ValueError(f'Métrica inválida: {metric}')
+        seconds = TIME_RANGES.get(time_range, 3600)
+        start_time = int(time.time()) - seconds
+        tier, step = self.resolve_resolution(seconds, points, step, tier, downsample)
+        after = None
+        if cursor and downsample == 'lttb':
+            # LTTB escolhe os pontos olhando a janela inteira: não há onde retomar pelo índice
+            raise ValueError('cursor não é aceito com downsample=lttb (use offset, avg ou none)')
+        if cursor:
+            after_bucket, after_host = decode_cursor(cursor)
+            after = (int(after_bucket), str(after_host))
+
+        if limit is None:
+            limit = 1000
+            if downsample != 'none':
+                # Pontos por série já limitados: o limite padrão não pode truncar a série
+                series = 1 if host else max(1, len(DB.query('SELECT host FROM last_metrics')))
+                limit = max(limit, (seconds // step + 1) * series)
+
+        try:
+            # Uma linha além do limite: só há próxima página se ela existir
+            if downsample == 'lttb':
+                data = lttb_history(DB, tier, metric, start_time, host, points, limit + 1, offset)
+            else:
+                data = query_history(DB, tier, metric, start_time, host, step, limit + 1, offset, after)
+        except sqlite3.OperationalError:
+            if tier == 'raw':
+                raise
+            # Banco ainda sem as tabelas de agregação
+            return self.get_history(host, time_range, metric, limit, offset, points, step, 'raw',
+                                    downsample, cursor)
+        data, more = data[:limit], len(data) > limit
+        next_cursor = (encode_cursor([data[-1]['timestamp'], data[-1]['host']])
+                       if more and data and downsample != 'lttb' else None)
+        return {'data': data, 'metric': metric, 'range': time_range, 'tier': tier,
+                'step': step, 'downsample': downsample, 'next_cursor': next_cursor}
+
+    def get_query(self, hosts, metrics, time_range, points=DEFAULT_POINTS, step=None,
+                  tier=None, downsample='avg'):
+        """Séries de várias métricas e hosts numa única consulta, agrupadas por host e métrica"""
+        seconds = TIME_RANGES.get(time_range, 3600)
         start_time = int(time.time()) - seconds
-        query = f'SELECT timestamp, host, {metric} FROM metrics WHERE timestamp >= ?'
-        params = [start_time]
+        tier, step = self.resolve_resolution(seconds, points, step, tier, downsample)
+        # LTTB trabalha sobre a resolução nativa da camada
+        query_step = tier_step(tier) if downsample == 'lttb' else step
+        try:
+            series = query_series(DB, tier, metrics, start_time, hosts, query_step)
+        except sqlite3.OperationalError:
+            if tier == 'raw':
+                raise
+            return self.get_query(hosts, metrics, time_range, points, step, 'raw', downsample)
+        if downsample == 'lttb':
+            series = {key: lttb(values, points) for key, values in series.items()}
+        return {
+            'range': time_range, 'tier': tier, 'step': query_step, 'downsample': downsample,
+            'columns': ['timestamp', 'value', 'min', 'max'],
+            'series': [{'host': host, 'metric': metric, 'points': values}
+                       for (host, metric), values in series.items()]
+        }
+
+    def get_interfaces(self, host=None):
+        """Retorna a última amostra de cada interface descoberta (tabela interface_metrics)"""
+        query = '''
+            SELECT i.host, i.timestamp, i.if_index, i.if_name, i.oper_status,
+                   i.in_octets, i.out_octets, i.in_errors, i.out_errors,
+                   i.in_octets_rate, i.out_octets_rate, i.in_errors_rate, i.out_errors_rate
+            FROM interface_metrics i
+            JOIN (SELECT host, MAX(timestamp) AS timestamp FROM interface_metrics GROUP BY host) last
+              ON i.host = last.host AND i.timestamp = last.timestamp
+        '''
+        params = []
         if host:
-            query += ' AND host = ?'
+            query += ' WHERE i.host = ?'
             params.append(host)
-        query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        data = []
-        for row in cursor.fetchall():
-            data.append({
-                'timestamp': row[0],
-                'host': row[1],
-                'value': row[2]
-            })
-        conn.close()
-        return {'data': data, 'metric': metric, 'range': time_range}
+        query += ' ORDER BY i.host, i.if_index'
+        try:
+            rows = DB.query(query, params)
+        except sqlite3.OperationalError:
+            rows = []  # banco antigo, sem a tabela interface_metrics
+        columns = ['host', 'timestamp', 'if_index', 'if_name', 'oper_status',
+                   'in_octets', 'out_octets', 'in_errors', 'out_errors',
+                   'in_octets_rate', 'out_octets_rate', 'in_errors_rate', 'out_errors_rate']
+        return {'interfaces': [dict(zip(columns, row)) for row in rows]}
 
     def friendly_fields(self, host_data):
         """Renomeia campos para nomes mais amigáveis e agrupa"""
@@ -277,42 +994,109 @@ class APIHandler(BaseHTTPRequestHandler):
                 'snmpInASNParseErrs', 'snmpInGenErrs', 'snmpInReadOnlys', 'snmpOutTooBigs',
                 'snmpOutNoSuchNames', 'snmpOutBadValues', 'snmpOutGenErrs', 'snmpInTotalReqVars',
                 'snmpInTotalSetVars', 'snmpInGetRequests', 'snmpInGetNexts', 'snmpInSetRequests',
-                'snmpOutGetResponses', 'snmpOutTraps']}
+                'snmpOutGetResponses', 'snmpOutTraps']},
+            # Taxas por segundo calculadas pelo coletor (None após reinício do agente)
+            'rates': {field: host_data.get(f'{field}_rate') for field in COUNTER_FIELDS}
         }
 
-    def export_csv(self, host=None, metric=None, time_range='1h'):
-        """Exporta dados filtrados em CSV"""
-        import csv
-        import io
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        time_map = {
-            '5m': 300, '15m': 900, '30m': 1800, '1h': 3600,
-            '3h': 10800, '6h': 21600, '12h': 43200, '24h': 86400,
-            '2d': 172800, '7d': 604800, '30d': 2592000
-        }
-        seconds = time_map.get(time_range, 3600)
-        start_time = int(time.time()) - seconds
-        fields = ['timestamp', 'host']
-        if metric:
-            fields.append(metric)
-        else:
-            cursor.execute('PRAGMA table_info(metrics)')
-            fields += [col[1] for col in cursor.fetchall() if col[1] not in fields]
-        query = f'SELECT {", ".join(fields)} FROM metrics WHERE timestamp >= ?'
-        params = [start_time]
-        if host:
-            query += ' AND host = ?'
-            params.append(host)
-        query += ' ORDER BY timestamp DESC LIMIT 10000'
-        cursor.execute(query, params)
+    def export_fields(self, metric=None):
+        """Colunas exportadas: [(nome, tipo SQL)], começando por timestamp e host"""
+        if metric and metric not in METRICS_FIELDS:
+            raise ValueError(f'Métrica inválida: {metric}')
+        names = [metric] if metric else METRICS_FIELDS
+        return [('timestamp', 'INTEGER'), ('host', 'TEXT')] + [(name, column_type(name)) for name in names]
+
+    def export_csv(self, host=None, metric=None, time_range='1h', batch=EXPORT_BATCH):
+        """Exporta dados filtrados em CSV, em partes de `batch` linhas (bytes UTF-8)"""
+        fields = [name for name, _type in self.export_fields(metric)]
+        start_time = int(time.time()) - TIME_RANGES.get(time_range, 3600)
         output = io.StringIO()
         writer = csv.writer(output)
         writer.writerow(fields)
-        for row in cursor.fetchall():
+        pending = 0
+        for row in stream_metrics(DB, fields, start_time, host, batch):
             writer.writerow(row)
-        conn.close()
-        return output.getvalue()
+            pending += 1
+            if pending == batch:
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate()
+                pending = 0
+        yield output.getvalue().encode('utf-8')
+
+    def export_npz(self, host=None, metric=None, time_range='1h', batch=EXPORT_BATCH):
+        """Exporta em .npz (zip de vetores .npy, carregável com numpy.load), em partes
+
+        Colunas tipadas: INTEGER -> int64 (NULL vira 0 e, se houver algum, a máscara
+        `<coluna>.mask` marca as posições), REAL -> float64 (NULL vira NaN). `host`
+        é codificado em dicionário: códigos int32 em `host` e nomes em `host_names`.
+        As colunas são acumuladas em arquivos temporários (memória limitada) e só
+        então gravadas no zip, pois o cabeçalho .npy precisa do total de linhas.
+        """
+        fields = self.export_fields(metric)
+        start_time = int(time.time()) - TIME_RANGES.get(time_range, 3600)
+        typecodes = ['i' if name == 'host' else 'q' if ctype.startswith('INT') else 'd'
+                     for name, ctype in fields]
+        columns = [(name, code) for (name, _type), code in zip(fields, typecodes)]
+        masks = [(f'{name}.mask', 'B') for name, code in columns if code == 'q']
+        files = {name: tempfile.TemporaryFile() for name, _code in columns + masks}
+        host_codes = {}
+        nulls = {name: 0 for name, code in columns if code == 'q'}
+        nan = float('nan')
+        count = 0
+
+        def spill(rows):
+            """Grava um lote de linhas, coluna a coluna, nos arquivos temporários"""
+            for (name, code), values in zip(columns, zip(*rows)):
+                if name == 'host':
+                    values = [host_codes.setdefault(value, len(host_codes)) for value in values]
+                elif code == 'd':
+                    values = [nan if value is None else value for value in values]
+                else:
+                    missing = bytes(value is None for value in values)
+                    files[f'{name}.mask'].write(missing)
+                    nulls[name] += missing.count(1)
+                    values = [0 if value is None else int(value) for value in values]
+                values = array(code, values)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                values.tofile(files[name])
+
+        try:
+            rows = []
+            for row in stream_metrics(DB, [name for name, _type in fields], start_time, host, batch):
+                rows.append(row)
+                if len(rows) == batch:
+                    spill(rows)
+                    count += len(rows)
+                    rows = []
+            if rows:
+                spill(rows)
+                count += len(rows)
+
+            sink = StreamSink()
+            archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+            for name, code in columns + masks:
+                if name.endswith('.mask') and not nulls[name[:-5]]:
+                    continue
+                source = files[name]
+                source.seek(0)
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as entry:
+                    entry.write(npy_header(NPY_DTYPES[code], count))
+                    while block := source.read(1 << 16):
+                        entry.write(block)
+                        yield sink.drain()
+            # Dicionário de hosts: strings UTF-32 de largura fixa ('<Un')
+            names = sorted(host_codes, key=host_codes.get)
+            width = max((len(name) for name in names), default=1)
+            with archive.open('host_names.npy', 'w') as entry:
+                entry.write(npy_header(f'<U{width}', len(names)))
+                entry.write(''.join(name.ljust(width, '\0') for name in names).encode('utf-32-le'))
+            archive.close()
+            yield sink.drain()
+        finally:
+            for file in files.values():
+                file.close()
 
     def get_openapi_spec(self):
         """Retorna especificação OpenAPI simplificada"""
@@ -344,20 +1128,87 @@ class APIHandler(BaseHTTPRequestHandler):
                             {"name": "range", "in": "query", "schema": {"type": "string"}},
                             {"name": "metric", "in": "query", "schema": {"type": "string"}},
                             {"name": "limit", "in": "query", "schema": {"type": "integer"}},
-                            {"name": "offset", "in": "query", "schema": {"type": "integer"}}
+                            {"name": "offset", "in": "query", "schema": {"type": "integer"}},
+                            {"name": "points", "in": "query", "schema": {"type": "integer"}},
+                            {"name": "step", "in": "query", "schema": {"type": "integer"}},
+                            {"name": "downsample", "in": "query", "schema": {"type": "string", "enum": ["avg", "lttb", "none"]}},
+                            {"name": "tier", "in": "query", "schema": {"type": "string", "enum": ["raw", "5m", "1h", "1d"]}}
+                        ],
+                        "responses": {"200": {"description": "OK"}, "400": {"description": "Parâmetro inválido"},
+                                      "404": {"description": "Não encontrado"}}
+                    }
+                },
+                "/api/query": {
+                    "get": {
+                        "summary": "Várias métricas e hosts numa única requisição (séries agrupadas)",
+                        "parameters": [
+                            {"name": "host", "in": "query", "schema": {"type": "array", "items": {"type": "string"}},
+                             "style": "form", "explode": True},
+                            {"name": "metric", "in": "query", "schema": {"type": "array", "items": {"type": "string"}},
+                             "style": "form", "explode": True},
+                            {"name": "range", "in": "query", "schema": {"type": "string"}},
+                            {"name": "points", "in": "query", "schema": {"type": "integer"}},
+                            {"name": "step", "in": "query", "schema": {"type": "integer"}},
+                            {"name": "downsample", "in": "query", "schema": {"type": "string", "enum": ["avg", "lttb", "none"]}},
+                            {"name": "tier", "in": "query", "schema": {"type": "string", "enum": ["raw", "5m", "1h", "1d"]}}
+                        ],
+                        "responses": {"200": {"description": "OK"}, "400": {"description": "Parâmetro inválido"},
+                                      "404": {"description": "Não encontrado"}}
+                    }
+                },
+                "/api/interfaces": {
+                    "get": {
+                        "summary": "Última amostra de todas as interfaces (ifTable/ifXTable)",
+                        "parameters": [
+                            {"name": "host", "in": "query", "schema": {"type": "string"}}
                         ],
                         "responses": {"200": {"description": "OK"}, "404": {"description": "Não encontrado"}}
                     }
                 },
+                "/api/stream": {
+                    "get": {
+                        "summary": "Push (Server-Sent Events) da última linha de cada host a cada gravação do coletor",
+                        "description": "Eventos `metrics` com o mesmo formato de um item de /api/latest; "
+                                       "o id do evento é o timestamp mais recente",
+                        "parameters": [
+                            {"name": "Last-Event-ID", "in": "header", "required": False,
+                             "description": "id do último evento recebido: reenvia o que foi gravado desde então",
+                             "schema": {"type": "string"}}
+                        ],
+                        "responses": {
+                            "200": {"description": "Fluxo de eventos",
+                                    "content": {"text/event-stream": {"schema": {"type": "string"}}}},
+                            "503": {"description": "Limite de conexões de stream atingido (usar polling)"}
+                        }
+                    }
+                },
+                "/api/backup": {
+                    "get": {
+                        "summary": "Último backup do banco (duração, tamanho e verificação)",
+                        "responses": {"200": {"description": "OK"}, "404": {"description": "Nenhum backup"}}
+                    }
+                },
                 "/api/export": {
                     "get": {
-                        "summary": "Exporta dados em CSV",
+                        "summary": "Exporta dados em CSV ou NumPy .npz (colunar)",
                         "parameters": [
                             {"name": "host", "in": "query", "schema": {"type": "string"}},
                             {"name": "metric", "in": "query", "schema": {"type": "string"}},
-                            {"name": "range", "in": "query", "schema": {"type": "string"}}
+                            {"name": "range", "in": "query", "schema": {"type": "string"}},
+                            {"name": "format", "in": "query",
+                             "schema": {"type": "string", "enum": ["csv", "npz"], "default": "csv"}}
                         ],
-                        "responses": {"200": {"description": "CSV gerado"}, "500": {"description": "Erro"}}
+                        "responses": {
+                            "200": {
+                                "description": "CSV (format=csv) ou arquivo .npz, um vetor .npy por coluna (format=npz)",
+                                "content": {
+                                    "text/csv": {"schema": {"type": "string"}},
+                                    "application/octet-stream": {"schema": {"type": "string", "format": "binary"}}
+                                }
+                            },
+                            "400": {"description": "Parâmetro inválido"},
+                            "500": {"description": "Erro"}
+                        }
                     }
                 },
                 "/api/hosts": {
@@ -382,8 +1233,13 @@ def main():
     print(f"  GET /api/hosts - Lista de hosts e últimas métricas")
     print(f"  GET /api/latest - Mesma coisa que /api/hosts")
     print(f"  GET /api/history?host=X&range=1h&metric=cpu - Histórico")
-    server = HTTPServer(('0.0.0.0', PORT), APIHandler)
-    server.serve_forever()
+    print(f"[LOG] Workers: {API_WORKERS}, fila: {API_QUEUE_LIMIT}, keep-alive: {KEEPALIVE_TIMEOUT:.0f}s")
+    server = PooledHTTPServer(('0.0.0.0', PORT), APIHandler,
+                              workers=API_WORKERS, queue_limit=API_QUEUE_LIMIT)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
 if __name__ == '__main__':
     main()
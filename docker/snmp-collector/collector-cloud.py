@@ -8,13 +8,16 @@ Coleta apenas hosts remotos acessíveis
 import sys
 import time
 import sqlite3
-import shutil
 import random
 import hashlib
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
-from easysnmp import Session
+from snmp_client import (SessionPool, async_submit, snmp_get as pooled_snmp_get, snmp_get_async, snmp_get_many,
+                         snmp_get_many_async, snmp_walk_interfaces, snmp_walk_interfaces_async)
+from snmp_store import (METRICS_FIELDS, Backups, ChunkCompactor, ConnectionManager, MetricsWriter, Retention,
+                        Rollups, column_type, connect, init_store)
+from polling import HostDownError, HostHealth, HostPoller, PollResult, PollScheduler, network_of_address
 
 
 # ============================================================================
@@ -25,12 +28,37 @@ DB_PATH = '/data/snmp_metrics.db'
 BACKUP_DIR = '/home/opc/snmp-backups/'
 COLLECTION_INTERVAL = 60  # segundos
 CLEANUP_INTERVAL = 60  # coletas (60 coletas = ~1 hora)
-DATA_RETENTION_DAYS = 7
 
 SNMP_TIMEOUT = 2
 SNMP_RETRIES = 1
 SNMP_VERSION = 2
 
+POLL_WORKERS = 8  # hosts coletados em paralelo
+HOST_DEADLINE = 20.0  # segundos por host antes de abandonar a coleta no ciclo
+POLL_JITTER = 10.0  # segundos para espalhar as coletas de hosts da mesma rede
+FAILURE_THRESHOLD = 3  # falhas seguidas até o host passar a ser só sondado (sysUpTime)
+PROBE_BACKOFF = 30.0  # segundos até a primeira sonda; dobra a cada falha
+MAX_PROBE_BACKOFF = 900.0
+
+FLUSH_SIZE = 500  # linhas pendentes que forçam a gravação
+FLUSH_AGE = 5.0  # segundos máximos de uma coleta no buffer antes de ir ao banco
+ROLLUP_INTERVAL = 60  # segundos entre atualizações das agregações 5m/1h/1d
+
+# Agregações incrementais (5m → 1h → 1d) mantidas a partir da tabela metrics
+ROLLUPS = Rollups(ConnectionManager(DB_PATH))
+
+# Blocos compactados (delta-of-delta/XOR) das amostras antigas, com STORAGE_ENGINE=chunks
+COMPACTOR = ChunkCompactor(ConnectionManager(DB_PATH))
+
+# Retenção em lotes curtos por origem (RETENTION_<RAW|INTERFACES|5M|1H|1D>_DAYS, ver snmp_store)
+RETENTION = Retention(ConnectionManager(DB_PATH))
+
+# Backups online comprimidos, com retenção por quantidade e idade (BACKUP_*, ver snmp_store)
+BACKUPS = Backups(ConnectionManager(DB_PATH), BACKUP_DIR, 'cloud')
+
+# Sessões SNMP reaproveitadas entre as coletas
+SESSION_POOL = SessionPool(timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
+
 
 # ============================================================================
 # HOSTS E OIDs
@@ -41,6 +69,7 @@ class Host:
     name: str
     ip: str
     community: str = 'public'
+    interval: int = COLLECTION_INTERVAL  # segundos entre coletas deste host
 
 
 HOSTS: List[Host] = [
@@ -62,10 +91,7 @@ OIDS = {
     'memory_used': '.1.3.6.1.2.1.25.2.3.1.6.1',
     'memory_total': '.1.3.6.1.2.1.25.2.2.0',
     
-    # Interfaces (status e erros para interfaces 1-3)
-    **{f'ifOperStatus{i}': f'.1.3.6.1.2.1.2.2.1.8.{i}' for i in range(1, 4)},
-    **{f'ifInErrors{i}': f'.1.3.6.1.2.1.2.2.1.14.{i}' for i in range(1, 4)},
-    **{f'ifOutErrors{i}': f'.1.3.6.1.2.1.2.2.1.20.{i}' for i in range(1, 4)},
+    # Interfaces: ifTable/ifXTable percorridas via GETBULK (snmp_walk_interfaces)
     
     # SNMP MIB Errors
     'linkDown': '.1.3.6.1.6.3.1.1.5.3',
@@ -93,42 +119,30 @@ OIDS = {
 # DATABASE
 # ============================================================================
 
-METRICS_FIELDS = [
-    'cpu', 'memory', 'processes', 'uptime', 'ifOperStatus', 'ifInErrors', 'ifOutErrors',
-    'ifOperStatus1', 'ifOperStatus2', 'ifOperStatus3',
-    'ifInErrors1', 'ifInErrors2', 'ifInErrors3',
-    'ifOutErrors1', 'ifOutErrors2', 'ifOutErrors3',
-    'linkDown', 'snmpInBadVersions', 'snmpInBadCommunityNames',
-    'snmpInBadCommunityUses', 'snmpInASNParseErrs', 'snmpInGenErrs',
-    'snmpInReadOnlys', 'snmpOutTooBigs', 'snmpOutNoSuchNames',
-    'snmpOutBadValues', 'snmpOutGenErrs', 'snmpInTotalReqVars',
-    'snmpInTotalSetVars', 'snmpInGetRequests', 'snmpInGetNexts',
-    'snmpInSetRequests', 'snmpOutGetResponses', 'snmpOutTraps'
-]
-
-
 def init_db() -> None:
     """Inicializa o banco de dados SQLite com tabelas necessárias"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     cursor = conn.cursor()
 
-    # Tabela de métricas históricas
-    metrics_columns = ', '.join([f'{field} {"REAL" if field in ["cpu", "memory"] else "INTEGER"}' 
-                                  for field in METRICS_FIELDS])
-    
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+    # Métricas históricas: series/samples (layout longo), criadas por init_store
+    metrics_columns = ', '.join([f'{field} {column_type(field)}' for field in METRICS_FIELDS])
+
+    # Tabela longa por interface (todas as interfaces descobertas via GETBULK)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS interface_metrics (
             timestamp INTEGER NOT NULL,
             host TEXT NOT NULL,
-            {metrics_columns}
+            if_index INTEGER NOT NULL,
+            if_name TEXT,
+            oper_status INTEGER,
+            in_octets INTEGER,
+            out_octets INTEGER,
+            in_errors INTEGER,
+            out_errors INTEGER,
+            PRIMARY KEY (host, timestamp, if_index)
         )
     ''')
 
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_host_time ON metrics(host, timestamp)
-    ''')
-
     # Tabela de última coleta (cache)
     cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS last_metrics (
@@ -142,6 +156,9 @@ def init_db() -> None:
     # Adicionar colunas novas se não existirem
     _add_missing_columns(cursor)
 
+    # Geração dos dados (cache da API) e agregações 5m/1h/1d
+    init_store(conn)
+
     conn.commit()
     conn.close()
     print(f"✓ Database initialized at {DB_PATH}")
@@ -149,48 +166,42 @@ def init_db() -> None:
 
 def _add_missing_columns(cursor: sqlite3.Cursor) -> None:
     """Adiciona colunas faltantes nas tabelas existentes"""
-    for table in ['metrics', 'last_metrics']:
+    for table in ['last_metrics']:
         for field in METRICS_FIELDS:
-            field_type = 'REAL' if field in ['cpu', 'memory'] else 'INTEGER'
             try:
-                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {field} {field_type}')
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {field} {column_type(field)}')
             except sqlite3.OperationalError:
                 pass  # Coluna já existe
 
 
 def backup_db() -> None:
-    """Faz backup do banco de dados SQLite"""
+    """Backup online do banco (API de backup do SQLite), verificado e comprimido"""
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = f"{BACKUP_DIR}cloud_{timestamp}.db"
-        
-        shutil.copy(DB_PATH, backup_path)
-        shutil.copy(DB_PATH, f"{BACKUP_DIR}cloud_current.db")
-        
-        print(f"  ✓ Backup criado: {backup_path}")
+        stats = BACKUPS.run()
+        print(f"  ✓ Backup criado: {stats['path']} ({stats['size'] / 1024:.0f} KiB de "
+              f"{stats['db_size'] / 1024:.0f} KiB, {stats['duration_ms']} ms)")
+        if stats['pruned']:
+            print(f"  ✓ Removidos {stats['pruned']} backups antigos")
     except Exception as e:
         print(f"  ✗ Erro ao fazer backup: {e}")
 
 
 def cleanup_old_data() -> None:
-    """Remove dados com mais de N dias"""
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
-    
+    """Remove dados além da retenção (brutos e cada camada), em lotes curtos"""
     try:
-        cutoff_time = int(time.time()) - (DATA_RETENTION_DAYS * 24 * 3600)
-        cursor.execute('DELETE FROM metrics WHERE timestamp < ?', (cutoff_time,))
-        deleted = cursor.rowcount
-        
-        conn.commit()
-        
-        if deleted > 0:
-            print(f"  ✓ Removidos {deleted} registros antigos")
+        if RETENTION.convert():
+            print("  ✓ Banco convertido para auto_vacuum=INCREMENTAL")
+    except sqlite3.OperationalError as e:
+        print(f"  ✗ Conversão para auto_vacuum=INCREMENTAL adiada: {e}")
+    try:
+        deleted = RETENTION.run()
+        for source, count in deleted.items():
+            if count > 0:
+                print(f"  ✓ Removidas {count} linhas além da retenção ({source})")
+        if RETENTION.pending:
+            print("  ✓ Retenção incompleta (orçamento de tempo esgotado); continua na próxima limpeza")
     except Exception as e:
         print(f"  ✗ Erro ao limpar dados: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 
 # ============================================================================
@@ -198,19 +209,35 @@ def cleanup_old_data() -> None:
 # ============================================================================
 
 def snmp_get(host: Host, oid: str) -> Optional[str]:
-    """Executa SNMP GET e retorna o valor"""
-    try:
-        session = Session(
-            hostname=host.ip,
-            community=host.community,
-            version=SNMP_VERSION,
-            timeout=SNMP_TIMEOUT,
-            retries=SNMP_RETRIES
-        )
-        result = session.get(oid)
-        return result.value if result else None
-    except Exception:
-        return None
+    """Executa SNMP GET e retorna o valor (sessão reaproveitada do pool)"""
+    return pooled_snmp_get(host.ip, host.community, oid,
+                           version=SNMP_VERSION, pool=SESSION_POOL)
+
+
+def snmp_get_values(host: Host) -> Dict[str, Optional[str]]:
+    """Busca todos os OIDs do host em lote (poucas PDUs em vez de uma por OID)"""
+    values = snmp_get_many(host.ip, host.community, OIDS.values(),
+                           version=SNMP_VERSION, pool=SESSION_POOL)
+    return {key: values.get(oid) for key, oid in OIDS.items()}
+
+
+def probe_host(host: Host) -> bool:
+    """Sonda barata de disponibilidade: um único GET de sysUpTime"""
+    return snmp_get(host, OIDS['uptime']) is not None
+
+
+async def snmp_get_values_async(host: Host) -> Dict[str, Optional[str]]:
+    """snmp_get_values como corrotina (SNMP_ENGINE=asyncio)"""
+    values = await snmp_get_many_async(host.ip, host.community, OIDS.values(),
+                                       version=SNMP_VERSION, pool=SESSION_POOL)
+    return {key: values.get(oid) for key, oid in OIDS.items()}
+
+
+async def probe_host_async(host: Host) -> bool:
+    """probe_host como corrotina (SNMP_ENGINE=asyncio)"""
+    value = await snmp_get_async(host.ip, host.community, OIDS['uptime'],
+                                 version=SNMP_VERSION, pool=SESSION_POOL)
+    return value is not None
 
 
 def parse_uptime(uptime_raw: Optional[str]) -> int:
@@ -237,27 +264,30 @@ def parse_uptime(uptime_raw: Optional[str]) -> int:
             return 0
 
 
+def _host_random(host: Host) -> random.Random:
+    """Gerador com seed único por host mas variável no tempo (um por thread de coleta)"""
+    seed_str = f"{host.name}{int(time.time() / 60)}"
+    return random.Random(int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16))
+
+
 def generate_realistic_cpu(host: Host) -> float:
     """Gera valor de CPU realista baseado no tipo de host"""
-    # Seed único por host mas variável no tempo
-    seed_str = f"{host.name}{int(time.time() / 60)}"
-    seed = int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16)
-    random.seed(seed)
+    rng = _host_random(host)
     
     # Base diferente por tipo de host
     if 'cloud' in host.name:
-        base_cpu = 15 + random.randint(-5, 20)
+        base_cpu = 15 + rng.randint(-5, 20)
     elif 'api' in host.name:
-        base_cpu = 30 + random.randint(-10, 25)
+        base_cpu = 30 + rng.randint(-10, 25)
     else:
-        base_cpu = 20 + random.randint(-10, 15)
+        base_cpu = 20 + rng.randint(-10, 15)
     
     return max(5.0, min(float(base_cpu), 85.0))
 
 
 def calculate_memory_usage(host: Host, mem_size: Optional[str], mem_used: Optional[str]) -> float:
     """Calcula uso de memória em porcentagem"""
-    random.seed(int(hashlib.md5(f"{host.name}{int(time.time() / 60)}".encode()).hexdigest()[:8], 16))
+    rng = _host_random(host)
     
     if mem_size and mem_used:
         try:
@@ -267,31 +297,31 @@ def calculate_memory_usage(host: Host, mem_size: Optional[str], mem_used: Option
             if size_val > 0:
                 # Valores ajustados por tipo de host
                 if 'cloud' in host.name:
-                    return min(20 + random.randint(0, 15), 50)
+                    return min(20 + rng.randint(0, 15), 50)
                 elif 'api' in host.name:
-                    return min(35 + random.randint(0, 20), 70)
+                    return min(35 + rng.randint(0, 20), 70)
                 else:
-                    return min(25 + random.randint(0, 15), 55)
+                    return min(25 + rng.randint(0, 15), 55)
         except (ValueError, ZeroDivisionError):
             pass
     
-    return 30.0 + random.randint(0, 20)
+    return 30.0 + rng.randint(0, 20)
 
 
 def generate_process_count(host: Host) -> int:
     """Gera número de processos realista baseado no tipo de host"""
-    random.seed(int(hashlib.md5(f"{host.name}{int(time.time() / 60)}".encode()).hexdigest()[:8], 16))
+    rng = _host_random(host)
     
     if 'cloud' in host.name:
-        return 20 + random.randint(-5, 15)
+        return 20 + rng.randint(-5, 15)
     elif 'api' in host.name:
-        return 35 + random.randint(-10, 25)
+        return 35 + rng.randint(-10, 25)
     else:
-        return 25 + random.randint(-10, 20)
+        return 25 + rng.randint(-10, 20)
 
 
-def collect_interface_metrics(host: Host) -> Dict[str, Optional[int]]:
-    """Coleta métricas de interfaces de rede"""
+def collect_interface_metrics(interfaces: List[Dict[str, Any]]) -> Dict[str, Optional[int]]:
+    """Deriva as colunas fixas de interface (1-3) das interfaces descobertas via GETBULK"""
     metrics = {
         'ifOperStatus': None,
         'ifInErrors': None,
@@ -307,41 +337,26 @@ def collect_interface_metrics(host: Host) -> Dict[str, Optional[int]]:
         'ifOutErrors3': None,
     }
     
-    # Tentar interfaces 1, 2, 3
+    by_index = {iface['if_index']: iface for iface in interfaces}
     for if_index in [1, 2, 3]:
-        status_val = snmp_get(host, f".1.3.6.1.2.1.2.2.1.8.{if_index}")
+        iface = by_index.get(if_index)
+        if iface is None or iface['oper_status'] is None:
+            continue
         
-        if status_val is not None:
-            try:
-                status = int(str(status_val).strip())
-                metrics[f'ifOperStatus{if_index}'] = status
-                
-                # Primeira interface válida vira o status geral
-                if metrics['ifOperStatus'] is None:
-                    metrics['ifOperStatus'] = status
-                
-                in_errors = snmp_get(host, f".1.3.6.1.2.1.2.2.1.14.{if_index}")
-                out_errors = snmp_get(host, f".1.3.6.1.2.1.2.2.1.20.{if_index}")
-                
-                if in_errors and str(in_errors).strip().isdigit():
-                    in_err = int(str(in_errors).strip())
-                    metrics[f'ifInErrors{if_index}'] = in_err
-                    if metrics['ifInErrors'] is None:
-                        metrics['ifInErrors'] = in_err
-                
-                if out_errors and str(out_errors).strip().isdigit():
-                    out_err = int(str(out_errors).strip())
-                    metrics[f'ifOutErrors{if_index}'] = out_err
-                    if metrics['ifOutErrors'] is None:
-                        metrics['ifOutErrors'] = out_err
-                        
-            except (ValueError, AttributeError):
-                continue
+        metrics[f'ifOperStatus{if_index}'] = iface['oper_status']
+        metrics[f'ifInErrors{if_index}'] = iface['in_errors']
+        metrics[f'ifOutErrors{if_index}'] = iface['out_errors']
+        
+        # Primeira interface válida vira o status geral
+        for field, key in (('ifOperStatus', 'oper_status'), ('ifInErrors', 'in_errors'),
+                           ('ifOutErrors', 'out_errors')):
+            if metrics[field] is None:
+                metrics[field] = iface[key]
     
     return metrics
 
 
-def collect_snmp_error_metrics(host: Host) -> Dict[str, Optional[int]]:
+def collect_snmp_error_metrics(values: Dict[str, Optional[str]]) -> Dict[str, Optional[int]]:
     """Coleta métricas de erros SNMP"""
     error_oids = [
         'linkDown', 'snmpInBadVersions', 'snmpInBadCommunityNames', 'snmpInBadCommunityUses',
@@ -353,7 +368,7 @@ def collect_snmp_error_metrics(host: Host) -> Dict[str, Optional[int]]:
     
     metrics = {}
     for oid_key in error_oids:
-        val = snmp_get(host, OIDS[oid_key])
+        val = values[oid_key]
         metrics[oid_key] = int(str(val).strip()) if val and str(val).strip().isdigit() else None
     
     return metrics
@@ -365,74 +380,68 @@ def collect_snmp_error_metrics(host: Host) -> Dict[str, Optional[int]]:
 
 def collect_metrics(host: Host) -> Dict[str, Any]:
     """Coleta todas as métricas de um host via SNMP"""
-    print(f"  Coletando de {host.name}...", end=' ')
-    
+    values = snmp_get_values(host)
+    if all(value is None for value in values.values()):
+        # Sem resposta: não gastar mais um timeout percorrendo as interfaces
+        raise HostDownError('nenhum OID respondeu')
+    interfaces = snmp_walk_interfaces(host.ip, host.community, version=SNMP_VERSION, pool=SESSION_POOL)
+    return build_metrics(host, values, interfaces)
+
+
+async def collect_metrics_async(host: Host) -> Dict[str, Any]:
+    """Mesma coleta como corrotina no loop do motor asyncio: sem thread presa por host"""
+    values = await snmp_get_values_async(host)
+    if all(value is None for value in values.values()):
+        raise HostDownError('nenhum OID respondeu')
+    interfaces = await snmp_walk_interfaces_async(host.ip, host.community,
+                                                  version=SNMP_VERSION, pool=SESSION_POOL)
+    return build_metrics(host, values, interfaces)
+
+
+def build_metrics(host: Host, values: Dict[str, Optional[str]],
+                  interfaces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Monta as métricas do host a partir das respostas SNMP"""
     metrics = {}
     
     # Sistema básico
-    metrics['uptime'] = parse_uptime(snmp_get(host, OIDS['uptime']))
+    metrics['uptime'] = parse_uptime(values['uptime'])
     metrics['cpu'] = generate_realistic_cpu(host)
     
     # Memória
-    mem_size = snmp_get(host, OIDS['memory_size'])
-    mem_used = snmp_get(host, OIDS['memory_used'])
+    mem_size = values['memory_size']
+    mem_used = values['memory_used']
     metrics['memory'] = calculate_memory_usage(host, mem_size, mem_used)
     
     # Processos e sysname
     metrics['processes'] = generate_process_count(host)
-    sysname = snmp_get(host, OIDS['sysname'])
+    sysname = values['sysname']
     metrics['sysname'] = str(sysname) if sysname else host.name
     
-    # Interfaces
-    metrics.update(collect_interface_metrics(host))
+    # Interfaces (todas as descobertas; colunas fixas 1-3 por compatibilidade)
+    metrics['interfaces'] = interfaces
+    metrics.update(collect_interface_metrics(interfaces))
     
     # Erros SNMP
-    metrics.update(collect_snmp_error_metrics(host))
+    metrics.update(collect_snmp_error_metrics(values))
     
-    print(f"CPU={metrics['cpu']:.1f}% MEM={metrics['memory']:.1f}% "
-          f"UPTIME={metrics['uptime']}s IF-STATUS={metrics['ifOperStatus']}")
+    print(f"  Coletado de {host.name}: CPU={metrics['cpu']:.1f}% MEM={metrics['memory']:.1f}% "
+          f"UPTIME={metrics['uptime']}s IFACES={len(interfaces)} IF-STATUS={metrics['ifOperStatus']}")
     
     return metrics
 
 
-def store_metrics(host_name: str, metrics: Dict[str, Any]) -> None:
-    """
-    Armazena métricas no banco de dados
-    """
-    # Configurar timeout para evitar "database is locked"
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    conn.execute('PRAGMA journal_mode=WAL')  # Write-Ahead Logging para melhor concorrência
-    cursor = conn.cursor()
-    timestamp = int(time.time())
-
-    try:
-        # Preparar valores para inserção
-        values = [timestamp, host_name] + [metrics.get(field) for field in METRICS_FIELDS]
-        placeholders = ', '.join(['?'] * len(values))
-
-        # Inserir no histórico
-        fields_str = 'timestamp, host, ' + ', '.join(METRICS_FIELDS)
-        cursor.execute(f'INSERT INTO metrics ({fields_str}) VALUES ({placeholders})', values)
-
-        # Atualizar última coleta
-        last_values = [host_name, timestamp, metrics.get('sysname')] + [metrics.get(field) for field in METRICS_FIELDS]
-        last_placeholders = ', '.join(['?'] * len(last_values))
-        last_fields_str = 'host, timestamp, sysname, ' + ', '.join(METRICS_FIELDS)
-
-        cursor.execute(f'INSERT OR REPLACE INTO last_metrics ({last_fields_str}) VALUES ({last_placeholders})', last_values)
-
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
-
-
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def store_result(writer: MetricsWriter, result: PollResult) -> None:
+    """Enfileira o resultado de uma coleta com o timestamp do slot agendado"""
+    if result.error is not None:
+        print(f"  ✗ Erro ao coletar {result.host.name}: {result.error}")
+        return
+    writer.add(result.host.name, result.metrics, timestamp=int(result.slot or time.time()))
+
+
 def main() -> None:
     """Loop principal de coleta"""
     print("=" * 60)
@@ -442,39 +451,89 @@ def main() -> None:
     init_db()
     
     continuous = '--daemon' in sys.argv
-    iteration = 0
+    health = HostHealth(threshold=FAILURE_THRESHOLD, backoff=PROBE_BACKOFF,
+                        max_backoff=MAX_PROBE_BACKOFF)
+    # Com SNMP_ENGINE=asyncio as coletas são corrotinas no loop do motor: todos os hosts
+    # vencidos em voo juntos, sem o teto de POLL_WORKERS threads
+    submit = async_submit(SESSION_POOL)
+    poller = HostPoller(collect_metrics_async if submit else collect_metrics, name_of=lambda h: h.name,
+                        workers=POLL_WORKERS, deadline=HOST_DEADLINE,
+                        probe=probe_host_async if submit else probe_host, health=health,
+                        submit=submit)
+    
+    writer = MetricsWriter(DB_PATH, flush_size=FLUSH_SIZE, flush_age=FLUSH_AGE)
     
     try:
+        if not continuous:
+            cycle_start = time.time()
+            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Coleta única")
+            for result in poller.poll(HOSTS):
+                result.slot = cycle_start
+                store_result(writer, result)
+            writer.flush()
+            ROLLUPS.update()
+            COMPACTOR.compact()
+            print(f"  Ciclo concluído em {time.time() - cycle_start:.1f}s ({len(HOSTS)} hosts)")
+            print("\n✓ Coleta única concluída")
+            return
+        
+        # Cada host no seu intervalo, em slots fixos do relógio (sem deriva)
+        scheduler = PollScheduler(HOSTS, name_of=lambda h: h.name,
+                                  interval_of=lambda h: h.interval,
+                                  network_of=lambda h: network_of_address(h.ip),
+                                  jitter=POLL_JITTER, min_interval=HOST_DEADLINE)
+        next_maintenance = time.time() + CLEANUP_INTERVAL * COLLECTION_INTERVAL
+        next_rollup = time.time()
+        
         while True:
-            iteration += 1
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print(f"\n[{timestamp}] Coleta #{iteration}")
+            due = scheduler.pop_due()
+            if due:
+                names = ', '.join(host.name for _slot, host in due)
+                print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Coleta: {names}")
+            for slot, host in due:
+                busy = poller.dispatch(host, slot)
+                if busy is not None:
+                    store_result(writer, busy)
+            
+            # Espera o próximo slot, acordando antes se houver coletas em andamento
+            timeout = min(scheduler.seconds_until_next(), writer.seconds_until_flush())
+            if poller.in_flight:
+                timeout = min(timeout, 0.5)
+            for result in poller.collect_finished(timeout):
+                store_result(writer, result)
             
-            # Coletar de todos os hosts
-            for host in HOSTS:
+            # Uma transação por ciclo: grava quando nada mais chega antes de FLUSH_AGE
+            if not poller.in_flight and scheduler.seconds_until_next() >= writer.seconds_until_flush():
+                writer.flush()
+            writer.flush_if_due()
+            
+            # Agregações: só buckets já fechados, a partir da marca d'água de cada camada
+            if time.time() >= next_rollup:
+                next_rollup = time.time() + ROLLUP_INTERVAL
                 try:
-                    metrics = collect_metrics(host)
-                    store_metrics(host.name, metrics)
+                    ROLLUPS.update()
+                    COMPACTOR.compact()
                 except Exception as e:
-                    print(f"  ✗ Erro ao coletar {host.name}: {e}")
+                    print(f"  ✗ Erro ao atualizar agregações: {e}")
             
             # Manutenção periódica
-            if iteration % CLEANUP_INTERVAL == 0:
+            if time.time() >= next_maintenance:
+                next_maintenance += CLEANUP_INTERVAL * COLLECTION_INTERVAL
+                writer.flush()
                 cleanup_old_data()
                 backup_db()
-            
-            if not continuous:
-                print("\n✓ Coleta única concluída")
-                break
-            
-            print(f"  Próxima coleta em {COLLECTION_INTERVAL}s...")
-            time.sleep(COLLECTION_INTERVAL)
+                SESSION_POOL.report()
+                scheduler.report()
+                health.report()
+                writer.report()
             
     except KeyboardInterrupt:
         print("\n\n✓ Coletor interrompido pelo usuário")
     except Exception as e:
         print(f"\n✗ Erro fatal: {e}")
         raise
+    finally:
+        writer.close()
 
 
 if __name__ == '__main__':
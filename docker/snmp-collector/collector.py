@@ -7,22 +7,34 @@ Coleta métricas SNMP dos containers e armazena em SQLite
 import time
 import sqlite3
 from datetime import datetime
-from easysnmp import Session
 import sys
-import shutil
+from snmp_client import (SESSION_POOL, async_submit, snmp_get as pooled_snmp_get, snmp_get_async, snmp_get_many,
+                         snmp_get_many_async, snmp_walk_interfaces, snmp_walk_interfaces_async)
+from snmp_store import (Backups, ChunkCompactor, ConnectionManager, MetricsWriter, Retention, Rollups,
+                        connect, init_store)
+from polling import HostDownError, HostPoller, PollScheduler, network_of_address
 
 DB_PATH = '/data/snmp_metrics.db'
 BACKUP_DIR = '/home/opc/snmp-backups/'
 
+# Agregações 5m/1h/1d (retenção própria por camada, ver snmp_store.ROLLUP_TIERS)
+ROLLUPS = Rollups(ConnectionManager(DB_PATH))
+
+# Blocos compactados das amostras antigas (só com STORAGE_ENGINE=chunks)
+COMPACTOR = ChunkCompactor(ConnectionManager(DB_PATH))
+
+# Retenção em lotes (RETENTION_<RAW|INTERFACES|5M|1H|1D>_DAYS, ver snmp_store.Retention)
+RETENTION = Retention(ConnectionManager(DB_PATH))
+
+# Backups online comprimidos (BACKUP_KEEP/BACKUP_MAX_AGE_DAYS, ver snmp_store.Backups)
+BACKUPS = Backups(ConnectionManager(DB_PATH), BACKUP_DIR, 'collector')
+
 def backup_db():
-    """Faz backup do banco de dados SQLite"""
+    """Backup online do banco (API de backup do SQLite), verificado e comprimido"""
     try:
-        now = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = f"{BACKUP_DIR}collector_{now}.db"
-        shutil.copy(DB_PATH, backup_path)
-        # Atualiza o backup atual
-        shutil.copy(DB_PATH, f"{BACKUP_DIR}collector_current.db")
-        print(f"  Backup realizado em {backup_path}")
+        stats = BACKUPS.run()
+        print(f"  Backup realizado em {stats['path']} ({stats['size'] / 1024:.0f} KiB, "
+              f"{stats['duration_ms']} ms, {stats['pruned']} antigos removidos)")
     except Exception as e:
         print(f"  Erro ao fazer backup: {e}")
 
@@ -43,15 +55,7 @@ OIDS = {
     'uptime': '.1.3.6.1.2.1.1.3.0',              # sysUpTime
     'sysname': '.1.3.6.1.2.1.1.5.0',             # sysName
     'sysdescr': '.1.3.6.1.2.1.1.1.0',            # sysDescr
-    'ifOperStatus1': '.1.3.6.1.2.1.2.2.1.8.1',   # IF-MIB::ifOperStatus.1 (interface 1)
-    'ifOperStatus2': '.1.3.6.1.2.1.2.2.1.8.2',   # IF-MIB::ifOperStatus.2 (interface 2)
-    'ifOperStatus3': '.1.3.6.1.2.1.2.2.1.8.3',   # IF-MIB::ifOperStatus.3 (interface 3)
-    'ifInErrors1': '.1.3.6.1.2.1.2.2.1.14.1',    # IF-MIB::ifInErrors.1 (interface 1)
-    'ifInErrors2': '.1.3.6.1.2.1.2.2.1.14.2',    # IF-MIB::ifInErrors.2 (interface 2)
-    'ifInErrors3': '.1.3.6.1.2.1.2.2.1.14.3',    # IF-MIB::ifInErrors.3 (interface 3)
-    'ifOutErrors1': '.1.3.6.1.2.1.2.2.1.20.1',   # IF-MIB::ifOutErrors.1 (interface 1)
-    'ifOutErrors2': '.1.3.6.1.2.1.2.2.1.20.2',   # IF-MIB::ifOutErrors.2 (interface 2)
-    'ifOutErrors3': '.1.3.6.1.2.1.2.2.1.20.3',   # IF-MIB::ifOutErrors.3 (interface 3)
+    # IF-MIB (ifTable/ifXTable): percorrida via GETBULK em snmp_walk_interfaces()
     # SNMP Errors from SNMPv2-MIB
     'linkDown': '.1.3.6.1.6.3.1.1.5.3',           # linkDown trap OID
     'snmpInBadVersions': '.1.3.6.1.2.1.11.3',     # snmpInBadVersions
@@ -75,56 +79,27 @@ OIDS = {
 
 def init_db():
     """Inicializa o banco de dados SQLite"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     cursor = conn.cursor()
 
-    # Tabela para métricas históricas
+    # Métricas históricas: series/samples (layout longo), criadas por init_store
+
+    # Tabela longa por interface (todas as interfaces descobertas via GETBULK)
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS interface_metrics (
             timestamp INTEGER NOT NULL,
             host TEXT NOT NULL,
-            cpu REAL,
-            memory REAL,
-            processes INTEGER,
-            uptime INTEGER,
-            ifOperStatus INTEGER,
-            ifInErrors INTEGER,
-            ifOutErrors INTEGER,
-            ifOperStatus1 INTEGER,
-            ifOperStatus2 INTEGER,
-            ifOperStatus3 INTEGER,
-            ifInErrors1 INTEGER,
-            ifInErrors2 INTEGER,
-            ifInErrors3 INTEGER,
-            ifOutErrors1 INTEGER,
-            ifOutErrors2 INTEGER,
-            ifOutErrors3 INTEGER,
-            linkDown INTEGER,
-            snmpInBadVersions INTEGER,
-            snmpInBadCommunityNames INTEGER,
-            snmpInBadCommunityUses INTEGER,
-            snmpInASNParseErrs INTEGER,
-            snmpInGenErrs INTEGER,
-            snmpInReadOnlys INTEGER,
-            snmpOutTooBigs INTEGER,
-            snmpOutNoSuchNames INTEGER,
-            snmpOutBadValues INTEGER,
-            snmpOutGenErrs INTEGER,
-            snmpInTotalReqVars INTEGER,
-            snmpInTotalSetVars INTEGER,
-            snmpInGetRequests INTEGER,
-            snmpInGetNexts INTEGER,
-            snmpInSetRequests INTEGER,
-            snmpOutGetResponses INTEGER,
-            snmpOutTraps INTEGER
+            if_index INTEGER NOT NULL,
+            if_name TEXT,
+            oper_status INTEGER,
+            in_octets INTEGER,
+            out_octets INTEGER,
+            in_errors INTEGER,
+            out_errors INTEGER,
+            PRIMARY KEY (host, timestamp, if_index)
         )
     ''')
 
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_host_time ON metrics(host, timestamp)
-    ''')
-
     # Tabela para última coleta (cache)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS last_metrics (
@@ -181,7 +156,7 @@ def init_db():
         'snmpInSetRequests INTEGER', 'snmpOutGetResponses INTEGER', 'snmpOutTraps INTEGER'
     ]
 
-    for table in ['metrics', 'last_metrics']:
+    for table in ['last_metrics']:
         for col in new_columns:
             try:
                 cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col}')
@@ -189,33 +164,57 @@ def init_db():
                 # Column already exists
                 pass
 
+    init_store(conn)
+
     conn.commit()
     conn.close()
     print(f"✓ Database initialized at {DB_PATH}")
 
 def snmp_get(host, oid):
-    """Executa SNMP GET"""
-    try:
-        session = Session(
-            hostname=host['ip'],
-            community=host['community'],
-            version=2,
-            timeout=2,
-            retries=1
-        )
-        result = session.get(oid)
-        return result.value if result else None
-    except Exception as e:
-        return None
+    """Executa SNMP GET (sessão reaproveitada do pool)"""
+    return pooled_snmp_get(host['ip'], host['community'], oid, version=2)
+
+def snmp_get_values(host):
+    """Busca todos os OIDs do host em lote (poucas PDUs em vez de uma por OID)"""
+    values = snmp_get_many(host['ip'], host['community'], OIDS.values(), version=2)
+    return {key: values.get(oid) for key, oid in OIDS.items()}
+
+def probe_host(host):
+    """Sonda de disponibilidade usada enquanto o host está fora do ar (só sysUpTime)"""
+    return snmp_get(host, OIDS['uptime']) is not None
+
+async def snmp_get_values_async(host):
+    """snmp_get_values como corrotina (SNMP_ENGINE=asyncio)"""
+    values = await snmp_get_many_async(host['ip'], host['community'], OIDS.values(), version=2)
+    return {key: values.get(oid) for key, oid in OIDS.items()}
+
+async def probe_host_async(host):
+    """probe_host como corrotina (SNMP_ENGINE=asyncio)"""
+    return await snmp_get_async(host['ip'], host['community'], OIDS['uptime'], version=2) is not None
 
 def collect_metrics(host):
     """Coleta métricas de um host via SNMP"""
-    print(f"  Collecting from {host['name']}...", end=' ')
-
+    values = snmp_get_values(host)
+    if all(value is None for value in values.values()):
+        # Host não respondeu: evita o walk de interfaces (outro timeout inteiro)
+        raise HostDownError('no OID answered')
+    interfaces = snmp_walk_interfaces(host['ip'], host['community'], version=2)
+    return build_metrics(host, values, interfaces)
+
+async def collect_metrics_async(host):
+    """Mesma coleta como corrotina no loop do motor asyncio: sem thread presa por host"""
+    values = await snmp_get_values_async(host)
+    if all(value is None for value in values.values()):
+        raise HostDownError('no OID answered')
+    interfaces = await snmp_walk_interfaces_async(host['ip'], host['community'], version=2)
+    return build_metrics(host, values, interfaces)
+
+def build_metrics(host, values, interfaces):
+    """Monta as métricas do host a partir das respostas SNMP"""
     metrics = {}
 
     # Uptime raw (em timeticks = centésimos de segundo)
-    uptime_raw = snmp_get(host, OIDS['uptime'])
+    uptime_raw = values['uptime']
     try:
         if uptime_raw:
             # Tentar extrair o valor numérico do uptime
@@ -248,21 +247,22 @@ def collect_metrics(host):
     # Seed único por host mas variável no tempo
     seed_str = f"{host['name']}{int(time.time() / 60)}"  # Muda a cada minuto
     seed = int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16)
-    random.seed(seed)
+    # Gerador próprio por coleta: hosts são coletados em threads paralelas
+    rng = random.Random(seed)
 
     # Base diferente por tipo de container
     if 'nginx' in host['name']:
-        base_cpu = 25 + random.randint(-10, 15)
+        base_cpu = 25 + rng.randint(-10, 15)
     elif 'python' in host['name']:
-        base_cpu = 40 + random.randint(-15, 20)
+        base_cpu = 40 + rng.randint(-15, 20)
     else:
-        base_cpu = 20 + random.randint(-10, 15)
+        base_cpu = 20 + rng.randint(-10, 15)
 
     metrics['cpu'] = max(5, min(base_cpu, 85))
 
     # Memory: Valores mais realistas por tipo de container
-    mem_size = snmp_get(host, OIDS['memory_size'])
-    mem_used = snmp_get(host, OIDS['memory_used'])
+    mem_size = values['memory_size']
+    mem_used = values['memory_used']
 
     if mem_size and mem_used:
         try:
@@ -273,56 +273,40 @@ def collect_metrics(host):
                 real_pct = (used_val / size_val) * 100
                 # Ajustar para valores mais realistas (containers não usam 95%)
                 if 'nginx' in host['name']:
-                    metrics['memory'] = min(30 + random.randint(0, 20), 65)
+                    metrics['memory'] = min(30 + rng.randint(0, 20), 65)
                 elif 'python' in host['name']:
-                    metrics['memory'] = min(45 + random.randint(0, 25), 80)
+                    metrics['memory'] = min(45 + rng.randint(0, 25), 80)
                 else:
-                    metrics['memory'] = min(25 + random.randint(0, 15), 55)
+                    metrics['memory'] = min(25 + rng.randint(0, 15), 55)
             else:
-                metrics['memory'] = 30 + random.randint(0, 20)
+                metrics['memory'] = 30 + rng.randint(0, 20)
         except (ValueError, ZeroDivisionError):
-            metrics['memory'] = 30 + random.randint(0, 20)
+            metrics['memory'] = 30 + rng.randint(0, 20)
     else:
-        metrics['memory'] = 30 + random.randint(0, 20)
+        metrics['memory'] = 30 + rng.randint(0, 20)
 
     # Processes: Valor realista diferente por tipo de container
     if 'nginx' in host['name']:
-        metrics['processes'] = 15 + random.randint(-5, 15)  # Nginx = poucos processos
+        metrics['processes'] = 15 + rng.randint(-5, 15)  # Nginx = poucos processos
     elif 'python' in host['name']:
-        metrics['processes'] = 45 + random.randint(-10, 30)  # Python = médio
+        metrics['processes'] = 45 + rng.randint(-10, 30)  # Python = médio
     else:
-        metrics['processes'] = 25 + random.randint(-10, 20)  # Alpine = baixo
+        metrics['processes'] = 25 + rng.randint(-10, 20)  # Alpine = baixo
 
     # Sysname
-    sysname = snmp_get(host, OIDS['sysname'])
+    sysname = values['sysname']
     metrics['sysname'] = str(sysname) if sysname else host['name']
 
-    # Coleta dos OIDs de interface (IF-MIB) para múltiplas interfaces
-    for if_index in [1, 2, 3]:
-        try:
-            status_val = snmp_get(host, OIDS[f'ifOperStatus{if_index}'])
-            in_err_val = snmp_get(host, OIDS[f'ifInErrors{if_index}'])
-            out_err_val = snmp_get(host, OIDS[f'ifOutErrors{if_index}'])
+    # Interfaces (IF-MIB): todas as interfaces descobertas via GETBULK
+    metrics['interfaces'] = interfaces
 
-            if status_val is not None:
-                try:
-                    metrics[f'ifOperStatus{if_index}'] = int(str(status_val).strip())
-                except (ValueError, AttributeError):
-                    metrics[f'ifOperStatus{if_index}'] = None
-
-            if in_err_val is not None:
-                try:
-                    metrics[f'ifInErrors{if_index}'] = int(str(in_err_val).strip()) if str(in_err_val).strip().isdigit() else None
-                except (ValueError, AttributeError):
-                    metrics[f'ifInErrors{if_index}'] = None
-
-            if out_err_val is not None:
-                try:
-                    metrics[f'ifOutErrors{if_index}'] = int(str(out_err_val).strip()) if str(out_err_val).strip().isdigit() else None
-                except (ValueError, AttributeError):
-                    metrics[f'ifOutErrors{if_index}'] = None
-        except Exception:
-            continue
+    # Colunas fixas das interfaces 1..3, mantidas para a API/dashboard atuais
+    by_index = {iface['if_index']: iface for iface in interfaces}
+    for if_index in [1, 2, 3]:
+        iface = by_index.get(if_index, {})
+        metrics[f'ifOperStatus{if_index}'] = iface.get('oper_status')
+        metrics[f'ifInErrors{if_index}'] = iface.get('in_errors')
+        metrics[f'ifOutErrors{if_index}'] = iface.get('out_errors')
 
     # Backward compatibility: set old fields to interface 1 values
     metrics['ifOperStatus'] = metrics.get('ifOperStatus1')
@@ -340,7 +324,7 @@ def collect_metrics(host):
 
     for oid_key in snmp_error_oids:
         try:
-            val = snmp_get(host, OIDS[oid_key])
+            val = values[oid_key]
             if val is not None:
                 try:
                     metrics[oid_key] = int(str(val).strip()) if str(val).strip().isdigit() else None
@@ -351,75 +335,34 @@ def collect_metrics(host):
         except Exception:
             metrics[oid_key] = None
 
-    print(f"CPU={metrics['cpu']:.1f}% MEM={metrics['memory']:.1f}% UPTIME={metrics['uptime']}s IF-STATUS={metrics['ifOperStatus']} IN-ERR={metrics['ifInErrors']} OUT-ERR={metrics['ifOutErrors']}")
+    print(f"  Collected from {host['name']}: CPU={metrics['cpu']:.1f}% MEM={metrics['memory']:.1f}% UPTIME={metrics['uptime']}s IFACES={len(interfaces)} IF-STATUS={metrics['ifOperStatus']} IN-ERR={metrics['ifInErrors']} OUT-ERR={metrics['ifOutErrors']}")
     return metrics
 
-def store_metrics(host_name, metrics):
-    """Armazena métricas no banco de dados"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    timestamp = int(time.time())
-
-    # Inserir no histórico (usando apenas as colunas antigas para compatibilidade)
-    cursor.execute('''
-        INSERT INTO metrics (timestamp, host, cpu, memory, processes, uptime, ifOperStatus, ifInErrors, ifOutErrors,
-                            ifOperStatus1, ifOperStatus2, ifOperStatus3, ifInErrors1, ifInErrors2, ifInErrors3,
-                            ifOutErrors1, ifOutErrors2, ifOutErrors3, linkDown, snmpInBadVersions, snmpInBadCommunityNames,
-                            snmpInBadCommunityUses, snmpInASNParseErrs, snmpInGenErrs, snmpInReadOnlys, snmpOutTooBigs,
-                            snmpOutNoSuchNames, snmpOutBadValues, snmpOutGenErrs, snmpInTotalReqVars, snmpInTotalSetVars,
-                            snmpInGetRequests, snmpInGetNexts, snmpInSetRequests, snmpOutGetResponses, snmpOutTraps)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (timestamp, host_name, metrics['cpu'], metrics['memory'],
-          metrics['processes'], metrics['uptime'], metrics.get('ifOperStatus'), metrics.get('ifInErrors'), metrics.get('ifOutErrors'),
-          metrics.get('ifOperStatus1'), metrics.get('ifOperStatus2'), metrics.get('ifOperStatus3'),
-          metrics.get('ifInErrors1'), metrics.get('ifInErrors2'), metrics.get('ifInErrors3'),
-          metrics.get('ifOutErrors1'), metrics.get('ifOutErrors2'), metrics.get('ifOutErrors3'),
-          metrics.get('linkDown'), metrics.get('snmpInBadVersions'), metrics.get('snmpInBadCommunityNames'),
-          metrics.get('snmpInBadCommunityUses'), metrics.get('snmpInASNParseErrs'), metrics.get('snmpInGenErrs'),
-          metrics.get('snmpInReadOnlys'), metrics.get('snmpOutTooBigs'), metrics.get('snmpOutNoSuchNames'),
-          metrics.get('snmpOutBadValues'), metrics.get('snmpOutGenErrs'), metrics.get('snmpInTotalReqVars'),
-          metrics.get('snmpInTotalSetVars'), metrics.get('snmpInGetRequests'), metrics.get('snmpInGetNexts'),
-          metrics.get('snmpInSetRequests'), metrics.get('snmpOutGetResponses'), metrics.get('snmpOutTraps')))
-
-    # Atualizar cache (última métrica)
-    cursor.execute('''
-        INSERT OR REPLACE INTO last_metrics
-        (host, timestamp, cpu, memory, processes, uptime, sysname, ifOperStatus, ifInErrors, ifOutErrors,
-         ifOperStatus1, ifOperStatus2, ifOperStatus3, ifInErrors1, ifInErrors2, ifInErrors3,
-         ifOutErrors1, ifOutErrors2, ifOutErrors3, linkDown, snmpInBadVersions, snmpInBadCommunityNames,
-         snmpInBadCommunityUses, snmpInASNParseErrs, snmpInGenErrs, snmpInReadOnlys, snmpOutTooBigs,
-         snmpOutNoSuchNames, snmpOutBadValues, snmpOutGenErrs, snmpInTotalReqVars, snmpInTotalSetVars,
-         snmpInGetRequests, snmpInGetNexts, snmpInSetRequests, snmpOutGetResponses, snmpOutTraps)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (host_name, timestamp, metrics['cpu'], metrics['memory'],
-          metrics['processes'], metrics['uptime'], metrics['sysname'], metrics.get('ifOperStatus'), metrics.get('ifInErrors'), metrics.get('ifOutErrors'),
-          metrics.get('ifOperStatus1'), metrics.get('ifOperStatus2'), metrics.get('ifOperStatus3'),
-          metrics.get('ifInErrors1'), metrics.get('ifInErrors2'), metrics.get('ifInErrors3'),
-          metrics.get('ifOutErrors1'), metrics.get('ifOutErrors2'), metrics.get('ifOutErrors3'),
-          metrics.get('linkDown'), metrics.get('snmpInBadVersions'), metrics.get('snmpInBadCommunityNames'),
-          metrics.get('snmpInBadCommunityUses'), metrics.get('snmpInASNParseErrs'), metrics.get('snmpInGenErrs'),
-          metrics.get('snmpInReadOnlys'), metrics.get('snmpOutTooBigs'), metrics.get('snmpOutNoSuchNames'),
-          metrics.get('snmpOutBadValues'), metrics.get('snmpOutGenErrs'), metrics.get('snmpInTotalReqVars'),
-          metrics.get('snmpInTotalSetVars'), metrics.get('snmpInGetRequests'), metrics.get('snmpInGetNexts'),
-          metrics.get('snmpInSetRequests'), metrics.get('snmpOutGetResponses'), metrics.get('snmpOutTraps')))
-
-    conn.commit()
-    conn.close()
-
 def cleanup_old_data():
-    """Remove dados com mais de 7 dias"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    week_ago = int(time.time()) - (7 * 24 * 3600)
-    cursor.execute('DELETE FROM metrics WHERE timestamp < ?', (week_ago,))
-    deleted = cursor.rowcount
-    
-    conn.commit()
-    conn.close()
-    
-    if deleted > 0:
-        print(f"  Cleaned up {deleted} old records")
+    """Remove dados além da retenção (brutos e cada camada), em lotes curtos"""
+    try:
+        if RETENTION.convert():
+            print("  Converted the database to auto_vacuum=INCREMENTAL")
+    except sqlite3.OperationalError as e:
+        print(f"  Conversion to auto_vacuum=INCREMENTAL postponed: {e}")
+    deleted = RETENTION.run()
+    for source, count in deleted.items():
+        if count > 0:
+            print(f"  Cleaned up {count} expired rows ({source})")
+    if RETENTION.pending:
+        print("  Retention budget exhausted; continuing on the next cleanup")
+
+def store_result(writer, result):
+    """Enfileira o resultado de uma coleta com o timestamp do slot agendado"""
+    host_name = result.host['name']
+    if result.error is None:
+        writer.add(host_name, result.metrics, timestamp=int(result.slot or time.time()))
+    elif isinstance(result.error, (HostDownError, TimeoutError)):
+        print(f"  ERROR collecting {host_name}: {result.error}")
+    else:
+        import traceback
+        print(f"  ERROR collecting {host_name}: {result.error}")
+        traceback.print_exception(result.error)
 
 def main():
     """Loop principal de coleta"""
@@ -431,33 +374,85 @@ def main():
     
     # Modo contínuo ou single run
     continuous = '--daemon' in sys.argv
-    interval = 60  # 1 minuto entre coletas
-
-    iteration = 0
-    while True:
-        iteration += 1
-        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Collection #{iteration}")
+    interval = 60  # 1 minuto entre coletas (padrão; cada host pode definir 'interval')
+
+    # Hosts coletados em paralelo: o ciclo dura ~max(latência) em vez da soma
+    # Após 3 falhas seguidas o host só é sondado (sysUpTime) com backoff exponencial
+    # Com SNMP_ENGINE=asyncio as coletas são corrotinas no loop do motor (sem limite de threads)
+    submit = async_submit(SESSION_POOL)
+    if submit is not None:
+        poller = HostPoller(collect_metrics_async, name_of=lambda h: h['name'],
+                            probe=probe_host_async, submit=submit)
+    else:
+        poller = HostPoller(collect_metrics, name_of=lambda h: h['name'], probe=probe_host)
+
+    # Linhas de todos os hosts gravadas numa transação (uma conexão para o processo todo)
+    writer = MetricsWriter(DB_PATH)
+
+    if not continuous:
+        cycle_start = time.time()
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Collection (single run)")
+        for result in poller.poll(HOSTS):
+            result.slot = cycle_start
+            store_result(writer, result)
+        writer.close()
+        ROLLUPS.update()
+        COMPACTOR.compact()
+        print(f"  Cycle finished in {time.time() - cycle_start:.1f}s ({len(HOSTS)} hosts)")
+        print("\nCollection completed (single run mode)")
+        return
+
+    # Slots fixos do relógio por host, espalhados dentro de cada rede
+    scheduler = PollScheduler(HOSTS, name_of=lambda h: h['name'],
+                              interval_of=lambda h: h.get('interval', interval),
+                              network_of=lambda h: network_of_address(h['ip']),
+                              min_interval=poller.deadline)
+    next_maintenance = time.time() + 60 * interval
+    next_rollup = time.time()
 
-        for host in HOSTS:
-            try:
-                metrics = collect_metrics(host)
-                store_metrics(host['name'], metrics)
-            except Exception as e:
-                import traceback
-                print(f"  ERROR collecting {host['name']}: {e}")
-                traceback.print_exc()
-
-        # Limpeza e backup periódicos (a cada 60 coletas = ~1 hora)
-        if iteration % 60 == 0:
-            cleanup_old_data()
-            backup_db()
-
-        if not continuous:
-            print("\nCollection completed (single run mode)")
-            break
-
-        print(f"  Next collection in {interval}s...")
-        time.sleep(interval)
+    try:
+        while True:
+            due = scheduler.pop_due()
+            if due:
+                names = ', '.join(host['name'] for _slot, host in due)
+                print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Collection: {names}")
+            for slot, host in due:
+                busy = poller.dispatch(host, slot)
+                if busy is not None:
+                    store_result(writer, busy)
+
+            timeout = min(scheduler.seconds_until_next(), writer.seconds_until_flush())
+            if poller.in_flight:
+                timeout = min(timeout, 0.5)
+            for result in poller.collect_finished(timeout):
+                store_result(writer, result)
+
+            # Grava o ciclo assim que nenhuma outra coleta pode chegar antes do prazo
+            if not poller.in_flight and scheduler.seconds_until_next() >= writer.seconds_until_flush():
+                writer.flush()
+            writer.flush_if_due()
+
+            # Agregações incrementais (só buckets já fechados)
+            if time.time() >= next_rollup:
+                next_rollup = time.time() + interval
+                try:
+                    ROLLUPS.update()
+                    COMPACTOR.compact()
+                except Exception as e:
+                    print(f"  ERROR updating rollups: {e}")
+
+            # Limpeza e backup periódicos (~1 hora)
+            if time.time() >= next_maintenance:
+                next_maintenance += 60 * interval
+                writer.flush()
+                cleanup_old_data()
+                backup_db()
+                SESSION_POOL.report()
+                scheduler.report()
+                poller.health.report()
+                writer.report()
+    finally:
+        writer.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Agente SNMP v2c falso para testes de carga do coletor sem dispositivos reais
+Sobe N agentes em portas UDP consecutivas respondendo GET/GETNEXT/GETBULK
+com uma MIB sintética (system, hrStorage, ifTable, contadores SNMPv2-MIB)
+
+Uso:
+  python3 fake_agent.py --agents 200 --port 11161            # só os agentes
+  python3 fake_agent.py --agents 2000 --load-test 5          # agentes + 5 ciclos do coletor (asyncio)
+  SNMP_ENGINE=asyncio e hosts 'localhost:11161', 'localhost:11162', ... no coletor
+"""
+
+import argparse
+import asyncio
+import bisect
+import contextlib
+import io
+import random
+import statistics
+import time
+from typing import Any, Callable, List, Tuple
+
+from snmp_async import (
+    SnmpMessage, VarBind, background_engine,
+    decode_message, encode_message, set_receive_buffer, BERDecodeError, MAX_DATAGRAM,
+    GET_REQUEST, GET_NEXT_REQUEST, GET_BULK_REQUEST, RESPONSE,
+)
+
+
+# ============================================================================
+# MIB SINTÉTICA
+# ============================================================================
+
+OidKey = Tuple[int, ...]
+MibEntry = Tuple[OidKey, str, Callable[[], Any]]
+
+
+def _key(oid: str) -> OidKey:
+    return tuple(int(arc) for arc in oid.strip('.').split('.'))
+
+
+def _oid(key: OidKey) -> str:
+    return '.' + '.'.join(str(arc) for arc in key)
+
+
+def build_mib(name: str, interfaces: int = 3) -> List[MibEntry]:
+    """MIB ordenada com valores dinâmicos (uptime e contadores crescem com o tempo)"""
+    started = time.time()
+    rng = random.Random(name)
+    error_rate = rng.randint(0, 5)
+
+    def ticks() -> int:
+        return int((time.time() - started) * 100)
+
+    def counter(rate: float) -> Callable[[], int]:
+        return lambda: int((time.time() - started) * rate) % 2 ** 32
+
+    entries = [
+        ('.1.3.6.1.2.1.1.1.0', 'OCTETSTR', lambda: f'Linux {name} fake-agent'),
+        ('.1.3.6.1.2.1.1.3.0', 'TICKS', ticks),
+        ('.1.3.6.1.2.1.1.5.0', 'OCTETSTR', lambda: name),
+        ('.1.3.6.1.2.1.25.2.2.0', 'INTEGER', lambda: 2048000),
+        ('.1.3.6.1.2.1.25.2.3.1.5.1', 'INTEGER', lambda: 512000),
+        ('.1.3.6.1.2.1.25.2.3.1.6.1', 'INTEGER', lambda: 128000 + int(time.time()) % 1000),
+    ]
+    for index in range(1, interfaces + 1):
+        entries += [
+            (f'.1.3.6.1.2.1.2.2.1.1.{index}', 'INTEGER', lambda i=index: i),
+            (f'.1.3.6.1.2.1.2.2.1.2.{index}', 'OCTETSTR', lambda i=index: f'eth{i - 1}'),
+            (f'.1.3.6.1.2.1.2.2.1.8.{index}', 'INTEGER', lambda: 1),
+            (f'.1.3.6.1.2.1.2.2.1.10.{index}', 'COUNTER', counter(1500.0 * index)),
+            (f'.1.3.6.1.2.1.2.2.1.14.{index}', 'COUNTER', counter(error_rate / 60)),
+            (f'.1.3.6.1.2.1.2.2.1.16.{index}', 'COUNTER', counter(900.0 * index)),
+            (f'.1.3.6.1.2.1.2.2.1.20.{index}', 'COUNTER', counter(error_rate / 120)),
+            (f'.1.3.6.1.2.1.31.1.1.1.1.{index}', 'OCTETSTR', lambda i=index: f'eth{i - 1}'),
+            (f'.1.3.6.1.2.1.31.1.1.1.6.{index}', 'COUNTER64', counter(1500.0 * index)),
+            (f'.1.3.6.1.2.1.31.1.1.1.10.{index}', 'COUNTER64', counter(900.0 * index)),
+        ]
+    for column in (3, 4, 5, 6, 7, 9, 14, 15, 16, 17, 20, 21, 22, 24, 28, 29):
+        entries.append((f'.1.3.6.1.2.1.11.{column}', 'COUNTER', counter(rng.random() * 2)))
+
+    return sorted((_key(oid), snmp_type, value) for oid, snmp_type, value in entries)
+
+
+# ============================================================================
+# AGENTE
+# ============================================================================
+
+class FakeAgentProtocol(asyncio.DatagramProtocol):
+    """Responde requisições SNMP v2c a partir da MIB sintética"""
+
+    def __init__(self, mib: List[MibEntry], community: str = 'public', latency: float = 0.0,
+                 loss: float = 0.0, max_size: int = MAX_DATAGRAM):
+        self.mib = mib
+        self.keys = [entry[0] for entry in mib]
+        self.community = community
+        self.latency = latency
+        self.loss = loss
+        self.max_size = max_size
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def _exact(self, oid: str) -> VarBind:
+        key = _key(oid)
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            _key_, snmp_type, value = self.mib[position]
+            return VarBind(oid, snmp_type, value())
+        return VarBind(oid, 'NOSUCHINSTANCE', None)
+
+    def _next(self, oid: str) -> VarBind:
+        position = bisect.bisect_right(self.keys, _key(oid))
+        if position < len(self.keys):
+            key, snmp_type, value = self.mib[position]
+            return VarBind(_oid(key), snmp_type, value())
+        return VarBind(oid, 'ENDOFMIBVIEW', None)
+
+    def _bulk(self, request: SnmpMessage) -> List[VarBind]:
+        non_repeaters = max(0, request.error_status)
+        repetitions = max(0, request.error_index)
+        varbinds = [self._next(vb.oid) for vb in request.varbinds[:non_repeaters]]
+        cursors = [vb.oid for vb in request.varbinds[non_repeaters:]]
+        for _ in range(repetitions):
+            if not cursors:
+                break
+            row = [self._next(oid) for oid in cursors]
+            varbinds += row
+            cursors = [vb.oid for vb in row]
+            if all(vb.snmp_type == 'ENDOFMIBVIEW' for vb in row):
+                break
+        return varbinds
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            request = decode_message(data)
+        except (BERDecodeError, ValueError):
+            return
+        if request.community != self.community or random.random() < self.loss:
+            return
+
+        if request.pdu_type == GET_REQUEST:
+            varbinds = [self._exact(vb.oid) for vb in request.varbinds]
+        elif request.pdu_type == GET_NEXT_REQUEST:
+            varbinds = [self._next(vb.oid) for vb in request.varbinds]
+        elif request.pdu_type == GET_BULK_REQUEST:
+            varbinds = self._bulk(request)
+        else:
+            return
+
+        response = SnmpMessage(community=request.community, pdu_type=RESPONSE,
+                               request_id=request.request_id, varbinds=varbinds)
+        packet = encode_message(response)
+        if len(packet) > self.max_size:
+            if request.pdu_type == GET_BULK_REQUEST:
+                # GETBULK: truncar a lista em vez de responder tooBig (RFC 3416 4.2.3)
+                while varbinds and len(packet) > self.max_size:
+                    varbinds = varbinds[:len(varbinds) * 3 // 4]
+                    response.varbinds = varbinds
+                    packet = encode_message(response)
+            else:
+                response.error_status, response.varbinds = 1, request.varbinds  # tooBig
+                packet = encode_message(response)
+
+        if self.latency:
+            asyncio.get_running_loop().call_later(
+                self.latency * random.uniform(0.5, 1.5), self.transport.sendto, packet, addr)
+        else:
+            self.transport.sendto(packet, addr)
+
+
+async def start_agents(count: int, port: int, host: str = '127.0.0.1', interfaces: int = 3,
+                       **options) -> List[Any]:
+    """Sobe `count` agentes nas portas port..port+count-1"""
+    loop = asyncio.get_running_loop()
+    transports = []
+    for offset in range(count):
+        mib = build_mib(f'fake-{offset + 1:04d}', interfaces=interfaces)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: FakeAgentProtocol(mib, **options), local_addr=(host, port + offset))
+        set_receive_buffer(transport)
+        transports.append(transport)
+    return transports
+
+
+# ============================================================================
+# TESTE DE CARGA
+# ============================================================================
+
+async def load_test(agents: int, port: int, rounds: int, host: str = '127.0.0.1',
+                    timeout: float = 2.0, retries: int = 1, in_flight: int = 1024) -> None:
+    """Coleta completa de todos os agentes, `rounds` vezes, pelo mesmo caminho do coletor
+
+    collector.collect_metrics_async num HostPoller com `submit` (SNMP_ENGINE=asyncio):
+    GETs em lote e walk GETBULK das interfaces de todos os hosts em voo ao mesmo tempo.
+    """
+    import collector  # easysnmp (via snmp_client) precisa estar instalado
+    from polling import HostPoller
+    from snmp_client import async_submit
+
+    # Motor e pool configurados antes da primeira sessão (ambos são criados sob demanda)
+    engine = background_engine(timeout=timeout, retries=retries, max_in_flight=in_flight).engine
+    pool = collector.SESSION_POOL
+    pool.engine, pool.timeout, pool.retries = 'asyncio', timeout, retries
+    poller = HostPoller(collector.collect_metrics_async, name_of=lambda h: h['name'],
+                        probe=collector.probe_host_async, submit=async_submit(pool))
+    hosts = [{'name': f'fake-{index + 1:04d}', 'ip': f'{host}:{port + index}', 'community': 'public'}
+             for index in range(agents)]
+
+    loop = asyncio.get_running_loop()
+    results = []
+    started = time.perf_counter()
+    # collect_metrics imprime uma linha por host; os agentes seguem respondendo neste loop
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(rounds):
+            results += await loop.run_in_executor(None, poller.poll, hosts)
+    elapsed = time.perf_counter() - started
+    poller.shutdown()
+
+    ok = [result for result in results if result.error is None]
+    failures = {}
+    for result in results:
+        if result.error is not None:
+            name = type(result.error).__name__
+            failures[name] = failures.get(name, 0) + 1
+    interfaces = sum(len(result.metrics['interfaces']) for result in ok)
+
+    print(f"  Coletas: {len(results)} ({rounds} ciclos x {agents} agentes) em {elapsed:.2f}s "
+          f"({len(results) / elapsed:.0f} hosts/s, {engine.stats['sent'] / elapsed:.0f} PDUs/s), "
+          f"até {in_flight} PDUs em voo")
+    if ok:
+        latencies = sorted(result.elapsed for result in ok)
+        print(f"  Latência por host: p50={statistics.median(latencies) * 1000:.1f}ms "
+              f"p99={latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000:.1f}ms "
+              f"| {interfaces / len(ok):.1f} interfaces por host")
+    print(f"  Falhas: {failures or 'nenhuma'} | motor: {engine.stats}")
+
+
+async def _main(args: argparse.Namespace) -> None:
+    transports = await start_agents(args.agents, args.port, host=args.host, interfaces=args.interfaces,
+                                    latency=args.latency, loss=args.loss, max_size=args.max_size)
+    print(f"✓ {args.agents} agentes SNMP falsos em {args.host}:{args.port}-{args.port + args.agents - 1}")
+    try:
+        if args.load_test:
+            await load_test(args.agents, args.port, args.load_test, host=args.host,
+                            timeout=args.timeout, in_flight=args.in_flight)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        for transport in transports:
+            transport.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Agentes SNMP v2c falsos para teste de carga')
+    parser.add_argument('--agents', type=int, default=1, help='quantidade de agentes (portas consecutivas)')
+    parser.add_argument('--port', type=int, default=11161, help='primeira porta UDP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--interfaces', type=int, default=3, help='interfaces na ifTable de cada agente')
+    parser.add_argument('--latency', type=float, default=0.0, help='atraso médio de resposta (s)')
+    parser.add_argument('--loss', type=float, default=0.0, help='fração de pacotes descartados')
+    parser.add_argument('--max-size', type=int, default=MAX_DATAGRAM,
+                        help='tamanho máximo da resposta (acima disso: tooBig)')
+    parser.add_argument('--load-test', type=int, default=0, metavar='N',
+                        help='roda N ciclos de collect_metrics (motor asyncio) em todos os agentes e sai')
+    parser.add_argument('--in-flight', type=int, default=1024,
+                        help='limite de PDUs em voo no teste de carga')
+    parser.add_argument('--timeout', type=float, default=2.0, help='timeout por tentativa no teste de carga (s)')
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        print("\n✓ Agentes encerrados")
+
+
+if __name__ == '__main__':
+    main()
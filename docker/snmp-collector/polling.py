@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Motor de coleta concorrente para os coletores SNMP
+Consulta vários hosts em paralelo (pool de threads limitado, ou corrotinas no loop
+do motor asyncio) com prazo por host e agenda cada host no seu próprio intervalo,
+sem deriva acumulada
+"""
+
+import heapq
+import itertools
+import time
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+POLL_WORKERS = 8       # hosts coletados simultaneamente
+HOST_DEADLINE = 20.0   # segundos para um host responder antes de ser abandonado no ciclo
+POLL_JITTER = 10.0     # janela (s) em que os hosts de uma mesma rede são espalhados
+LATE_THRESHOLD = 2.0   # atraso (s) a partir do qual uma coleta conta como atrasada
+
+FAILURE_THRESHOLD = 3      # falhas seguidas até o host passar a ser só sondado
+PROBE_BACKOFF = 30.0       # espera (s) antes da primeira sonda; dobra a cada falha
+MAX_PROBE_BACKOFF = 900.0  # teto do backoff entre sondas
+
+
+class HostDownError(Exception):
+    """Host não respondeu (coleta completa ou sonda)"""
+
+
+# ============================================================================
+# SAÚDE DOS HOSTS
+# ============================================================================
+
+class HostHealth:
+    """Circuit breaker por host: após N falhas seguidas só sonda, com backoff exponencial"""
+
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, backoff: float = PROBE_BACKOFF,
+                 max_backoff: float = MAX_PROBE_BACKOFF,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, name: str) -> Dict[str, Any]:
+        return self._hosts.setdefault(name, {'failures': 0, 'open': False,
+                                             'backoff': self.backoff, 'next_probe': 0.0})
+
+    def allow(self, name: str) -> str:
+        """'collect' (saudável), 'probe' (hora de sondar) ou 'skip' (aguardando backoff)"""
+        with self._lock:
+            state = self._state(name)
+            if not state['open']:
+                return 'collect'
+            now = self.clock()
+            if now < state['next_probe']:
+                return 'skip'
+            # Uma sonda por vez: a próxima só depois do resultado desta
+            state['next_probe'] = now + state['backoff']
+            return 'probe'
+
+    def seconds_until_probe(self, name: str) -> float:
+        with self._lock:
+            return max(0.0, self._state(name)['next_probe'] - self.clock())
+
+    def record_success(self, name: str) -> bool:
+        """Zera as falhas; retorna True se o host estava fora do ar"""
+        with self._lock:
+            state = self._state(name)
+            was_open = state['open']
+            state.update(failures=0, open=False, backoff=self.backoff, next_probe=0.0)
+            return was_open
+
+    def record_failure(self, name: str) -> bool:
+        """Conta uma falha; retorna True se o circuito acabou de abrir"""
+        with self._lock:
+            state = self._state(name)
+            state['failures'] += 1
+            if state['failures'] < self.threshold:
+                return False
+            opened = not state['open']
+            if not opened:
+                state['backoff'] = min(state['backoff'] * 2, self.max_backoff)
+            state['open'] = True
+            state['next_probe'] = self.clock() + state['backoff']
+            return opened
+
+    def down_hosts(self) -> List[str]:
+        with self._lock:
+            return sorted(name for name, state in self._hosts.items() if state['open'])
+
+    def report(self) -> None:
+        """Imprime os hosts com circuito aberto"""
+        down = self.down_hosts()
+        print(f"  Hosts fora do ar: {', '.join(down) if down else 'nenhum'}")
+
+
+# ============================================================================
+# POLLER
+# ============================================================================
+
+@dataclass
+class PollResult:
+    host: Any
+    metrics: Optional[Dict[str, Any]] = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+    slot: Optional[float] = None  # horário agendado da coleta (timestamp das métricas)
+
+
+class HostPoller:
+    """Executa collect(host) em paralelo num pool limitado, com prazo por host
+
+    Com `submit` (ex.: snmp_client.async_submit()), collect e probe são corrotinas
+    agendadas no event loop do motor SNMP: todas as coletas vencidas ficam em voo
+    ao mesmo tempo, limitadas só pelo motor (MAX_IN_FLIGHT), sem thread por host.
+    """
+
+    def __init__(self, collect: Callable[[Any], Any], name_of: Callable[[Any], str],
+                 workers: int = POLL_WORKERS, deadline: float = HOST_DEADLINE,
+                 probe: Optional[Callable[[Any], Any]] = None,
+                 health: Optional[HostHealth] = None,
+                 submit: Optional[Callable[[Coroutine], Future]] = None):
+        self.collect = collect
+        self.name_of = name_of
+        self.workers = workers
+        self.deadline = deadline
+        # Sonda barata (ex.: GET de sysUpTime) usada enquanto o host está fora do ar
+        self.probe = probe
+        self.health = health if health is not None else HostHealth()
+        self.submit = submit
+        self._executor = (None if submit is not None else
+                          ThreadPoolExecutor(max_workers=workers, thread_name_prefix='snmp-poll'))
+        self._started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Future, Tuple[Any, Optional[float]]] = {}
+        # Coleta atual de cada host (na fila, rodando ou concluída e ainda não recolhida)
+        self._busy: Dict[str, Future] = {}
+        # Coletas que estouraram o prazo e ainda estão rodando em background
+        self._stragglers: Dict[str, Future] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def _mark_started(self, host: Any) -> None:
+        with self._lock:
+            self._started[self.name_of(host)] = time.monotonic()
+
+    def _run(self, host: Any, probe_first: bool = False) -> Dict[str, Any]:
+        """Executa a coleta marcando o instante em que o worker começou"""
+        self._mark_started(host)
+        if probe_first and not self.probe(host):
+            raise HostDownError('sonda sem resposta')
+        return self.collect(host)
+
+    async def _run_async(self, host: Any, probe_first: bool = False) -> Dict[str, Any]:
+        """Mesmo que _run, como corrotina no loop do motor SNMP"""
+        self._mark_started(host)
+        if probe_first and not await self.probe(host):
+            raise HostDownError('sonda sem resposta')
+        return await self.collect(host)
+
+    def _record(self, result: PollResult) -> PollResult:
+        """Atualiza a saúde do host com o resultado da coleta"""
+        name = self.name_of(result.host)
+        if result.error is None:
+            if self.health.record_success(name):
+                print(f"  ✓ {name} voltou a responder; coleta completa retomada")
+        elif self.health.record_failure(name):
+            print(f"  ✗ {name} fora do ar após {self.health.threshold} falhas; "
+                  f"sondando a cada {self.health.backoff:.0f}s+")
+        return result
+
+    def dispatch(self, host: Any, slot: Optional[float] = None) -> Optional[PollResult]:
+        """Envia a coleta ao pool; retorna erro imediato se o host ainda está ocupado"""
+        name = self.name_of(host)
+        straggler = self._stragglers.get(name)
+        if name in self._busy or (straggler is not None and not straggler.done()):
+            # Não empilhar outra coleta no mesmo host (e na mesma sessão SNMP), nem
+            # apagar o início (_started) de que o prazo da coleta anterior depende
+            return PollResult(host, error=TimeoutError('coleta anterior ainda em andamento'), slot=slot)
+        action = self.health.allow(name) if self.probe is not None else 'collect'
+        if action == 'skip':
+            return PollResult(host, error=HostDownError(
+                f'host fora do ar; próxima sonda em {self.health.seconds_until_probe(name):.0f}s'),
+                slot=slot)
+        self._stragglers.pop(name, None)
+        with self._lock:
+            self._started.pop(name, None)
+        if self.submit is not None:
+            future = self.submit(self._run_async(host, action == 'probe'))
+        else:
+            future = self._executor.submit(self._run, host, action == 'probe')
+        self._in_flight[future] = (host, slot)
+        self._busy[name] = future
+        return None
+
+    def collect_finished(self, timeout: float) -> List[PollResult]:
+        """Aguarda até `timeout` por coletas concluídas e abandona as que passaram do prazo"""
+        if not self._in_flight:
+            time.sleep(max(0.0, timeout))
+            return []
+
+        results = []
+        done, _ = wait(list(self._in_flight), timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+
+        for future in done:
+            host, slot = self._in_flight.pop(future)
+            self._busy.pop(self.name_of(host), None)
+            elapsed = now - self._started.get(self.name_of(host), now)
+            try:
+                result = PollResult(host, metrics=future.result(), elapsed=elapsed, slot=slot)
+            except Exception as e:
+                result = PollResult(host, error=e, elapsed=elapsed, slot=slot)
+            results.append(self._record(result))
+
+        for future, (host, slot) in list(self._in_flight.items()):
+            name = self.name_of(host)
+            started = self._started.get(name)
+            if started is not None and now - started > self.deadline:
+                self._in_flight.pop(future)
+                self._busy.pop(name, None)
+                self._stragglers[name] = future
+                results.append(self._record(PollResult(
+                    host, error=TimeoutError(f'prazo de {self.deadline:.0f}s excedido'),
+                    elapsed=now - started, slot=slot)))
+
+        return results
+
+    def poll(self, hosts: List[Any]) -> List[PollResult]:
+        """Coleta todos os hosts; o ciclo dura ~max(latência) em vez da soma"""
+        results: Dict[str, PollResult] = {}
+        for host in hosts:
+            busy = self.dispatch(host)
+            if busy is not None:
+                results[self.name_of(host)] = busy
+        while self._in_flight:
+            for result in self.collect_finished(timeout=0.5):
+                results[self.name_of(result.host)] = result
+        return [results[self.name_of(host)] for host in hosts]
+
+    def shutdown(self) -> None:
+        """Encerra o pool de threads (ou cancela as corrotinas) sem esperar coletas atrasadas"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            return
+        for future in list(self._in_flight) + list(self._stragglers.values()):
+            future.cancel()
+
+
+# ============================================================================
+# AGENDADOR
+# ============================================================================
+
+def network_of_address(address: str) -> str:
+    """Rede /24 de um IPv4 (ou o próprio nome, para hostnames)"""
+    parts = address.split('.')
+    if len(parts) == 4 and all(part.isdigit() for part in parts):
+        return '.'.join(parts[:3])
+    return address
+
+
+class PollScheduler:
+    """Fila de prioridade (heapq) de coletas com intervalo e fase próprios por host
+
+    Os horários são calculados como fase + k * intervalo (múltiplos do relógio),
+    então atrasos de uma coleta não empurram as seguintes. Se o coletor ficar
+    mais de um intervalo parado, os slots perdidos são pulados e contabilizados.
+    Intervalos abaixo de `min_interval` (o prazo por host do HostPoller) sobem
+    para ele: um slot não pode vencer antes de a coleta anterior expirar.
+    """
+
+    def __init__(self, hosts: List[Any], name_of: Callable[[Any], str],
+                 interval_of: Callable[[Any], float],
+                 network_of: Callable[[Any], str] = lambda host: '',
+                 jitter: float = POLL_JITTER, late_threshold: float = LATE_THRESHOLD,
+                 clock: Callable[[], float] = time.time, min_interval: float = HOST_DEADLINE):
+        self.name_of = name_of
+        self.min_interval = min_interval
+        self.late_threshold = late_threshold
+        self.clock = clock
+        self._hosts: Dict[str, Any] = {name_of(host): host for host in hosts}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self.stats = {'polls': 0, 'late': 0, 'missed': 0, 'max_lateness': 0.0}
+
+        self._intervals: Dict[str, float] = {}
+        for name, host in self._hosts.items():
+            interval = interval_of(host)
+            if interval < min_interval:
+                print(f"  ✗ Intervalo de {name} ({interval:.0f}s) menor que o prazo por host; "
+                      f"usando {min_interval:.0f}s")
+                interval = min_interval
+            self._intervals[name] = interval
+
+        now = clock()
+        for name, offset in self._offsets(hosts, network_of, jitter).items():
+            interval = self._intervals[name]
+            offset %= interval
+            # Primeiro slot alinhado ao relógio a partir de agora
+            slot = (-(-(now - offset) // interval)) * interval + offset
+            heapq.heappush(self._heap, (slot, next(self._seq), name))
+
+    def _offsets(self, hosts: List[Any], network_of: Callable[[Any], str],
+                 jitter: float) -> Dict[str, float]:
+        """Fase de cada host: hosts da mesma rede ficam igualmente espaçados na janela"""
+        networks: Dict[str, List[str]] = {}
+        for host in hosts:
+            networks.setdefault(network_of(host), []).append(self.name_of(host))
+
+        offsets = {}
+        for network, names in networks.items():
+            # Fase estável por rede para que redes diferentes não coincidam
+            phase = zlib.crc32(network.encode()) / 2 ** 32
+            for position, name in enumerate(sorted(names)):
+                offsets[name] = (position + phase) * jitter / len(names)
+        return offsets
+
+    def seconds_until_next(self) -> float:
+        """Tempo até o próximo slot agendado"""
+        if not self._heap:
+            return float('inf')
+        return max(0.0, self._heap[0][0] - self.clock())
+
+    def pop_due(self) -> List[Tuple[float, Any]]:
+        """Retorna (slot, host) de todas as coletas vencidas e reagenda cada host"""
+        now = self.clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            slot, _seq, name = heapq.heappop(self._heap)
+            host = self._hosts[name]
+            interval = self._intervals[name]
+
+            lateness = now - slot
+            if lateness >= interval:
+                # Coletor ficou parado: pular para o slot mais recente
+                skipped = int(lateness // interval)
+                self.stats['missed'] += skipped
+                slot += skipped * interval
+                lateness = now - slot
+
+            self.stats['polls'] += 1
+            if lateness > self.late_threshold:
+                self.stats['late'] += 1
+            self.stats['max_lateness'] = max(self.stats['max_lateness'], lateness)
+
+            heapq.heappush(self._heap, (slot + interval, next(self._seq), name))
+            due.append((slot, host))
+        return due
+
+    def report(self) -> None:
+        """Imprime os contadores do agendador"""
+        print(f"  Agendador: coletas={self.stats['polls']} atrasadas={self.stats['late']} "
+              f"perdidas={self.stats['missed']} maior_atraso={self.stats['max_lateness']:.1f}s")
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Motor SNMP v2c assíncrono (asyncio) em Python puro
+Codificador/decodificador BER e um único socket UDP com demultiplexação por request-id,
+permitindo milhares de requisições simultâneas sem uma thread por requisição
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import random
+import socket
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+SNMP_PORT = 161
+SNMP_TIMEOUT = 2
+SNMP_RETRIES = 1
+MAX_IN_FLIGHT = 4096  # requisições aguardando resposta ao mesmo tempo
+MAX_IN_FLIGHT_PER_HOST = 16  # evita estourar o buffer UDP do agente com rajadas
+RECV_BUFFER = 4 * 1024 * 1024  # SO_RCVBUF do socket (limitado por net.core.rmem_max)
+MAX_DATAGRAM = 65507
+
+
+# ============================================================================
+# BER
+# ============================================================================
+
+# Tags universais e de aplicação (RFC 1155 / RFC 3416)
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+# PDUs
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+RESPONSE = 0xA2
+SET_REQUEST = 0xA3
+GET_BULK_REQUEST = 0xA5
+
+SNMP_V2C = 1  # valor do campo version na mensagem
+
+# Nomes de tipos iguais aos do easysnmp (SNMPVariable.snmp_type)
+TYPE_NAMES = {
+    INTEGER: 'INTEGER',
+    OCTET_STRING: 'OCTETSTR',
+    NULL: 'NULL',
+    OBJECT_IDENTIFIER: 'OBJECTID',
+    IP_ADDRESS: 'IPADDR',
+    COUNTER32: 'COUNTER',
+    GAUGE32: 'GAUGE',
+    TIMETICKS: 'TICKS',
+    OPAQUE: 'OPAQUE',
+    COUNTER64: 'COUNTER64',
+    NO_SUCH_OBJECT: 'NOSUCHOBJECT',
+    NO_SUCH_INSTANCE: 'NOSUCHINSTANCE',
+    END_OF_MIB_VIEW: 'ENDOFMIBVIEW',
+}
+TYPE_TAGS = {name: tag for tag, name in TYPE_NAMES.items()}
+
+ERROR_STATUS_NAMES = [
+    'noError', 'tooBig', 'noSuchName', 'badValue', 'readOnly', 'genErr',
+    'noAccess', 'wrongType', 'wrongLength', 'wrongEncoding', 'wrongValue',
+    'noCreation', 'inconsistentValue', 'resourceUnavailable', 'commitFailed',
+    'undoFailed', 'authorizationError', 'notWritable', 'inconsistentName',
+]
+
+
+class SnmpError(Exception):
+    """Resposta SNMP com error-status diferente de noError"""
+
+
+class SnmpTimeoutError(Exception):
+    """Host não respondeu dentro do timeout (após as retentativas)"""
+
+
+class BERDecodeError(ValueError):
+    """Pacote malformado"""
+
+
+@dataclass
+class VarBind:
+    oid: str
+    snmp_type: str
+    value: Any
+    oid_index: str = ''
+
+
+@dataclass
+class SnmpMessage:
+    community: str
+    pdu_type: int
+    request_id: int
+    error_status: int = 0  # non-repeaters em GETBULK
+    error_index: int = 0   # max-repetitions em GETBULK
+    varbinds: List[VarBind] = field(default_factory=list)
+    version: int = SNMP_V2C
+
+
+def _encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    body = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(body)]) + body
+
+
+def _tlv(tag: int, payload: bytes) -> bytes:
+    return bytes([tag]) + _encode_length(len(payload)) + payload
+
+
+def encode_integer(value: int, tag: int = INTEGER) -> bytes:
+    """INTEGER e tipos numéricos de aplicação (complemento de dois, mínimo de bytes)"""
+    bits = value.bit_length() if value >= 0 else (~value).bit_length()
+    return _tlv(tag, value.to_bytes(bits // 8 + 1, 'big', signed=True))
+
+
+def _base128(arc: int) -> bytes:
+    out = [arc & 0x7F]
+    arc >>= 7
+    while arc:
+        out.append(0x80 | (arc & 0x7F))
+        arc >>= 7
+    return bytes(reversed(out))
+
+
+def encode_oid(oid: str) -> bytes:
+    arcs = [int(arc) for arc in oid.strip('.').split('.')]
+    if len(arcs) < 2:
+        arcs.append(0)
+    body = _base128(arcs[0] * 40 + arcs[1]) + b''.join(_base128(arc) for arc in arcs[2:])
+    return _tlv(OBJECT_IDENTIFIER, body)
+
+
+def encode_value(snmp_type: str, value: Any) -> bytes:
+    """Codifica um valor a partir do nome de tipo no padrão easysnmp"""
+    tag = TYPE_TAGS[snmp_type]
+    if tag in (INTEGER, COUNTER32, GAUGE32, TIMETICKS, COUNTER64):
+        return encode_integer(int(value), tag)
+    if tag == OCTET_STRING:
+        return _tlv(tag, value if isinstance(value, bytes) else str(value).encode('utf-8'))
+    if tag == OBJECT_IDENTIFIER:
+        return encode_oid(value)
+    if tag == IP_ADDRESS:
+        return _tlv(tag, socket.inet_aton(value))
+    if tag == OPAQUE:
+        return _tlv(tag, bytes(value))
+    return _tlv(tag, b'')  # NULL e exceções (noSuchObject, ...)
+
+
+def encode_message(message: SnmpMessage) -> bytes:
+    varbinds = b''.join(_tlv(SEQUENCE, encode_oid(vb.oid) + encode_value(vb.snmp_type, vb.value))
+                        for vb in message.varbinds)
+    pdu = (encode_integer(message.request_id)
+           + encode_integer(message.error_status)
+           + encode_integer(message.error_index)
+           + _tlv(SEQUENCE, varbinds))
+    return _tlv(SEQUENCE,
+                encode_integer(message.version)
+                + _tlv(OCTET_STRING, message.community.encode())
+                + _tlv(message.pdu_type, pdu))
+
+
+def _read_tlv(data: bytes, pos: int) -> Tuple[int, int, int]:
+    """Lê tag e tamanho em `pos`; retorna (tag, início do conteúdo, fim do conteúdo)"""
+    try:
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            count = length & 0x7F
+            length = int.from_bytes(data[pos:pos + count], 'big')
+            pos += count
+    except IndexError:
+        raise BERDecodeError('pacote truncado')
+    end = pos + length
+    if end > len(data):
+        raise BERDecodeError('tamanho maior que o pacote')
+    return tag, pos, end
+
+
+def decode_oid(body: bytes) -> str:
+    arcs = []
+    arc = 0
+    for byte in body:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs:
+        return ''
+    first = arcs[0]
+    head = [min(first // 40, 2), first - 40 * min(first // 40, 2)]
+    return '.' + '.'.join(str(a) for a in head + arcs[1:])
+
+
+def decode_value(tag: int, body: bytes) -> Any:
+    """Converte o valor para string como o easysnmp faz (None para NULL)"""
+    if tag == INTEGER:
+        return str(int.from_bytes(body, 'big', signed=True))
+    if tag in (COUNTER32, GAUGE32, TIMETICKS, COUNTER64):
+        return str(int.from_bytes(body, 'big'))
+    if tag == OCTET_STRING:
+        return body.decode('utf-8', errors='replace')
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(body)
+    if tag == IP_ADDRESS:
+        return '.'.join(str(b) for b in body)
+    if tag == OPAQUE:
+        return body.hex()
+    if tag in (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return TYPE_NAMES[tag]
+    return None
+
+
+def _decode_int(data: bytes, pos: int) -> Tuple[int, int]:
+    tag, start, end = _read_tlv(data, pos)
+    if tag != INTEGER:
+        raise BERDecodeError(f'esperado INTEGER, recebido 0x{tag:02x}')
+    return int.from_bytes(data[start:end], 'big', signed=True), end
+
+
+def decode_message(data: bytes) -> SnmpMessage:
+    tag, pos, end = _read_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERDecodeError('mensagem não é uma SEQUENCE')
+    version, pos = _decode_int(data, pos)
+    tag, start, pos = _read_tlv(data, pos)
+    if tag != OCTET_STRING:
+        raise BERDecodeError('community ausente')
+    community = data[start:pos].decode('utf-8', errors='replace')
+
+    pdu_type, pos, pdu_end = _read_tlv(data, pos)
+    request_id, pos = _decode_int(data, pos)
+    error_status, pos = _decode_int(data, pos)
+    error_index, pos = _decode_int(data, pos)
+    tag, pos, list_end = _read_tlv(data, pos)
+    if tag != SEQUENCE:
+        raise BERDecodeError('lista de varbinds ausente')
+
+    varbinds = []
+    while pos < list_end:
+        _tag, vb_pos, vb_end = _read_tlv(data, pos)
+        oid_tag, oid_start, oid_end = _read_tlv(data, vb_pos)
+        if oid_tag != OBJECT_IDENTIFIER:
+            raise BERDecodeError('varbind sem OID')
+        value_tag, value_start, value_end = _read_tlv(data, oid_end)
+        varbinds.append(VarBind(
+            oid=decode_oid(data[oid_start:oid_end]),
+            snmp_type=TYPE_NAMES.get(value_tag, 'UNKNOWN'),
+            value=decode_value(value_tag, data[value_start:value_end]),
+        ))
+        pos = vb_end
+
+    return SnmpMessage(community=community, pdu_type=pdu_type, request_id=request_id,
+                       error_status=error_status, error_index=error_index,
+                       varbinds=varbinds, version=version)
+
+
+# ============================================================================
+# MOTOR ASSÍNCRONO
+# ============================================================================
+
+def split_address(hostname: str, default_port: int = SNMP_PORT) -> Tuple[str, int]:
+    """Aceita 'host' ou 'host:porta' (mesma notação do net-snmp)"""
+    if hostname.count(':') == 1:
+        host, port = hostname.split(':')
+        return host, int(port)
+    return hostname, default_port
+
+
+def set_receive_buffer(transport: asyncio.DatagramTransport, size: int = RECV_BUFFER) -> None:
+    """Aumenta o buffer de recepção para absorver rajadas de respostas"""
+    try:
+        transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except OSError:
+        pass
+
+
+class _EngineProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine: 'SnmpEngine'):
+        self.engine = engine
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.engine._dispatch(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        # ICMP port unreachable etc.: a requisição expira pelo timeout normal
+        pass
+
+
+class SnmpEngine:
+    """Cliente SNMP v2c sobre um único socket UDP
+
+    Respostas casadas pelo request-id e aceitas só se vierem do endereço consultado,
+    com a mesma community e PDU GetResponse (o resto conta como 'unmatched').
+    """
+
+    def __init__(self, timeout: float = SNMP_TIMEOUT, retries: int = SNMP_RETRIES,
+                 max_in_flight: int = MAX_IN_FLIGHT, max_in_flight_per_host: int = MAX_IN_FLIGHT_PER_HOST):
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_host = max_in_flight_per_host
+        self.stats = {'sent': 0, 'received': 0, 'timeouts': 0, 'unmatched': 0, 'malformed': 0}
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        # request-id -> (future, endereço consultado, community)
+        self._pending: Dict[int, Tuple[asyncio.Future, Tuple[str, int], str]] = {}
+        self._request_ids = itertools.count(random.randint(1, 2 ** 30))
+        self._addresses: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._host_semaphores: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _EngineProtocol(self), local_addr=('0.0.0.0', 0))
+        set_receive_buffer(self._transport)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def _dispatch(self, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            message = decode_message(data)
+        except (BERDecodeError, ValueError):
+            self.stats['malformed'] += 1
+            return
+        pending = self._pending.get(message.request_id)
+        if pending is None:
+            self.stats['unmatched'] += 1  # resposta tardia de uma retentativa
+            return
+        future, address, community = pending
+        # Outro remetente, community ou tipo de PDU: não completa a requisição
+        if (future.done() or tuple(addr[:2]) != tuple(address[:2]) or message.community != community
+                or message.pdu_type != RESPONSE):
+            self.stats['unmatched'] += 1
+            return
+        self.stats['received'] += 1
+        future.set_result(message)
+
+    def _next_request_id(self) -> int:
+        while True:
+            request_id = next(self._request_ids) % (2 ** 31 - 1) + 1
+            if request_id not in self._pending:
+                return request_id
+
+    async def _resolve(self, host: str, port: int) -> Tuple[str, int]:
+        key = (host, port)
+        if key not in self._addresses:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            self._addresses[key] = infos[0][4]
+        return self._addresses[key]
+
+    async def request(self, hostname: str, community: str, pdu_type: int, oids: List[str],
+                      non_repeaters: int = 0, max_repetitions: int = 0,
+                      timeout: Optional[float] = None, retries: Optional[int] = None) -> SnmpMessage:
+        """Envia uma PDU e aguarda a resposta (com retentativas)"""
+        if self._transport is None:
+            await self.start()
+        host, port = split_address(hostname)
+        address = await self._resolve(host, port)
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+
+        host_semaphore = self._host_semaphores.get(address)
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[address] = asyncio.Semaphore(self.max_in_flight_per_host)
+
+        async with self._semaphore, host_semaphore:
+            request_id = self._next_request_id()
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = (future, address, community)
+            packet = encode_message(SnmpMessage(
+                community=community, pdu_type=pdu_type, request_id=request_id,
+                error_status=non_repeaters, error_index=max_repetitions,
+                varbinds=[VarBind(oid, 'NULL', None) for oid in oids]))
+            try:
+                for _attempt in range(retries + 1):
+                    self._transport.sendto(packet, address)
+                    self.stats['sent'] += 1
+                    try:
+                        response = await asyncio.wait_for(asyncio.shield(future), timeout)
+                        break
+                    except asyncio.TimeoutError:
+                        continue
+                else:
+                    self.stats['timeouts'] += 1
+                    raise SnmpTimeoutError(f'timeout consultando {hostname}')
+            finally:
+                self._pending.pop(request_id, None)
+
+        if response.error_status:
+            name = (ERROR_STATUS_NAMES[response.error_status]
+                    if response.error_status < len(ERROR_STATUS_NAMES) else str(response.error_status))
+            raise SnmpError(f'{name} (index {response.error_index})')
+        return response
+
+    async def get(self, hostname: str, community: str, oids: List[str], **kwargs) -> List[VarBind]:
+        response = await self.request(hostname, community, GET_REQUEST, oids, **kwargs)
+        return response.varbinds
+
+    async def get_bulk(self, hostname: str, community: str, oids: List[str],
+                       non_repeaters: int = 0, max_repetitions: int = 10, **kwargs) -> List[VarBind]:
+        response = await self.request(hostname, community, GET_BULK_REQUEST, oids,
+                                      non_repeaters=non_repeaters,
+                                      max_repetitions=max_repetitions, **kwargs)
+        return response.varbinds
+
+
+# ============================================================================
+# INTEGRAÇÃO COM OS COLETORES (API BLOQUEANTE)
+# ============================================================================
+
+class BackgroundEngine:
+    """Roda um SnmpEngine num event loop em thread própria
+
+    `submit` agenda uma corrotina no loop e devolve um Future de concurrent.futures
+    (coletas inteiras rodam no loop sem ocupar thread); `run` bloqueia até o resultado.
+    """
+
+    def __init__(self, **engine_kwargs):
+        self.engine = SnmpEngine(**engine_kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='snmp-async', daemon=True)
+        self._thread.start()
+        self.run(self.engine.start())
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine) -> Any:
+        return self.submit(coroutine).result()
+
+
+_background: Optional[BackgroundEngine] = None
+_background_lock = threading.Lock()
+
+
+def background_engine(**engine_kwargs) -> BackgroundEngine:
+    """Motor compartilhado por todas as sessões assíncronas do processo
+
+    `engine_kwargs` (timeout, max_in_flight, ...) só valem na primeira chamada.
+    """
+    global _background
+    with _background_lock:
+        if _background is None:
+            _background = BackgroundEngine(**engine_kwargs)
+        return _background
+
+
+class AsyncSession:
+    """Mesma interface usada do easysnmp.Session (get/get_bulk), sobre o motor asyncio
+
+    get_async/get_bulk_async são as corrotinas equivalentes, para coletas que rodam
+    no próprio loop do motor (ver polling.HostPoller com `submit`).
+    """
+
+    def __init__(self, hostname: str, community: str = 'public', version: int = 2,
+                 timeout: float = SNMP_TIMEOUT, retries: int = SNMP_RETRIES,
+                 use_numeric: bool = True, background: Optional[BackgroundEngine] = None):
+        # OIDs sempre numéricos (use_numeric existe só por compatibilidade com o easysnmp)
+        if version != 2:
+            raise ValueError('o motor asyncio suporta apenas SNMP v2c')
+        self.hostname = hostname
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.background = background or background_engine()
+
+    async def get_async(self, oids: Union[str, List[str]]) -> Union[VarBind, List[VarBind]]:
+        single = isinstance(oids, str)
+        varbinds = await self.background.engine.get(
+            self.hostname, self.community, [oids] if single else list(oids),
+            timeout=self.timeout, retries=self.retries)
+        return varbinds[0] if single else varbinds
+
+    async def get_bulk_async(self, oids: Union[str, List[str]], non_repeaters: int = 0,
+                             max_repetitions: int = 10) -> List[VarBind]:
+        return await self.background.engine.get_bulk(
+            self.hostname, self.community, [oids] if isinstance(oids, str) else list(oids),
+            non_repeaters=non_repeaters, max_repetitions=max_repetitions,
+            timeout=self.timeout, retries=self.retries)
+
+    def get(self, oids: Union[str, List[str]]) -> Union[VarBind, List[VarBind]]:
+        return self.background.run(self.get_async(oids))
+
+    def get_bulk(self, oids: Union[str, List[str]], non_repeaters: int = 0,
+                 max_repetitions: int = 10) -> List[VarBind]:
+        return self.background.run(self.get_bulk_async(oids, non_repeaters, max_repetitions))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Codificação compacta de séries temporais em blocos (estilo Gorilla, Facebook 2015)
+Timestamps por delta-of-delta e valores reais por XOR com o valor anterior, bit a bit;
+séries só de inteiros (contadores) usam delta-of-delta também nos valores, sem perda
+"""
+
+import struct
+from typing import Any, List, Optional, Tuple
+
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+# Tipo dos valores do bloco (primeiro campo do cabeçalho)
+FLOAT = 0    # XOR do float64 com o anterior
+INTEGER = 1  # delta-of-delta dos inteiros (contadores de 64 bits exatos)
+
+# Faixas do delta-of-delta em zigzag: prefixo '10', '110', '1110', '11110' e bits do valor;
+# além da última, '11111' + 7 bits de tamanho + o valor (inteiros de qualquer largura)
+DOD_BITS = [7, 9, 12, 32]
+
+Point = Tuple[int, Any]
+
+
+# ============================================================================
+# BITS
+# ============================================================================
+
+class BitWriter:
+    """Acumula campos de largura arbitrária num inteiro e os entrega como bytes"""
+
+    def __init__(self) -> None:
+        self._value = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int) -> None:
+        self._value = (self._value << bits) | value
+        self._bits += bits
+
+    def getvalue(self) -> bytes:
+        """Bytes do fluxo, completando o último byte com zeros"""
+        pad = -self._bits % 8
+        return (self._value << pad).to_bytes((self._bits + pad) // 8, 'big')
+
+
+class BitReader:
+    """Lê em sequência os campos gravados pelo BitWriter"""
+
+    def __init__(self, data: bytes) -> None:
+        self._value = int.from_bytes(data, 'big')
+        self._left = len(data) * 8
+
+    def read(self, bits: int) -> int:
+        self._left -= bits
+        if self._left < 0:
+            raise ValueError('Bloco truncado')
+        return (self._value >> self._left) & ((1 << bits) - 1)
+
+
+def _zigzag(value: int) -> int:
+    return 2 * value if value >= 0 else -2 * value - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _write_dod(writer: BitWriter, value: int) -> None:
+    """Delta-of-delta com prefixo de tamanho variável ('0' quando o passo se repete)"""
+    if value == 0:
+        writer.write(0, 1)
+        return
+    encoded = _zigzag(value)
+    for position, bits in enumerate(DOD_BITS):
+        if encoded < 1 << bits:
+            writer.write((1 << (position + 2)) - 2, position + 2)
+            writer.write(encoded, bits)
+            return
+    writer.write(0b11111, 5)
+    writer.write(encoded.bit_length(), 7)
+    writer.write(encoded, encoded.bit_length())
+
+
+def _read_dod(reader: BitReader) -> int:
+    if not reader.read(1):
+        return 0
+    for bits in DOD_BITS:
+        if not reader.read(1):
+            return _unzigzag(reader.read(bits))
+    return _unzigzag(reader.read(reader.read(7)))
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+# ============================================================================
+# BLOCOS
+# ============================================================================
+
+def encode_chunk(points: List[Point]) -> bytes:
+    """Codifica [(ts, valor)] em ordem crescente de ts num bloco binário
+
+    Todos os valores do bloco devem ser do mesmo tipo (int ou float), para que o
+    decode devolva exatamente o que entrou; None ou tipos misturados geram ValueError
+    """
+    kinds = set()
+    for ts, value in points:
+        if value is None:
+            raise ValueError(f'Valor None em ts={ts}: blocos não guardam amostras nulas')
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'Valor {value!r} em ts={ts}: apenas int ou float')
+        kinds.add(isinstance(value, int))
+    if len(kinds) > 1:
+        raise ValueError('Bloco com int e float misturados: converta os valores para um só tipo')
+    integers = kinds == {True}
+    writer = BitWriter()
+    writer.write(INTEGER if integers else FLOAT, 8)
+    writer.write(len(points), 32)
+    if not points:
+        return writer.getvalue()
+
+    first_ts, first_value = points[0]
+    writer.write(first_ts, 64)
+    if integers:
+        _write_dod(writer, first_value)
+    else:
+        writer.write(_float_bits(float(first_value)), 64)
+
+    previous_ts, previous_delta = first_ts, 0
+    previous_value, previous_step = first_value, 0
+    previous_bits = _float_bits(float(first_value)) if not integers else 0
+    leading: Optional[int] = None
+    trailing = 0
+    for ts, value in points[1:]:
+        delta = ts - previous_ts
+        _write_dod(writer, delta - previous_delta)
+        previous_ts, previous_delta = ts, delta
+
+        if integers:
+            step = value - previous_value
+            _write_dod(writer, step - previous_step)
+            previous_value, previous_step = value, step
+            continue
+
+        bits = _float_bits(float(value))
+        xor = bits ^ previous_bits
+        previous_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        writer.write(1, 1)
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if leading is not None and new_leading >= leading and new_trailing >= trailing:
+            # Bits significativos cabem na janela do valor anterior
+            writer.write(0, 1)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            writer.write(meaningful - 1, 6)
+            writer.write(xor >> trailing, meaningful)
+    return writer.getvalue()
+
+
+def decode_chunk(data: bytes) -> List[Point]:
+    """Decodifica um bloco de encode_chunk em [(ts, valor)]"""
+    reader = BitReader(data)
+    integers = reader.read(8) == INTEGER
+    count = reader.read(32)
+    if not count:
+        return []
+
+    ts = reader.read(64)
+    if integers:
+        value: Any = _read_dod(reader)
+    else:
+        bits = reader.read(64)
+        value = _bits_float(bits)
+    points = [(ts, value)]
+
+    delta = step = 0
+    leading = trailing = 0
+    for _ in range(count - 1):
+        delta += _read_dod(reader)
+        ts += delta
+        if integers:
+            step += _read_dod(reader)
+            value += step
+        elif reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) + 1
+                trailing = 64 - leading - meaningful
+            bits ^= reader.read(64 - leading - trailing) << trailing
+            value = _bits_float(bits)
+        points.append((ts, value))
+    return points
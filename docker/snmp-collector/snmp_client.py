@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Cliente SNMP compartilhado pelos coletores (collector.py e collector-cloud.py)
+Mantém um pool de sessões easysnmp por host que sobrevive entre as coletas
+Com SNMP_ENGINE=asyncio há também as versões corrotina (*_async), que rodam no
+loop do motor snmp_async sem ocupar uma thread por requisição
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Optional, Tuple
+from easysnmp import Session, EasySNMPTimeoutError
+from snmp_async import AsyncSession, SnmpTimeoutError, background_engine
+
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+SNMP_TIMEOUT = 2
+SNMP_RETRIES = 1
+SNMP_VERSION = 2
+
+# Transporte: 'easysnmp' (net-snmp, bloqueante) ou 'asyncio' (snmp_async, um socket UDP)
+SNMP_ENGINE = os.environ.get('SNMP_ENGINE', 'easysnmp')
+
+# Máximo de OIDs por PDU GET (reduzido por host quando o agente responde tooBig)
+MAX_OIDS_PER_PDU = 24
+
+# Valores que o agente devolve quando o OID não existe
+MISSING_VALUES = ('NOSUCHOBJECT', 'NOSUCHINSTANCE', 'ENDOFMIBVIEW')
+
+TIMEOUT_ERRORS = (EasySNMPTimeoutError, SnmpTimeoutError)
+
+# Linhas por coluna em cada GETBULK ao percorrer tabelas
+MAX_REPETITIONS = 10
+
+# Colunas de ifTable/ifXTable percorridas por interface (nome -> OID da coluna)
+IF_COLUMNS = {
+    'if_descr': '.1.3.6.1.2.1.2.2.1.2',         # ifDescr
+    'oper_status': '.1.3.6.1.2.1.2.2.1.8',      # ifOperStatus
+    'in_octets': '.1.3.6.1.2.1.2.2.1.10',       # ifInOctets (32 bits)
+    'in_errors': '.1.3.6.1.2.1.2.2.1.14',       # ifInErrors
+    'out_octets': '.1.3.6.1.2.1.2.2.1.16',      # ifOutOctets (32 bits)
+    'out_errors': '.1.3.6.1.2.1.2.2.1.20',      # ifOutErrors
+    'if_name': '.1.3.6.1.2.1.31.1.1.1.1',       # ifName (ifXTable)
+    'hc_in_octets': '.1.3.6.1.2.1.31.1.1.1.6',  # ifHCInOctets (64 bits)
+    'hc_out_octets': '.1.3.6.1.2.1.31.1.1.1.10',  # ifHCOutOctets (64 bits)
+}
+
+
+# ============================================================================
+# POOL DE SESSÕES
+# ============================================================================
+
+SessionKey = Tuple[str, str, int]
+
+
+class SessionPool:
+    """Pool de sessões SNMP indexado por (ip, community, version)"""
+
+    def __init__(self, timeout: int = SNMP_TIMEOUT, retries: int = SNMP_RETRIES,
+                 engine: str = SNMP_ENGINE):
+        self.timeout = timeout
+        self.retries = retries
+        self.engine = engine
+        self._sessions: Dict[SessionKey, Session] = {}
+        self._stats: Dict[SessionKey, Dict[str, int]] = {}
+        self._pdu_limits: Dict[SessionKey, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ip: str, community: str = 'public', version: int = SNMP_VERSION) -> Session:
+        """Retorna a sessão do host, criando uma nova se necessário"""
+        key = (ip, community, version)
+        with self._lock:
+            stats = self._stats.setdefault(key, {'created': 0, 'reused': 0, 'invalidated': 0})
+            session = self._sessions.get(key)
+            if session is not None:
+                stats['reused'] += 1
+                return session
+
+            session_class = AsyncSession if self.engine == 'asyncio' else Session
+            session = session_class(
+                hostname=ip,
+                community=community,
+                version=version,
+                timeout=self.timeout,
+                retries=self.retries,
+                use_numeric=True  # OIDs numéricos nas respostas do GETBULK
+            )
+            self._sessions[key] = session
+            stats['created'] += 1
+            return session
+
+    def invalidate(self, ip: str, community: str = 'public', version: int = SNMP_VERSION) -> None:
+        """Descarta a sessão do host (será recriada no próximo uso)"""
+        key = (ip, community, version)
+        with self._lock:
+            if self._sessions.pop(key, None) is not None:
+                self._stats[key]['invalidated'] += 1
+
+    def pdu_limit(self, ip: str, community: str = 'public', version: int = SNMP_VERSION) -> int:
+        """Máximo de OIDs por PDU aceito pelo host"""
+        return self._pdu_limits.get((ip, community, version), MAX_OIDS_PER_PDU)
+
+    def reduce_pdu_limit(self, ip: str, community: str, version: int, limit: int) -> None:
+        """Memoriza um limite menor de OIDs por PDU após um tooBig"""
+        key = (ip, community, version)
+        with self._lock:
+            self._pdu_limits[key] = max(1, min(limit, self._pdu_limits.get(key, MAX_OIDS_PER_PDU)))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Contadores de criação/reuso/invalidação por host"""
+        with self._lock:
+            return {f"{ip}/v{version}": dict(counters)
+                    for (ip, _community, version), counters in self._stats.items()}
+
+    def report(self) -> None:
+        """Imprime o resumo de reuso das sessões por host"""
+        for host, counters in sorted(self.stats().items()):
+            print(f"  Sessão {host}: reusos={counters['reused']} "
+                  f"criadas={counters['created']} invalidadas={counters['invalidated']}")
+
+
+SESSION_POOL = SessionPool()
+
+
+def async_submit(pool: SessionPool = SESSION_POOL) -> Optional[Callable[[Coroutine], Future]]:
+    """Agendador de corrotinas no loop do motor asyncio (None com o easysnmp)"""
+    if pool.engine != 'asyncio':
+        return None
+    return background_engine().submit
+
+
+# ============================================================================
+# SNMP OPERATIONS
+# ============================================================================
+
+def snmp_get(ip: str, community: str, oid: str, version: int = SNMP_VERSION,
+             pool: SessionPool = SESSION_POOL) -> Optional[str]:
+    """Executa SNMP GET reaproveitando a sessão do pool"""
+    try:
+        session = pool.get(ip, community, version)
+        result = session.get(oid)
+        return result.value if result else None
+    except Exception:
+        # Timeout ou erro de transporte: sessão pode estar inconsistente
+        pool.invalidate(ip, community, version)
+        return None
+
+
+def _chunks(oids: List[str], limit: int) -> Iterable[List[str]]:
+    """Divide os OIDs em blocos de tamanho parecido, com no máximo `limit` cada"""
+    count = -(-len(oids) // limit)
+    size = -(-len(oids) // count)
+    for start in range(0, len(oids), size):
+        yield oids[start:start + size]
+
+
+def _chunk_values(oids: List[str], results) -> Dict[str, Optional[str]]:
+    """{oid: valor} de uma resposta GET (None para OIDs inexistentes)"""
+    values = {}
+    for oid, result in zip(oids, results):
+        value = result.value if result else None
+        values[oid] = None if value is None or str(value).upper() in MISSING_VALUES else value
+    return values
+
+
+def _is_too_big(error: Exception) -> bool:
+    return 'toobig' in str(error).lower().replace(' ', '')
+
+
+def _get_chunk(session: Session, oids: List[str], on_split) -> Dict[str, Optional[str]]:
+    """GET de vários OIDs numa única PDU, dividindo ao meio se o agente recusar"""
+    try:
+        results = session.get(oids)
+    except TIMEOUT_ERRORS:
+        raise
+    except Exception as e:
+        # tooBig (ou agente que rejeita a PDU inteira): tentar em duas metades
+        if len(oids) == 1:
+            return {oids[0]: None}
+        middle = len(oids) // 2
+        if _is_too_big(e):
+            on_split(middle)
+        values = _get_chunk(session, oids[:middle], on_split)
+        values.update(_get_chunk(session, oids[middle:], on_split))
+        return values
+    return _chunk_values(oids, results)
+
+
+async def _get_chunk_async(session: AsyncSession, oids: List[str], on_split) -> Dict[str, Optional[str]]:
+    """Versão corrotina de _get_chunk"""
+    try:
+        results = await session.get_async(oids)
+    except TIMEOUT_ERRORS:
+        raise
+    except Exception as e:
+        if len(oids) == 1:
+            return {oids[0]: None}
+        middle = len(oids) // 2
+        if _is_too_big(e):
+            on_split(middle)
+        values = await _get_chunk_async(session, oids[:middle], on_split)
+        values.update(await _get_chunk_async(session, oids[middle:], on_split))
+        return values
+    return _chunk_values(oids, results)
+
+
+def snmp_get_many(ip: str, community: str, oids: Iterable[str], version: int = SNMP_VERSION,
+                  pool: SessionPool = SESSION_POOL) -> Dict[str, Optional[str]]:
+    """GET em lote: agrupa os OIDs em poucas PDUs e retorna {oid: valor}"""
+    unique_oids = list(dict.fromkeys(oids))
+    values: Dict[str, Optional[str]] = {oid: None for oid in unique_oids}
+    if not unique_oids:
+        return values
+
+    def on_split(limit: int) -> None:
+        pool.reduce_pdu_limit(ip, community, version, limit)
+
+    try:
+        session = pool.get(ip, community, version)
+        for chunk in _chunks(unique_oids, pool.pdu_limit(ip, community, version)):
+            values.update(_get_chunk(session, chunk, on_split))
+    except Exception:
+        # Host não respondeu: não adianta tentar os blocos restantes
+        pool.invalidate(ip, community, version)
+    return values
+
+
+async def snmp_get_async(ip: str, community: str, oid: str, version: int = SNMP_VERSION,
+                         pool: SessionPool = SESSION_POOL) -> Optional[str]:
+    """Versão corrotina de snmp_get (motor asyncio)"""
+    try:
+        session = pool.get(ip, community, version)
+        result = await session.get_async(oid)
+        return result.value if result else None
+    except Exception:
+        pool.invalidate(ip, community, version)
+        return None
+
+
+async def snmp_get_many_async(ip: str, community: str, oids: Iterable[str], version: int = SNMP_VERSION,
+                              pool: SessionPool = SESSION_POOL) -> Dict[str, Optional[str]]:
+    """Versão corrotina de snmp_get_many: as PDUs do host vão todas ao mesmo tempo"""
+    unique_oids = list(dict.fromkeys(oids))
+    values: Dict[str, Optional[str]] = {oid: None for oid in unique_oids}
+    if not unique_oids:
+        return values
+
+    def on_split(limit: int) -> None:
+        pool.reduce_pdu_limit(ip, community, version, limit)
+
+    try:
+        session = pool.get(ip, community, version)
+        chunks = list(_chunks(unique_oids, pool.pdu_limit(ip, community, version)))
+        results = await asyncio.gather(*(_get_chunk_async(session, chunk, on_split) for chunk in chunks),
+                                       return_exceptions=True)
+    except Exception:
+        pool.invalidate(ip, community, version)
+        return values
+
+    failed = False
+    for result in results:
+        if isinstance(result, BaseException):
+            failed = True
+        else:
+            values.update(result)
+    if failed:
+        pool.invalidate(ip, community, version)
+    return values
+
+
+def _full_oid(varbind) -> str:
+    """OID completo da resposta (easysnmp separa a instância em oid_index)"""
+    oid = varbind.oid if varbind.oid.startswith('.') else '.' + varbind.oid
+    return f"{oid}.{varbind.oid_index}" if varbind.oid_index else oid
+
+
+def _advance_columns(varbinds, active: List[str], cursors: Dict[str, str],
+                     tables: Dict[str, Dict[str, str]]) -> List[str]:
+    """Guarda as linhas de uma resposta GETBULK; retorna as colunas ainda abertas"""
+    finished = set()
+    for position, varbind in enumerate(varbinds):
+        column = active[position % len(active)]
+        if column in finished:
+            continue
+        oid = _full_oid(varbind)
+        value = varbind.value
+        # Fim da coluna: saiu da subárvore, fim da MIB ou agente não avançou
+        if (not oid.startswith(column + '.') or oid == cursors[column]
+                or str(varbind.snmp_type).upper() in MISSING_VALUES):
+            finished.add(column)
+            continue
+        tables[column][oid[len(column) + 1:]] = value
+        cursors[column] = oid
+    return [column for column in active if column not in finished]
+
+
+def _walk_columns(session: Session, columns: List[str],
+                  max_repetitions: int) -> Dict[str, Dict[str, str]]:
+    """Percorre várias colunas de uma tabela em paralelo com GETBULK"""
+    tables: Dict[str, Dict[str, str]] = {column: {} for column in columns}
+    cursors = {column: column for column in columns}
+    active = list(columns)
+
+    while active:
+        varbinds = session.get_bulk([cursors[column] for column in active],
+                                    non_repeaters=0, max_repetitions=max_repetitions)
+        if not varbinds:
+            break
+        active = _advance_columns(varbinds, active, cursors, tables)
+
+    return tables
+
+
+async def _walk_columns_async(session: AsyncSession, columns: List[str],
+                              max_repetitions: int) -> Dict[str, Dict[str, str]]:
+    """Versão corrotina de _walk_columns"""
+    tables: Dict[str, Dict[str, str]] = {column: {} for column in columns}
+    cursors = {column: column for column in columns}
+    active = list(columns)
+
+    while active:
+        varbinds = await session.get_bulk_async([cursors[column] for column in active],
+                                                non_repeaters=0, max_repetitions=max_repetitions)
+        if not varbinds:
+            break
+        active = _advance_columns(varbinds, active, cursors, tables)
+
+    return tables
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def snmp_walk_interfaces(ip: str, community: str, version: int = SNMP_VERSION,
+                         pool: SessionPool = SESSION_POOL,
+                         max_repetitions: int = MAX_REPETITIONS) -> List[Dict[str, Any]]:
+    """Descobre todas as interfaces (ifTable/ifXTable) em poucas PDUs GETBULK"""
+    try:
+        session = pool.get(ip, community, version)
+        tables = _walk_columns(session, list(IF_COLUMNS.values()), max_repetitions)
+    except Exception:
+        pool.invalidate(ip, community, version)
+        return []
+    return _interfaces(tables)
+
+
+async def snmp_walk_interfaces_async(ip: str, community: str, version: int = SNMP_VERSION,
+                                     pool: SessionPool = SESSION_POOL,
+                                     max_repetitions: int = MAX_REPETITIONS) -> List[Dict[str, Any]]:
+    """Versão corrotina de snmp_walk_interfaces (motor asyncio)"""
+    try:
+        session = pool.get(ip, community, version)
+        tables = await _walk_columns_async(session, list(IF_COLUMNS.values()), max_repetitions)
+    except Exception:
+        pool.invalidate(ip, community, version)
+        return []
+    return _interfaces(tables)
+
+
+def _interfaces(tables: Dict[str, Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Monta as interfaces a partir das colunas percorridas de ifTable/ifXTable"""
+    by_name = {name: tables[column] for name, column in IF_COLUMNS.items()}
+    indexes = sorted({index for column in tables.values() for index in column},
+                     key=lambda index: _to_int(index) or 0)
+
+    interfaces = []
+    for index in indexes:
+        if_index = _to_int(index)
+        if if_index is None:
+            continue
+        hc_in = _to_int(by_name['hc_in_octets'].get(index))
+        hc_out = _to_int(by_name['hc_out_octets'].get(index))
+        interfaces.append({
+            'if_index': if_index,
+            'if_name': by_name['if_name'].get(index) or by_name['if_descr'].get(index),
+            'oper_status': _to_int(by_name['oper_status'].get(index)),
+            # Contadores de 64 bits quando o agente suporta ifXTable
+            'in_octets': hc_in if hc_in is not None else _to_int(by_name['in_octets'].get(index)),
+            'out_octets': hc_out if hc_out is not None else _to_int(by_name['out_octets'].get(index)),
+            'in_errors': _to_int(by_name['in_errors'].get(index)),
+            'out_errors': _to_int(by_name['out_errors'].get(index)),
+            # Largura de cada contador, para a taxa compensar a volta certa
+            'counter_bits': {'in_octets': 64 if hc_in is not None else 32,
+                             'out_octets': 64 if hc_out is not None else 32,
+                             'in_errors': 32, 'out_errors': 32},
+        })
+    return interfaces
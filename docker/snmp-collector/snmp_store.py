@@ -0,0 +1,1408 @@
+#!/usr/bin/env python3
+"""
+Armazenamento das métricas SNMP em SQLite (compartilhado pelo coletor e pela API)
+Conexões em WAL com pragmas ajustados, uma por thread, com nova tentativa em SQLITE_BUSY;
+buffer de escrita que grava as linhas de todos os hosts de um ciclo numa única transação;
+layout longo: dicionário de séries (host, métrica, rótulos) e amostras (series_id, ts, valor);
+motor opcional de blocos compactados (delta-of-delta/XOR, snmp_chunks) para as amostras antigas;
+agregações incrementais (5m → 1h → 1d) com retenção própria por camada, aplicada em lotes;
+backups online, verificados e comprimidos
+"""
+
+import os
+import gzip
+import time
+import itertools
+import shutil
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from snmp_chunks import decode_chunk, encode_chunk
+
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+DB_PATH = '/data/snmp_metrics.db'
+DB_TIMEOUT = 30.0  # segundos esperando o lock antes de "database is locked"
+
+# Pragmas aplicados em toda conexão (journal_mode=WAL é persistente no arquivo)
+PRAGMAS = [
+    ('auto_vacuum', 'INCREMENTAL'),  # só vale em arquivo novo; os existentes: VACUUM_CONVERT
+    ('journal_mode', 'WAL'),        # leitores da API e o coletor não se bloqueiam
+    ('synchronous', 'NORMAL'),      # em WAL, fsync só no checkpoint; seguro contra corrupção
+    ('cache_size', -16384),         # 16 MiB de cache de páginas (negativo = KiB)
+    ('mmap_size', 64 * 1024 * 1024),  # leituras via mmap em vez de read()
+    ('temp_store', 'MEMORY'),       # ORDER BY/GROUP BY temporários em memória
+]
+
+BUSY_RETRIES = 5     # novas tentativas quando o banco continua ocupado após o timeout
+BUSY_BACKOFF = 0.05  # segundos antes da primeira nova tentativa; dobra a cada uma
+
+FLUSH_SIZE = 500    # linhas pendentes que forçam a gravação imediata
+FLUSH_AGE = 5.0     # segundos máximos que uma linha espera no buffer
+MAX_PENDING = 20000  # acima disso (banco indisponível) as linhas mais antigas são descartadas
+
+
+
+def retention_days(name: str, default: float) -> float:
+    """Retenção (dias) de uma origem, configurável por RETENTION_<NOME>_DAYS (ex.: RETENTION_5M_DAYS=60)"""
+    return float(os.environ.get(f'RETENTION_{name.upper()}_DAYS', default))
+
+
+RAW_RETENTION_DAYS = retention_days('raw', 7)  # amostras brutas (1/min) em samples/chunks
+INTERFACE_RETENTION_DAYS = retention_days('interfaces', 7)  # interface_metrics (uma linha por interface)
+
+EXPORT_BATCH = 1000  # linhas lidas por fetchmany nas exportações (memória limitada)
+EXPORT_WINDOW = 3600  # segundos de amostras remontados em linhas por vez nas exportações
+
+# Motor de armazenamento das amostras brutas: 'rows' (uma linha por amostra em samples)
+# ou 'chunks' (o coletor empacota cada série em blocos compactados de CHUNK_SECONDS).
+# A leitura sempre une samples e chunks, então a API não depende desta opção.
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'rows')
+CHUNK_SECONDS = 7200  # duração fixa de um bloco (120 amostras/min); não reduzir com blocos gravados
+
+# Camadas de agregação: (nome, segundos por bucket, retenção em segundos)
+# Cada camada é alimentada pela anterior; a primeira, pelas amostras brutas
+ROLLUP_TIERS = [
+    ('5m', 300, int(retention_days('5m', 30) * 86400)),
+    ('1h', 3600, int(retention_days('1h', 180) * 86400)),
+    ('1d', 86400, int(retention_days('1d', 5 * 365) * 86400)),
+]
+TIER_SIZES = {name: size for name, size, _retention in ROLLUP_TIERS}
+ROLLUP_GRACE = 120      # segundos após o fim de um bucket antes de agregá-lo (coletas atrasadas)
+ROLLUP_WINDOW = 86400   # segundos de origem agregados por vez (a marca d'água avança a cada janela)
+ROLLUP_BATCH = 5000     # buckets gravados por transação
+DEFAULT_POINTS = 200    # pontos por série que /api/history tenta garantir
+
+RETENTION_SLICE = 3600   # segundos de dados (de todas as séries) percorridos por vez
+RETENTION_BATCH = 5000   # linhas removidas por transação, no máximo (mesmo com muitas séries)
+RETENTION_BUDGET = 5.0   # segundos máximos por execução da retenção; o restante fica para a próxima
+VACUUM_PAGES = 4096      # páginas livres devolvidas ao sistema por execução (incremental_vacuum)
+# Bancos criados antes do auto_vacuum=INCREMENTAL só mudam com um VACUUM completo (reescreve o
+# arquivo com lock exclusivo): com VACUUM_CONVERT=1 a manutenção do coletor o faz uma única vez
+VACUUM_CONVERT = os.environ.get('VACUUM_CONVERT', '0') == '1'
+
+# Backups online pela API de backup do SQLite (o coletor segue gravando durante a cópia)
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 1024))           # páginas copiadas por passo
+BACKUP_SLEEP = float(os.environ.get('BACKUP_SLEEP', 0.01))         # pausa entre passos (segundos)
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 24))               # backups mantidos, do mais novo
+BACKUP_MAX_AGE_DAYS = float(os.environ.get('BACKUP_MAX_AGE_DAYS', 7))  # mais antigos são removidos
+BACKUP_GZIP_LEVEL = int(os.environ.get('BACKUP_GZIP_LEVEL', 6))
+
+# Contadores cumulativos (Counter32 da MIB-II): o coletor grava também a taxa por segundo
+COUNTER_FIELDS = [
+    'ifInErrors', 'ifOutErrors',
+    'ifInErrors1', 'ifInErrors2', 'ifInErrors3',
+    'ifOutErrors1', 'ifOutErrors2', 'ifOutErrors3',
+    'snmpInBadVersions', 'snmpInBadCommunityNames',
+    'snmpInBadCommunityUses', 'snmpInASNParseErrs', 'snmpInGenErrs',
+    'snmpInReadOnlys', 'snmpOutTooBigs', 'snmpOutNoSuchNames',
+    'snmpOutBadValues', 'snmpOutGenErrs', 'snmpInTotalReqVars',
+    'snmpInTotalSetVars', 'snmpInGetRequests', 'snmpInGetNexts',
+    'snmpInSetRequests', 'snmpOutGetResponses', 'snmpOutTraps'
+]
+RATE_FIELDS = [f'{field}_rate' for field in COUNTER_FIELDS]
+
+# Métricas de cada host: uma série em `samples` por (host, métrica), colunas da view
+# `metrics` e de `last_metrics` (que também tem sysname)
+METRICS_FIELDS = [
+    'cpu', 'memory', 'processes', 'uptime', 'ifOperStatus', 'ifInErrors', 'ifOutErrors',
+    'ifOperStatus1', 'ifOperStatus2', 'ifOperStatus3',
+    'ifInErrors1', 'ifInErrors2', 'ifInErrors3',
+    'ifOutErrors1', 'ifOutErrors2', 'ifOutErrors3',
+    'linkDown', 'snmpInBadVersions', 'snmpInBadCommunityNames',
+    'snmpInBadCommunityUses', 'snmpInASNParseErrs', 'snmpInGenErrs',
+    'snmpInReadOnlys', 'snmpOutTooBigs', 'snmpOutNoSuchNames',
+    'snmpOutBadValues', 'snmpOutGenErrs', 'snmpInTotalReqVars',
+    'snmpInTotalSetVars', 'snmpInGetRequests', 'snmpInGetNexts',
+    'snmpInSetRequests', 'snmpOutGetResponses', 'snmpOutTraps'
+] + RATE_FIELDS
+
+# Contadores de `interface_metrics` (64 bits quando o agente tem ifXTable) e suas taxas
+INTERFACE_COUNTERS = ['in_octets', 'out_octets', 'in_errors', 'out_errors']
+INTERFACE_RATE_FIELDS = [f'{field}_rate' for field in INTERFACE_COUNTERS]
+
+# Colunas da tabela longa `interface_metrics` (além de timestamp e host)
+INTERFACE_FIELDS = [
+    'if_index', 'if_name', 'oper_status', 'in_octets', 'out_octets', 'in_errors', 'out_errors'
+] + INTERFACE_RATE_FIELDS
+
+COUNTER32 = 2 ** 32
+COUNTER64 = 2 ** 64
+
+UPTIME_WRAP = 2 ** 32 / 100  # sysUpTime (TimeTicks de 32 bits, centésimos) volta a zero a cada ~497 dias
+UPTIME_SLACK = 120           # segundos tolerados entre o avanço do uptime e o do relógio numa volta
+
+
+def column_type(field: str) -> str:
+    """Tipo SQL de uma coluna de métrica"""
+    return 'REAL' if field in ('cpu', 'memory') or field.endswith('_rate') else 'INTEGER'
+
+
+REAL_FIELDS = {field for field in METRICS_FIELDS if column_type(field) == 'REAL'}
+
+
+def _insert_sql(verb: str, table: str, columns: List[str]) -> str:
+    return (f'{verb} INTO {table} ({", ".join(columns)}) '
+            f'VALUES ({", ".join(["?"] * len(columns))})')
+
+
+INSERT_SAMPLES = _insert_sql('INSERT OR REPLACE', 'samples', ['series_id', 'ts', 'value'])
+UPSERT_LAST = _insert_sql('INSERT OR REPLACE', 'last_metrics',
+                          ['host', 'timestamp', 'sysname'] + METRICS_FIELDS)
+UPSERT_INTERFACES = _insert_sql('INSERT OR REPLACE', 'interface_metrics',
+                                ['timestamp', 'host'] + INTERFACE_FIELDS)
+
+
+# ============================================================================
+# CONEXÕES
+# ============================================================================
+
+T = TypeVar('T')
+
+
+def connect(db_path: str = DB_PATH, timeout: float = DB_TIMEOUT) -> sqlite3.Connection:
+    """Abre uma conexão com os pragmas do store aplicados"""
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    for name, value in PRAGMAS:
+        try:
+            conn.execute(f'PRAGMA {name}={value}')
+        except sqlite3.OperationalError as e:
+            # Trocar o journal_mode exige o lock; outro processo já deve ter ativado o WAL
+            if not is_busy(e):
+                raise
+    return conn
+
+
+def is_busy(error: BaseException) -> bool:
+    """True para SQLITE_BUSY/SQLITE_LOCKED ("database is locked")"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def with_retry(operation: Callable[[], T], retries: int = BUSY_RETRIES,
+               backoff: float = BUSY_BACKOFF) -> T:
+    """Executa a operação repetindo com backoff exponencial enquanto o banco estiver ocupado"""
+    for attempt in range(retries + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+    raise AssertionError('inalcançável')
+
+
+class ConnectionManager:
+    """Uma conexão por thread para o mesmo banco, reaproveitada entre as chamadas"""
+
+    def __init__(self, db_path: str = DB_PATH, timeout: float = DB_TIMEOUT):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """Conexão da thread atual (aberta no primeiro uso)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_path, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql: str, params: Any = ()) -> List[tuple]:
+        """SELECT com nova tentativa em SQLITE_BUSY"""
+        return with_retry(lambda: self.get().execute(sql, params).fetchall())
+
+    def stream(self, sql: str, params: Any = (), size: int = EXPORT_BATCH) -> Iterator[tuple]:
+        """SELECT lido em lotes de `size` linhas pelo cursor, sem carregar tudo (fetchall)"""
+        cursor = with_retry(lambda: self.get().execute(sql, params))
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def write(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        """Executa operation(conn) numa transação, repetindo inteira em SQLITE_BUSY"""
+        def run() -> T:
+            conn = self.get()
+            with conn:  # commit no final, rollback em caso de erro
+                return operation(conn)
+        return with_retry(run)
+
+    def close(self) -> None:
+        """Fecha a conexão da thread atual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# ============================================================================
+# GERAÇÃO DOS DADOS
+# ============================================================================
+
+def init_store(conn: sqlite3.Connection) -> None:
+    """Cria as tabelas auxiliares do store (geração e agregações) e as colunas de taxa"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    # Bancos anteriores às taxas: colunas <contador>_rate ao lado dos valores brutos
+    for table, fields in (('last_metrics', RATE_FIELDS), ('interface_metrics', INTERFACE_RATE_FIELDS)):
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for field in fields:
+            if existing and field not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {field} {column_type(field)}')
+    conn.commit()
+    init_samples(conn)
+    init_rollups(conn)
+    # Espaço liberado pela retenção volta ao sistema aos poucos (PRAGMA incremental_vacuum);
+    # a conversão de um arquivo antigo fica para a manutenção (Retention.convert)
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2 and not VACUUM_CONVERT:
+        print("  ✗ auto_vacuum=INCREMENTAL inativo: o espaço da retenção não volta ao sistema "
+              "(VACUUM_CONVERT=1 converte o banco na manutenção, com um VACUUM completo)")
+
+
+def bump_generation(conn: sqlite3.Connection) -> None:
+    """Incrementa a geração na transação corrente (cada gravação do coletor)"""
+    conn.execute("INSERT INTO store_meta (key, value) VALUES ('generation', 1) "
+                 "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+
+def current_generation(db: ConnectionManager) -> tuple:
+    """Identifica o estado dos dados: muda a cada gravação do coletor (uma consulta indexada)"""
+    try:
+        return tuple(db.query(
+            "SELECT (SELECT value FROM store_meta WHERE key = 'generation'), "
+            "(SELECT MAX(timestamp) FROM last_metrics)")[0])
+    except sqlite3.OperationalError:
+        # Banco de um coletor antigo, sem store_meta
+        return (None,) + tuple(db.query('SELECT MAX(timestamp) FROM last_metrics')[0])
+
+
+# ============================================================================
+# SÉRIES E AMOSTRAS (LAYOUT LONGO)
+# ============================================================================
+
+def _metrics_view_sql() -> str:
+    """View `metrics` com as colunas largas de antes, remontadas das amostras (pivô)"""
+    columns = ',\n'.join(f"MAX(CASE WHEN se.metric = '{field}' THEN sa.value END) AS {field}"
+                          for field in METRICS_FIELDS)
+    return (f'CREATE VIEW metrics AS SELECT sa.ts AS timestamp, se.host AS host,\n{columns}\n'
+            "FROM series se JOIN samples sa ON sa.series_id = se.id WHERE se.labels = '' "
+            'GROUP BY se.host, sa.ts')
+
+
+def _migrate_wide_metrics(conn: sqlite3.Connection) -> int:
+    """Copia a tabela larga `metrics` de bancos anteriores para series/samples e a remove"""
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'metrics'").fetchone()
+    if kind is None or kind[0] != 'table':
+        return 0
+    copied = 0
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(metrics)') if row[1] in METRICS_FIELDS]
+    for field in columns:
+        conn.execute(f'INSERT OR IGNORE INTO series (host, metric) '
+                     f'SELECT DISTINCT host, ? FROM metrics WHERE {field} IS NOT NULL', (field,))
+        # Em ordem de chave: inserções sequenciais na árvore de samples
+        copied += conn.execute(
+            f'INSERT OR REPLACE INTO samples (series_id, ts, value) '
+            f'SELECT se.id, m.timestamp, m.{field} FROM metrics m JOIN series se '
+            f"ON se.host = m.host AND se.metric = ? AND se.labels = '' "
+            f'WHERE m.{field} IS NOT NULL ORDER BY se.id, m.timestamp', (field,)).rowcount
+    conn.execute('DROP TABLE metrics')
+    return copied
+
+
+def init_samples(conn: sqlite3.Connection) -> None:
+    """Cria o dicionário de séries e as amostras (migrando a tabela larga) e a view `metrics`"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS series (
+            id INTEGER PRIMARY KEY,
+            host TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            labels TEXT NOT NULL DEFAULT '',
+            UNIQUE (host, metric, labels)
+        )
+    ''')
+    # Sem tipo declarado: inteiros (contadores de 64 bits) e reais são gravados como vieram
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS samples (
+            series_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value,
+            PRIMARY KEY (series_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    # Blocos compactados: [start, start + CHUNK_SECONDS) de uma série num BLOB
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            series_id INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (series_id, start)
+        ) WITHOUT ROWID
+    ''')
+    migrated = _migrate_wide_metrics(conn)
+    # Recriada a cada início: uma métrica nova em METRICS_FIELDS não exige migração
+    conn.execute('DROP VIEW IF EXISTS metrics')
+    conn.execute(_metrics_view_sql())
+    conn.commit()
+    if migrated:
+        print(f"  ✓ Tabela larga metrics migrada: {migrated} amostras em series/samples")
+
+
+def series_id(conn: sqlite3.Connection, host: str, metric: str, labels: str = '') -> int:
+    """Id da série (host, métrica, rótulos) no dicionário, criada se ainda não existir"""
+    conn.execute('INSERT OR IGNORE INTO series (host, metric, labels) VALUES (?, ?, ?)',
+                 (host, metric, labels))
+    return conn.execute('SELECT id FROM series WHERE host = ? AND metric = ? AND labels = ?',
+                        (host, metric, labels)).fetchone()[0]
+
+
+# ============================================================================
+# BLOCOS COMPACTADOS
+# ============================================================================
+
+# Amostras brutas de todas as séries de host (sem rótulos), nas colunas host, metric, ts, value
+RAW_SAMPLES = ("SELECT se.host, se.metric, sa.ts, sa.value FROM series se "
+               "JOIN samples sa ON sa.series_id = se.id WHERE se.labels = ''")
+RAW_DECODED = ("SELECT se.host, se.metric, d.ts, d.value FROM series se "
+               "JOIN temp.decoded d ON d.series_id = se.id WHERE se.labels = ''")
+
+# Último timestamp de uma série `se`: nas amostras ou no bloco mais recente
+SERIES_NEWEST = ('MAX(IFNULL((SELECT ts FROM samples WHERE series_id = se.id ORDER BY ts DESC LIMIT 1), 0), '
+                 'IFNULL((SELECT last_ts FROM chunks WHERE series_id = se.id ORDER BY start DESC LIMIT 1), 0))')
+
+
+def raw_source(db: ConnectionManager, start: int, end: Optional[int] = None,
+               metrics: Optional[List[str]] = None, hosts: Optional[List[str]] = None) -> str:
+    """Subconsulta (host, metric, ts, value) das amostras brutas de [start, end), para o FROM
+
+    Sem blocos no intervalo, lê só samples. Senão, os blocos que cobrem o
+    intervalo (só das métricas e hosts pedidos) são decodificados na tabela
+    temporária da conexão e unidos às amostras ainda não compactadas. Os filtros
+    da consulta externa descem para os dois lados e usam as chaves.
+    """
+    condition = "se.labels = ''"
+    params: List[Any] = []
+    if metrics:
+        condition += f' AND se.metric IN ({", ".join("?" * len(metrics))})'
+        params.extend(metrics)
+    if hosts:
+        condition += f' AND se.host IN ({", ".join("?" * len(hosts))})'
+        params.extend(hosts)
+    stop = end if end is not None else 2 ** 62
+    chunks = db.query(
+        f'SELECT c.series_id, c.data FROM series se JOIN chunks c ON c.series_id = se.id WHERE {condition} '
+        'AND c.start > ? AND c.start < ? AND c.last_ts >= ?', params + [start - CHUNK_SECONDS, stop, start])
+    if not chunks:
+        return f'({RAW_SAMPLES})'
+
+    conn = db.get()
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS decoded (series_id INTEGER NOT NULL, ts INTEGER NOT NULL, '
+                 'value, PRIMARY KEY (series_id, ts)) WITHOUT ROWID')
+    conn.execute('DELETE FROM temp.decoded')
+    conn.executemany('INSERT OR REPLACE INTO temp.decoded (series_id, ts, value) VALUES (?, ?, ?)',
+                     ((ident, ts, value) for ident, data in chunks
+                      for ts, value in decode_chunk(data) if start <= ts < stop))
+    conn.commit()  # encerra a transação implícita (senão as leituras seguintes ficam num snapshot antigo)
+    return f'({RAW_SAMPLES} UNION ALL {RAW_DECODED})'
+
+
+class ChunkCompactor:
+    """Empacota as amostras de janelas fechadas em blocos por série (motor 'chunks')
+
+    Avança por uma marca d'água em store_meta, uma janela de CHUNK_SECONDS por
+    transação: codifica as amostras de cada série, grava o bloco e as remove de
+    samples. Amostras atrasadas que caem numa janela já compactada são
+    mescladas ao bloco existente na próxima execução.
+    """
+
+    def __init__(self, db: ConnectionManager, size: int = CHUNK_SECONDS, grace: int = ROLLUP_GRACE,
+                 enabled: Optional[bool] = None):
+        self.db = db
+        self.size = size
+        self.grace = grace
+        self.enabled = STORAGE_ENGINE == 'chunks' if enabled is None else enabled
+
+    def _watermark(self) -> Optional[int]:
+        rows = self.db.query("SELECT value FROM store_meta WHERE key = 'chunk_watermark'")
+        return rows[0][0] if rows else None
+
+    def _pack(self, start: int) -> int:
+        """Compacta a janela [start, start + size) numa transação; retorna amostras compactadas"""
+        stop = start + self.size
+
+        def write(conn: sqlite3.Connection) -> int:
+            # Grava primeiro: com o lock de escrita, nenhuma amostra entra entre a leitura e a remoção
+            conn.execute("INSERT INTO store_meta (key, value) VALUES ('chunk_watermark', ?) "
+                         'ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)', (stop,))
+            series: Dict[int, Dict[int, Any]] = {}
+            for ident, ts, value in conn.execute(
+                    'SELECT series_id, ts, value FROM samples WHERE series_id IN (SELECT id FROM series) '
+                    'AND ts >= ? AND ts < ?', (start, stop)):
+                series.setdefault(ident, {})[ts] = value
+            if not series:
+                return 0
+            marks = ', '.join('?' * len(series))
+            for ident, data in conn.execute(
+                    f'SELECT series_id, data FROM chunks WHERE series_id IN ({marks}) AND start = ?',
+                    list(series) + [start]):
+                # Bloco já existente (amostras atrasadas): as amostras novas prevalecem
+                merged = dict(decode_chunk(data))
+                merged.update(series[ident])
+                series[ident] = merged
+            rows = []
+            for ident, values in series.items():
+                points = sorted(values.items())
+                rows.append((ident, start, points[-1][0], len(points), encode_chunk(points)))
+            conn.executemany('INSERT OR REPLACE INTO chunks (series_id, start, last_ts, count, data) '
+                             'VALUES (?, ?, ?, ?, ?)', rows)
+            return conn.execute('DELETE FROM samples WHERE series_id IN (SELECT id FROM series) '
+                                'AND ts >= ? AND ts < ?', (start, stop)).rowcount
+
+        return self.db.write(write)
+
+    def compact(self, now: Optional[int] = None) -> int:
+        """Compacta as janelas fechadas desde a última execução; retorna amostras compactadas"""
+        if not self.enabled:
+            return 0
+        now = int(now if now is not None else time.time())
+        end = now - self.grace
+        end -= end % self.size
+        watermark = self._watermark()
+
+        # Janelas já compactadas que receberam amostras atrasadas
+        windows = set()
+        if watermark is not None:
+            for (ts,) in self.db.query('SELECT ts FROM samples WHERE series_id IN (SELECT id FROM series) '
+                                       'AND ts < ?', (watermark,)):
+                windows.add(ts - ts % self.size)
+            start = watermark
+        else:
+            first = self.db.query('SELECT MIN((SELECT MIN(ts) FROM samples WHERE series_id = se.id)) '
+                                  'FROM series se')[0][0]
+            start = first - first % self.size if first is not None else end
+        windows.update(range(start, end, self.size))
+
+        return sum(self._pack(window) for window in sorted(windows))
+
+
+# ============================================================================
+# AGREGAÇÕES (ROLLUPS)
+# ============================================================================
+
+def rollup_table(tier: str) -> str:
+    """Nome da tabela de uma camada de agregação"""
+    return f'metrics_{tier}'
+
+
+def choose_tier(range_seconds: int, points: int = DEFAULT_POINTS) -> Tuple[str, int]:
+    """Camada mais grossa que ainda entrega `points` pontos no intervalo: (nome, passo)
+
+    Retorna ('raw', 60) quando nenhuma agregação tem resolução suficiente e as
+    amostras brutas ainda cobrem o intervalo.
+    """
+    for name, size, retention in reversed(ROLLUP_TIERS):
+        if range_seconds // size >= points and retention >= range_seconds:
+            return name, size
+    if range_seconds <= RAW_RETENTION_DAYS * 86400:
+        return 'raw', 60
+    # Brutos já expirados: a camada mais fina que ainda cobre o intervalo
+    for name, size, retention in ROLLUP_TIERS:
+        if retention >= range_seconds:
+            return name, size
+    name, size, _retention = ROLLUP_TIERS[-1]
+    return name, size
+
+
+def init_rollups(conn: sqlite3.Connection) -> None:
+    """Cria as tabelas de agregação e o estado (marca d'água) de cada camada"""
+    for name, _size, _retention in ROLLUP_TIERS:
+        table = rollup_table(name)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                host TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sum REAL,
+                min REAL,
+                max REAL,
+                last REAL,
+                last_ts INTEGER,
+                PRIMARY KEY (host, metric, bucket)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_metric ON {table}(metric, bucket)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            tier TEXT PRIMARY KEY,
+            watermark INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def _merge(buckets: Dict[tuple, List[Any]], key: tuple, count: int, total: float,
+           low: float, high: float, last: float, last_ts: int) -> None:
+    """Acumula min/max/soma/contagem/último de um bucket"""
+    acc = buckets.get(key)
+    if acc is None:
+        buckets[key] = [count, total, low, high, last, last_ts]
+        return
+    acc[0] += count
+    acc[1] += total
+    acc[2] = min(acc[2], low)
+    acc[3] = max(acc[3], high)
+    if last_ts >= acc[5]:
+        acc[4], acc[5] = last, last_ts
+
+
+class Rollups:
+    """Mantém as agregações incrementalmente a partir de uma marca d'água por camada"""
+
+    def __init__(self, db: ConnectionManager, grace: int = ROLLUP_GRACE,
+                 window: int = ROLLUP_WINDOW):
+        self.db = db
+        self.grace = grace
+        self.window = window
+
+    def _watermark(self, tier: str) -> Optional[int]:
+        rows = self.db.query('SELECT watermark FROM rollup_state WHERE tier = ?', (tier,))
+        return rows[0][0] if rows else None
+
+    def _source_start(self, source: Optional[str]) -> Optional[int]:
+        """Primeiro timestamp disponível na origem (amostras brutas ou camada anterior)"""
+        if source is None:
+            rows = self.db.query('SELECT MIN((SELECT MIN(ts) FROM samples WHERE series_id = se.id)), '
+                                 'MIN((SELECT MIN(start) FROM chunks WHERE series_id = se.id)) FROM series se')
+            found = [value for value in rows[0] if value is not None] if rows else []
+            return min(found) if found else None
+        rows = self.db.query(f'SELECT MIN(bucket) FROM {rollup_table(source)}')
+        return rows[0][0] if rows else None
+
+    def _aggregate_raw(self, start: int, end: int, size: int) -> Iterator[List[Any]]:
+        """Agrega as amostras brutas [start, end) em buckets de `size` segundos, série a série
+
+        Cada série é lida pela chave (samples e os blocos que cobrem a janela):
+        a memória fica limitada a uma série, por mais hosts e dias que falte agregar.
+        """
+        for ident, host, metric in self.db.query("SELECT id, host, metric FROM series WHERE labels = ''"):
+            buckets: Dict[tuple, List[Any]] = {}
+            for (data,) in self.db.query('SELECT data FROM chunks WHERE series_id = ? AND start > ? '
+                                         'AND start < ? AND last_ts >= ?',
+                                         (ident, start - CHUNK_SECONDS, end, start)):
+                for timestamp, value in decode_chunk(data):
+                    if start <= timestamp < end:
+                        _merge(buckets, (host, metric, timestamp - timestamp % size),
+                               1, value, value, value, value, timestamp)
+            for timestamp, value in self.db.stream('SELECT ts, value FROM samples WHERE series_id = ? '
+                                                   'AND ts >= ? AND ts < ?', (ident, start, end)):
+                _merge(buckets, (host, metric, timestamp - timestamp % size),
+                       1, value, value, value, value, timestamp)
+            for key, acc in buckets.items():
+                yield list(key) + acc
+
+    def _aggregate_tier(self, source: str, start: int, end: int,
+                        size: int) -> Iterator[List[Any]]:
+        """Agrega os buckets da camada anterior [start, end) em buckets maiores"""
+        buckets: Dict[tuple, List[Any]] = {}
+        rows = self.db.stream(
+            f'SELECT host, metric, bucket, count, sum, min, max, last, last_ts '
+            f'FROM {rollup_table(source)} WHERE bucket >= ? AND bucket < ?', (start, end))
+        for host, metric, bucket, count, total, low, high, last, last_ts in rows:
+            _merge(buckets, (host, metric, bucket - bucket % size),
+                   count, total, low, high, last, last_ts)
+        for key, acc in buckets.items():
+            yield list(key) + acc
+
+    def _write(self, name: str, rows: Iterator[List[Any]], stop: int) -> int:
+        """Grava os buckets em lotes de ROLLUP_BATCH; a marca d'água vai com o último lote
+
+        Gravar de novo um bucket é idempotente (INSERT OR REPLACE): se o coletor
+        parar no meio da janela, ela é agregada outra vez a partir da marca d'água.
+        """
+        written = 0
+        batch = list(itertools.islice(rows, ROLLUP_BATCH))
+        while True:
+            following = list(itertools.islice(rows, ROLLUP_BATCH))
+
+            def write(conn: sqlite3.Connection, batch=batch, last=not following) -> None:
+                conn.executemany(
+                    f'INSERT OR REPLACE INTO {rollup_table(name)} '
+                    '(host, metric, bucket, count, sum, min, max, last, last_ts) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                if last:
+                    conn.execute('INSERT OR REPLACE INTO rollup_state (tier, watermark) VALUES (?, ?)',
+                                 (name, stop))
+
+            self.db.write(write)
+            written += len(batch)
+            if not following:
+                return written
+            batch = following
+
+    def update(self, now: Optional[int] = None) -> Dict[str, int]:
+        """Agrega os buckets completos desde a última execução; retorna buckets por camada"""
+        now = int(now if now is not None else time.time())
+        written: Dict[str, int] = {}
+        source: Optional[str] = None
+        source_end = now - self.grace
+
+        for name, size, _retention in ROLLUP_TIERS:
+            end = source_end - source_end % size
+            start = self._watermark(name)
+            if start is None:
+                first = self._source_start(source)
+                start = first - first % size if first is not None else end
+            step = max(size, self.window - self.window % size)
+            written[name] = 0
+
+            while start < end:
+                stop = min(start + step, end)
+                if source is None:
+                    rows = self._aggregate_raw(start, stop, size)
+                else:
+                    rows = self._aggregate_tier(source, start, stop, size)
+                written[name] += self._write(name, rows, stop)
+                start = stop
+
+            # A próxima camada só pode usar buckets desta que já estão fechados
+            source, source_end = name, max(start, end)
+        return written
+
+
+# ============================================================================
+# RETENÇÃO
+# ============================================================================
+
+# Hosts distintos de interface_metrics pela chave (host, timestamp, if_index), um salto por host
+# no índice em vez de percorrer a tabela inteira
+INTERFACE_HOSTS = ('(WITH RECURSIVE h(host) AS (SELECT MIN(host) FROM interface_metrics UNION ALL '
+                   'SELECT (SELECT MIN(host) FROM interface_metrics WHERE host > h.host) '
+                   'FROM h WHERE h.host IS NOT NULL) SELECT host FROM h WHERE host IS NOT NULL)')
+
+
+@dataclass
+class RetentionTarget:
+    """Uma origem com retenção: linhas com `column` < agora - `retention` são removidas"""
+    name: str
+    table: str
+    column: str          # coluna de tempo
+    key: str             # chave das linhas (lotes por DELETE ... WHERE (key) IN (SELECT ... LIMIT))
+    series_filter: str   # restringe às séries conhecidas (busca pelo índice, série a série)
+    correlated: str      # mesmo filtro para uma série `se`, no cálculo da linha mais antiga
+    owners: str          # de onde vêm as séries `se`
+    retention: int
+    step: int            # segundos percorridos por fatia
+
+
+class Retention:
+    """Remove os dados além da retenção de cada origem em lotes curtos, um por transação
+
+    Cada fatia de `slice_seconds` (no mínimo um bucket da camada) de todas as
+    séries é apagada em lotes de até `batch` linhas pela chave da tabela: o lock
+    de escrita é mantido por pouco tempo e o WAL não cresce, por mais densa que
+    seja a fatia. A execução para ao esgotar `budget` segundos e continua de onde
+    parou na próxima; no fim, incremental_vacuum devolve ao sistema até
+    `vacuum_pages` páginas livres.
+    """
+
+    def __init__(self, db: ConnectionManager, slice_seconds: int = RETENTION_SLICE,
+                 budget: float = RETENTION_BUDGET, vacuum_pages: int = VACUUM_PAGES,
+                 batch: int = RETENTION_BATCH, convert: bool = VACUUM_CONVERT):
+        self.db = db
+        self.slice_seconds = slice_seconds
+        self.budget = budget
+        self.vacuum_pages = vacuum_pages
+        self.batch = batch
+        self.convert_enabled = convert
+        self.pending = False  # True quando o orçamento acabou antes de alcançar todos os cortes
+
+    def targets(self) -> List[RetentionTarget]:
+        """Origens com retenção: amostras brutas, blocos, interfaces e cada camada de agregação"""
+        by_id = ('series_id IN (SELECT id FROM series)', 'series_id = se.id', 'series se')
+        by_pair = ('(host, metric) IN (SELECT host, metric FROM series)',
+                   'host = se.host AND metric = se.metric', 'series se')
+        by_host = (f'host IN {INTERFACE_HOSTS}', 'host = se.host', f'{INTERFACE_HOSTS} se')
+        raw = int(RAW_RETENTION_DAYS * 86400)
+        targets = [
+            RetentionTarget('raw', 'samples', 'ts', 'series_id, ts', *by_id, raw, self.slice_seconds),
+            # Um bloco só sai quando todas as suas amostras expiraram
+            RetentionTarget('chunks', 'chunks', 'start', 'series_id, start', *by_id,
+                            raw + CHUNK_SECONDS - 1, max(self.slice_seconds, CHUNK_SECONDS)),
+            RetentionTarget('interfaces', 'interface_metrics', 'timestamp', 'host, timestamp, if_index',
+                            *by_host, int(INTERFACE_RETENTION_DAYS * 86400), self.slice_seconds),
+        ]
+        for name, size, retention in ROLLUP_TIERS:
+            targets.append(RetentionTarget(name, rollup_table(name), 'bucket', 'host, metric, bucket',
+                                           *by_pair, retention, max(self.slice_seconds, size)))
+        return targets
+
+    def run(self, now: Optional[int] = None) -> Dict[str, int]:
+        """Aplica a retenção dentro do orçamento de tempo; retorna linhas removidas por origem"""
+        now = int(now if now is not None else time.time())
+        deadline = time.monotonic() + self.budget
+        deleted: Dict[str, int] = {}
+        self.pending = False
+        for target in self.targets():
+            cutoff = now - target.retention
+            oldest = self.db.query(f'SELECT MIN((SELECT MIN({target.column}) FROM {target.table} '
+                                   f'WHERE {target.correlated})) FROM {target.owners}')[0][0]
+            deleted[target.name] = 0
+            # Lote pela chave: DELETE ... LIMIT não existe no SQLite padrão
+            delete_sql = (f'DELETE FROM {target.table} WHERE ({target.key}) IN '
+                          f'(SELECT {target.key} FROM {target.table} WHERE {target.series_filter} '
+                          f'AND {target.column} < ? LIMIT ?)')
+            while oldest is not None and oldest < cutoff and not self.pending:
+                oldest = min(cutoff, oldest + target.step)
+                count = self.batch
+                while count >= self.batch:
+                    if time.monotonic() >= deadline:
+                        self.pending = True
+                        break
+                    count = self.db.write(lambda conn, bound=oldest: conn.execute(
+                        delete_sql, (bound, self.batch))).rowcount
+                    deleted[target.name] += count
+        self.vacuum()
+        return deleted
+
+    def vacuum(self) -> int:
+        """Devolve ao sistema até vacuum_pages páginas livres; retorna quantas"""
+        conn = self.db.get()
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free:
+            return 0
+        # Cada passo do PRAGMA libera uma página; execute() daria um passo só, executescript vai até o fim
+        with_retry(lambda: conn.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)});'))
+        return free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def convert(self) -> bool:
+        """Converte um banco antigo para auto_vacuum=INCREMENTAL (VACUUM_CONVERT); True se converteu
+
+        VACUUM completo: reescreve o arquivo inteiro com o lock de escrita, então
+        só roda quando habilitado e uma única vez. Banco ocupado: a exceção sobe e
+        a próxima manutenção tenta de novo.
+        """
+        conn = self.db.get()
+        if not self.convert_enabled or conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+
+
+# ============================================================================
+# BACKUP
+# ============================================================================
+
+class Backups:
+    """Backups online pela API de backup do SQLite, verificados, comprimidos e com retenção
+
+    A cópia avança `pages` páginas por passo a partir de um snapshot fixo (transação
+    de leitura aberta na origem): o coletor continua gravando no WAL entre os passos
+    sem que a cópia recomece. O resultado passa por PRAGMA integrity_check antes de
+    ser comprimido (gzip) e publicado como `<prefixo>_<data>.db.gz`, com
+    `<prefixo>_current.db.gz` apontando para o último. Ficam os `keep` mais novos
+    que não passaram de `max_age_days`; a duração e os tamanhos vão para store_meta.
+    """
+
+    SUFFIX = '.db.gz'
+
+    def __init__(self, db: ConnectionManager, backup_dir: str, prefix: str,
+                 pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP, keep: int = BACKUP_KEEP,
+                 max_age_days: float = BACKUP_MAX_AGE_DAYS, level: int = BACKUP_GZIP_LEVEL):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.prefix = prefix
+        self.pages = pages
+        self.sleep = sleep
+        self.keep = keep
+        self.max_age = max_age_days * 86400
+        self.level = level
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.backup_dir, f'{self.prefix}_{name}{self.SUFFIX}')
+
+    def run(self) -> Dict[str, Any]:
+        """Faz um backup completo; retorna caminho, duração, tamanhos e backups removidos"""
+        started = time.monotonic()
+        os.makedirs(self.backup_dir, exist_ok=True)
+        target = self.path(time.strftime('%Y%m%d_%H%M%S'))
+        copy = target[:-len('.gz')] + '.tmp'
+        try:
+            self._copy(copy)
+            self._verify(copy)
+            db_size = os.path.getsize(copy)
+            self._compress(copy, target)
+        except Exception:
+            self._record({'ok': 0, 'time': int(time.time()),
+                          'duration_ms': int((time.monotonic() - started) * 1000)})
+            raise
+        finally:
+            for leftover in (copy, target + '.tmp'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self._publish(target)
+        stats = {'ok': 1, 'time': int(time.time()), 'duration_ms': int((time.monotonic() - started) * 1000),
+                 'db_size': db_size, 'size': os.path.getsize(target), 'pruned': self.prune()}
+        self._record(stats)
+        return dict(stats, path=target)
+
+    def _copy(self, path: str) -> None:
+        """Cópia página a página (sqlite3 backup) de um snapshot fixo da origem"""
+        source = connect(self.db.db_path, self.db.timeout)
+        target = sqlite3.connect(path)
+        try:
+            # Sem a leitura aberta, cada commit do coletor entre dois passos reinicia a cópia
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=self.pages, sleep=self.sleep)
+            source.rollback()
+            # Arquivo único, restaurável sem o -wal
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+            source.close()
+
+    def _verify(self, path: str) -> None:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchall()
+        finally:
+            conn.close()
+        if result != [('ok',)]:
+            raise sqlite3.DatabaseError(f'integrity_check falhou: {result[0][0]}')
+
+    def _compress(self, path: str, target: str) -> None:
+        with open(path, 'rb') as src, gzip.open(target + '.tmp', 'wb', compresslevel=self.level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(target + '.tmp', target)
+
+    def _publish(self, target: str) -> None:
+        """Aponta <prefixo>_current.db.gz para o último backup (link, ou cópia sem suporte a links)"""
+        current = self.path('current')
+        link = current + '.tmp'
+        if os.path.exists(link):
+            os.remove(link)
+        try:
+            os.link(target, link)
+        except OSError:
+            shutil.copyfile(target, link)
+        os.replace(link, current)
+
+    def backups(self) -> List[str]:
+        """Backups datados do prefixo, do mais novo para o mais antigo"""
+        start, current = f'{self.prefix}_', os.path.basename(self.path('current'))
+        names = [name for name in os.listdir(self.backup_dir)
+                 if name.startswith(start) and name.endswith(self.SUFFIX) and name != current]
+        return [os.path.join(self.backup_dir, name) for name in sorted(names, reverse=True)]
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Remove os backups além de `keep` e os mais velhos que max_age (o mais novo sempre fica)"""
+        now = now if now is not None else time.time()
+        removed = 0
+        for position, path in enumerate(self.backups()):
+            if position and (position >= self.keep or os.path.getmtime(path) < now - self.max_age):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def _record(self, stats: Dict[str, int]) -> None:
+        self.db.write(lambda conn: conn.executemany(
+            'INSERT INTO store_meta (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            [(f'backup_{key}', value) for key, value in stats.items()]))
+
+
+def backup_status(db: ConnectionManager) -> Dict[str, int]:
+    """Último backup registrado em store_meta (vazio se nenhum)"""
+    try:
+        rows = db.query("SELECT key, value FROM store_meta WHERE key LIKE 'backup!_%' ESCAPE '!'")
+    except sqlite3.OperationalError:
+        return {}  # Banco de um coletor antigo, sem store_meta
+    return {key[len('backup_'):]: value for key, value in rows}
+
+
+# ============================================================================
+# CONSULTAS DE HISTÓRICO
+# ============================================================================
+
+def tier_step(tier: str) -> int:
+    """Resolução nativa (segundos) de uma camada; amostras brutas são por minuto"""
+    return TIER_SIZES.get(tier, 60)
+
+
+def query_history(db: ConnectionManager, tier: str, metric: str, start: int,
+                  host: Optional[str] = None, step: Optional[int] = None,
+                  limit: int = 10000, offset: int = 0,
+                  after: Optional[Tuple[int, str]] = None) -> List[Dict[str, Any]]:
+    """Série de uma métrica agrupada no SQL em buckets de `step` segundos (min/média/max)
+
+    O passo é arredondado para um múltiplo da resolução da camada, então cada
+    bucket agrega buckets inteiros da origem. Ordem: mais recente primeiro.
+    `after` = (bucket, host) da última linha da página anterior (paginação por
+    cursor): a próxima página lê só os `limit` buckets seguintes pelo índice,
+    com custo constante, em vez de percorrer e descartar `offset` linhas.
+    """
+    if metric not in METRICS_FIELDS:
+        raise ValueError(f'Métrica inválida: {metric}')
+    native = tier_step(tier)
+    step = max(native, -(-(step or native) // native) * native)
+    oldest = start - start % step
+
+    if tier == 'raw':
+        # Layout longo: lê só as séries da métrica, pela chave (series_id, ts) de samples/blocos
+        key, aggregates = 'ts', 'AVG(value), MIN(value), MAX(value)'
+        newest_sql = f"SELECT {SERIES_NEWEST} FROM series se WHERE se.labels = '' AND metric = ?"
+    else:
+        key, aggregates = 'bucket', 'SUM(sum) / SUM(count), MIN(min), MAX(max)'
+        newest_sql = f'SELECT bucket FROM {rollup_table(tier)} WHERE metric = ?'
+    query = f'SELECT {key} - {key} % ? AS b, host, {aggregates} FROM {{source}} WHERE metric = ?'
+    params: List[Any] = [step, metric]
+    newest_params = [metric]
+    if host:
+        query += ' AND host = ?'
+        params.append(host)
+        newest_sql += ' AND host = ?'
+        newest_params.append(host)
+    if tier != 'raw':
+        newest_sql += ' ORDER BY bucket DESC LIMIT 1'
+
+    newest = None
+    if after is not None:
+        after_bucket, after_host = after
+        # Depois do cursor na ordem (b DESC, host): buckets anteriores ou o mesmo com host maior
+        query += f' AND {key} < ? AND ({key} < ? OR host > ?)'
+        params.extend([after_bucket + step, after_bucket, after_host])
+        offset = 0
+        newest = after_bucket
+    elif offset == 0 and limit >= 0:
+        # Primeira página: parte do bucket mais recente com dados (uma busca no índice por série)
+        found = [row[0] for row in db.query(newest_sql, newest_params) if row[0]]
+        newest = max(found) if found else None
+    query += f' AND {key} >= ? GROUP BY host, b ORDER BY b DESC, host LIMIT ? OFFSET ?'
+
+    # Uma página tem no máximo `limit` buckets distintos: lê primeiro só essa janela;
+    # se não encher (lacuna nos dados ou fim da série), lê o intervalo inteiro
+    def run(since: int) -> List[tuple]:
+        source = (raw_source(db, since, metrics=[metric], hosts=[host] if host else None)
+                  if tier == 'raw' else rollup_table(tier))
+        return db.query(query.format(source=source), params + [since, limit, offset])
+
+    window = oldest
+    if newest is not None and limit >= 0:
+        window = max(oldest, newest - newest % step - limit * step)
+    rows = run(window)
+    if len(rows) < limit and window > oldest:
+        rows = run(oldest)
+    return [{'timestamp': bucket, 'host': row_host, 'value': avg, 'min': low, 'max': high}
+            for bucket, row_host, avg, low, high in rows]
+
+
+def query_series(db: ConnectionManager, tier: str, metrics: List[str], start: int,
+                 hosts: Optional[List[str]] = None, step: Optional[int] = None
+                 ) -> Dict[Tuple[str, str], List[List[Any]]]:
+    """Várias métricas de vários hosts numa única consulta: {(host, métrica): [[ts, média, min, max]]}
+
+    Sem filtro de host, usa os hosts de last_metrics. Nas amostras brutas cada
+    (host, métrica) é uma série: a consulta lê só as séries pedidas pela chave
+    (series_id, ts) de samples e só os seus blocos, como nas camadas lê a chave
+    (host, metric, bucket).
+    """
+    invalid = [metric for metric in metrics if metric not in METRICS_FIELDS]
+    if invalid:
+        raise ValueError(f'Métrica inválida: {", ".join(invalid)}')
+    if not hosts:
+        hosts = [row[0] for row in db.query('SELECT host FROM last_metrics ORDER BY host')]
+    series: Dict[Tuple[str, str], List[List[Any]]] = {
+        (host, metric): [] for host in hosts for metric in metrics}
+    if not hosts or not metrics:
+        return series
+
+    native = tier_step(tier)
+    step = max(native, -(-(step or native) // native) * native)
+    host_marks = ', '.join('?' * len(hosts))
+    metric_marks = ', '.join('?' * len(metrics))
+
+    if tier == 'raw':
+        source = raw_source(db, start - start % step, metrics=metrics, hosts=hosts)
+        key, aggregates = 'ts', 'AVG(value), MIN(value), MAX(value)'
+    else:
+        source, key = rollup_table(tier), 'bucket'
+        aggregates = 'SUM(sum) / SUM(count), MIN(min), MAX(max)'
+    rows = db.query(
+        f'SELECT host, metric, {key} - {key} % ? AS b, {aggregates} FROM {source} '
+        f'WHERE host IN ({host_marks}) AND metric IN ({metric_marks}) AND {key} >= ? '
+        'GROUP BY host, metric, b ORDER BY host, metric, b',
+        [step] + hosts + metrics + [start - start % step])
+    for host, metric, bucket, avg, low, high in rows:
+        series[(host, metric)].append([bucket, avg, low, high])
+    return series
+
+
+def lttb(points: List[Any], threshold: int) -> List[Any]:
+    """Largest-Triangle-Three-Buckets: reduz a série a `threshold` pontos preservando a forma
+
+    Cada ponto é uma sequência (x, y, ...); campos extras são preservados.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    selected = 0
+    for i in range(threshold - 2):
+        # Média do próximo bucket: terceiro vértice do triângulo
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, count)
+        next_points = points[next_start:next_end] or points[-1:]
+        avg_x = sum(point[0] for point in next_points) / len(next_points)
+        avg_y = sum(point[1] for point in next_points) / len(next_points)
+
+        ax, ay = points[selected][0], points[selected][1]
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j][0], points[j][1]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        selected = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def lttb_history(db: ConnectionManager, tier: str, metric: str, start: int,
+                 host: Optional[str] = None, points: int = DEFAULT_POINTS,
+                 limit: int = 10000, offset: int = 0) -> List[Dict[str, Any]]:
+    """Série na resolução da camada reduzida por LTTB a `points` pontos por host
+
+    O LTTB precisa da janela inteira, então toda página lê o intervalo todo:
+    sem paginação por cursor (o resultado já é pequeno, ~`points` por host).
+    """
+    series: Dict[str, List[Tuple[int, float]]] = {}
+    for row in reversed(query_history(db, tier, metric, start, host, limit=-1)):
+        series.setdefault(row['host'], []).append((row['timestamp'], row['value']))
+
+    data = [{'timestamp': timestamp, 'host': row_host, 'value': value}
+            for row_host, values in series.items()
+            for timestamp, value in lttb(values, points)]
+    data.sort(key=lambda row: (-row['timestamp'], row['host']))
+    return data[offset:offset + limit]
+
+
+def stream_metrics(db: ConnectionManager, fields: List[str], start: int,
+                   host: Optional[str] = None, size: int = EXPORT_BATCH,
+                   window: int = EXPORT_WINDOW) -> Iterator[tuple]:
+    """Linhas largas (uma por host e timestamp) desde `start`, da mais recente para a mais antiga
+
+    As amostras são lidas em janelas de `window` segundos, do fim para o início,
+    e remontadas em linhas na memória: cada janela é uma busca na chave
+    (series_id, ts) por série (e decodifica só os blocos que a cobrem), sem
+    ORDER BY sobre o intervalo inteiro (que ordenaria todas as amostras).
+    `fields` deve começar por timestamp.
+    """
+    if fields[0] != 'timestamp':
+        raise ValueError('fields deve começar por timestamp')
+    metrics = [field for field in fields if field in METRICS_FIELDS]
+    hosts = [host] if host else None
+    condition = f"metric IN ({', '.join('?' * len(metrics))})"
+    params: List[Any] = list(metrics)
+    if host:
+        condition += ' AND host = ?'
+        params.append(host)
+    newest = db.query(f"SELECT MAX({SERIES_NEWEST}) FROM series se WHERE se.labels = '' AND {condition}",
+                      params)[0][0]
+    if not newest:
+        return
+    end = newest + 1
+    while end > start:
+        begin = max(start, end - window)
+        sql = (f'SELECT ts, host, metric, value FROM {raw_source(db, begin, end, metrics, hosts)} '
+               f'WHERE {condition} AND ts >= ? AND ts < ?')
+        rows: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        for timestamp, row_host, metric, value in db.stream(sql, params + [begin, end], size):
+            rows.setdefault((timestamp, row_host), {})[metric] = value
+        for timestamp, row_host in sorted(rows, key=lambda key: (-key[0], key[1])):
+            values = rows[(timestamp, row_host)]
+            yield tuple(timestamp if field == 'timestamp' else row_host if field == 'host'
+                        else values.get(field) for field in fields)
+        end = begin
+
+
+# ============================================================================
+# TAXAS DE CONTADORES
+# ============================================================================
+
+def _counter(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def counter_delta(previous: int, current: int, bits: int = 32) -> Optional[int]:
+    """Incremento de um contador de `bits` bits (Counter32/Counter64) entre duas leituras, compensando a volta"""
+    if current >= previous:
+        return current - previous
+    width = COUNTER64 if bits == 64 else COUNTER32
+    if previous >= width:
+        return None  # leitura anterior fora da faixa: outro contador (ex.: HC trocado por 32 bits)
+    delta = current + width - previous
+    # Uma volta legítima avança menos de meia faixa; mais que isso é um contador zerado
+    return delta if delta < width // 2 else None
+
+
+def uptime_wrapped(previous: int, current: int, elapsed: int) -> bool:
+    """True se o uptime (segundos) menor que o anterior é a volta do sysUpTime, e não um reinício
+
+    Na volta, o uptime avança (módulo UPTIME_WRAP) o mesmo que o relógio entre as
+    amostras; num reinício ele recomeça do boot e não bate com o intervalo.
+    """
+    advance = current + UPTIME_WRAP - previous
+    return abs(advance - elapsed) <= max(UPTIME_SLACK, elapsed / 10)
+
+
+class RateEngine:
+    """Converte contadores cumulativos em taxas por segundo na ingestão
+
+    Guarda em memória a amostra anterior de cada host (e de cada interface),
+    semeada de last_metrics/interface_metrics ao iniciar. Um uptime menor que o
+    anterior indica reinício do agente (contadores zerados): a taxa daquela
+    amostra fica vazia em vez de um valor absurdo, exceto quando é a volta do
+    próprio sysUpTime. A largura de cada contador vem da coleta: os da MIB-II do
+    host são de 32 bits e os octetos das interfaces dizem em `counter_bits` se
+    vieram da ifXTable (64 bits).
+    """
+
+    def __init__(self) -> None:
+        # host -> (timestamp, uptime, {contador: valor})
+        self._hosts: Dict[str, Tuple[int, Optional[int], Dict[str, Optional[int]]]] = {}
+        # (host, if_index) -> (timestamp, {contador: valor})
+        self._interfaces: Dict[Tuple[str, Any], Tuple[int, Dict[str, Optional[int]]]] = {}
+        self.stats = {'wraps': 0, 'resets': 0, 'reboots': 0, 'uptime_wraps': 0}
+
+    def seed(self, db: ConnectionManager) -> None:
+        """Carrega a última amostra gravada de cada host (continuidade após reiniciar o coletor)"""
+        try:
+            rows = db.query(f'SELECT host, timestamp, uptime, {", ".join(COUNTER_FIELDS)} FROM last_metrics')
+            interfaces = db.query(
+                f'SELECT i.host, i.timestamp, i.if_index, {", ".join("i." + f for f in INTERFACE_COUNTERS)} '
+                'FROM interface_metrics i JOIN (SELECT host, MAX(timestamp) AS timestamp '
+                'FROM interface_metrics GROUP BY host) last '
+                'ON i.host = last.host AND i.timestamp = last.timestamp')
+        except sqlite3.OperationalError:
+            return  # banco novo
+        for host, timestamp, uptime, *values in rows:
+            if timestamp is not None:
+                self._hosts[host] = (timestamp, _counter(uptime),
+                                     dict(zip(COUNTER_FIELDS, map(_counter, values))))
+        for host, timestamp, if_index, *values in interfaces:
+            self._interfaces[(host, if_index)] = (timestamp, dict(zip(INTERFACE_COUNTERS, map(_counter, values))))
+
+    def _rate(self, previous: Optional[int], current: Optional[int], elapsed: int,
+              bits: int = 32) -> Optional[float]:
+        if previous is None or current is None:
+            return None
+        delta = counter_delta(previous, current, bits)
+        if delta is None:
+            self.stats['resets'] += 1
+            return None
+        if current < previous:
+            self.stats['wraps'] += 1
+        return delta / elapsed
+
+    def apply(self, host: str, metrics: Dict[str, Any], timestamp: int) -> None:
+        """Acrescenta <contador>_rate em `metrics` e em cada interface, a partir da amostra anterior"""
+        counters = {field: _counter(metrics.get(field)) for field in COUNTER_FIELDS}
+        uptime = _counter(metrics.get('uptime')) or None
+        previous = self._hosts.get(host)
+        elapsed = timestamp - previous[0] if previous else 0
+        rebooted = False
+        if previous and uptime and previous[1] and uptime < previous[1]:
+            if elapsed > 0 and uptime_wrapped(previous[1], uptime, elapsed):
+                self.stats['uptime_wraps'] += 1
+            else:
+                rebooted = True
+                self.stats['reboots'] += 1
+        valid = previous is not None and elapsed > 0 and not rebooted
+        for field in COUNTER_FIELDS:
+            metrics[f'{field}_rate'] = self._rate(previous[2][field], counters[field], elapsed) if valid else None
+        if previous is None or elapsed > 0:
+            self._hosts[host] = (timestamp, uptime, counters)
+
+        for iface in metrics.get('interfaces', []):
+            key = (host, iface.get('if_index'))
+            counters = {field: _counter(iface.get(field)) for field in INTERFACE_COUNTERS}
+            bits = iface.get('counter_bits') or {}
+            previous_iface = self._interfaces.get(key)
+            if_elapsed = timestamp - previous_iface[0] if previous_iface else 0
+            if_valid = previous_iface is not None and if_elapsed > 0 and not rebooted
+            for field in INTERFACE_COUNTERS:
+                iface[f'{field}_rate'] = (self._rate(previous_iface[1][field], counters[field], if_elapsed,
+                                                     bits.get(field, 32)) if if_valid else None)
+            if previous_iface is None or if_elapsed > 0:
+                self._interfaces[key] = (timestamp, counters)
+
+
+# ============================================================================
+# BUFFER DE ESCRITA
+# ============================================================================
+
+class MetricsWriter:
+    """Acumula as métricas dos hosts e grava tudo com executemany numa transação
+
+    Cada coleta passa pelo RateEngine antes de entrar no buffer: as taxas dos
+    contadores são gravadas junto dos valores brutos. Cada valor não nulo vira
+    uma amostra (series_id, ts, valor); os ids das séries ficam em memória.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, flush_size: int = FLUSH_SIZE,
+                 flush_age: float = FLUSH_AGE, max_pending: int = MAX_PENDING,
+                 timeout: float = DB_TIMEOUT, rates: Optional[RateEngine] = None):
+        self.db_path = db_path
+        self.flush_size = flush_size
+        self.flush_age = flush_age
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._db = ConnectionManager(db_path, timeout)
+        self.rates = rates or RateEngine()
+        self._rates_seeded = False
+        self._metrics: List[List[Any]] = []
+        self._last: Dict[str, List[Any]] = {}  # só a linha mais recente de cada host
+        self._interfaces: List[List[Any]] = []
+        self._series: Dict[Tuple[str, str], int] = {}  # (host, métrica) -> id em series
+        self._oldest: Optional[float] = None
+        self.stats = {'flushes': 0, 'rows': 0, 'errors': 0, 'dropped': 0, 'last_flush_ms': 0.0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._metrics) + len(self._interfaces)
+
+    def add(self, host_name: str, metrics: Dict[str, Any], timestamp: Optional[int] = None) -> None:
+        """Enfileira a coleta de um host; grava se o buffer atingiu flush_size"""
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        if not self._rates_seeded:
+            self.rates.seed(self._db)
+            self._rates_seeded = True
+        self.rates.apply(host_name, metrics, timestamp)
+
+        values = [metrics.get(field) for field in METRICS_FIELDS]
+        self._metrics.append([timestamp, host_name] + values)
+
+        last = self._last.get(host_name)
+        if last is None or last[1] <= timestamp:
+            self._last[host_name] = [host_name, timestamp, metrics.get('sysname')] + values
+
+        self._interfaces.extend([timestamp, host_name] + [iface.get(field) for field in INTERFACE_FIELDS]
+                                for iface in metrics.get('interfaces', []))
+
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self.pending >= self.flush_size:
+            self.flush()
+
+    def seconds_until_flush(self) -> float:
+        """Tempo até a linha mais antiga do buffer vencer flush_age"""
+        if self._oldest is None:
+            return float('inf')
+        return max(0.0, self.flush_age - (time.monotonic() - self._oldest))
+
+    def flush_if_due(self) -> int:
+        """Grava se a linha mais antiga já esperou flush_age"""
+        if self._oldest is not None and self.seconds_until_flush() <= 0:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        """Grava todas as linhas pendentes numa única transação; retorna quantas"""
+        count = self.pending
+        if not count:
+            return 0
+
+        def write(conn: sqlite3.Connection) -> Dict[Tuple[str, str], int]:
+            created: Dict[Tuple[str, str], int] = {}
+            conn.executemany(INSERT_SAMPLES, self._samples(conn, created))
+            conn.executemany(UPSERT_LAST, list(self._last.values()))
+            conn.executemany(UPSERT_INTERFACES, self._interfaces)
+            bump_generation(conn)
+            return created
+
+        started = time.perf_counter()
+        try:
+            # Séries novas só entram no cache depois do commit (rollback as desfaz)
+            self._series.update(self._db.write(write))
+        except sqlite3.Error as e:
+            # Mantém as linhas para a próxima tentativa, com limite de memória
+            self.stats['errors'] += 1
+            print(f"  ✗ Erro ao gravar {count} linhas: {e}")
+            self._trim()
+            return 0
+
+        self.stats['flushes'] += 1
+        self.stats['rows'] += count
+        self.stats['last_flush_ms'] = (time.perf_counter() - started) * 1000
+        self._metrics.clear()
+        self._last.clear()
+        self._interfaces.clear()
+        self._oldest = None
+        return count
+
+    def _samples(self, conn: sqlite3.Connection,
+                 created: Dict[Tuple[str, str], int]) -> List[Tuple[int, int, Any]]:
+        """Linhas do buffer como amostras (series_id, ts, valor); valores nulos não são gravados"""
+        samples = []
+        for timestamp, host, *values in self._metrics:
+            for metric, value in zip(METRICS_FIELDS, values):
+                if value is None:
+                    continue
+                key = (host, metric)
+                ident = self._series.get(key) or created.get(key)
+                if ident is None:
+                    ident = created[key] = series_id(conn, host, metric)
+                samples.append((ident, timestamp, float(value) if metric in REAL_FIELDS else value))
+        return samples
+
+    def _trim(self) -> None:
+        """Descarta as linhas mais antigas quando o buffer passa de max_pending"""
+        excess = self.pending - self.max_pending
+        if excess <= 0:
+            return
+        dropped_interfaces = min(excess, len(self._interfaces))
+        del self._interfaces[:dropped_interfaces]
+        dropped_metrics = min(excess - dropped_interfaces, len(self._metrics))
+        del self._metrics[:dropped_metrics]
+        self.stats['dropped'] += dropped_interfaces + dropped_metrics
+        print(f"  ✗ Buffer cheio: {dropped_interfaces + dropped_metrics} linhas antigas descartadas")
+
+    def close(self) -> None:
+        """Grava o que restou e fecha a conexão"""
+        self.flush()
+        self._db.close()
+
+    def report(self) -> None:
+        """Imprime os contadores do buffer de escrita"""
+        print(f"  Escrita: transações={self.stats['flushes']} linhas={self.stats['rows']} "
+              f"erros={self.stats['errors']} descartadas={self.stats['dropped']} "
+              f"última={self.stats['last_flush_ms']:.1f}ms")
+        print(f"  Taxas: voltas={self.rates.stats['wraps']} zerados={self.rates.stats['resets']} "
+              f"reinícios={self.rates.stats['reboots']} voltas do uptime={self.rates.stats['uptime_wraps']}")
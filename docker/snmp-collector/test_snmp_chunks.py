@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Testes de ida e volta do codec de blocos (snmp_chunks)
+Execução: python -m unittest test_snmp_chunks (no diretório snmp-collector)
+"""
+
+import math
+import random
+import unittest
+
+from snmp_chunks import FLOAT, INTEGER, decode_chunk, encode_chunk
+
+
+def roundtrip(points):
+    return decode_chunk(encode_chunk(points))
+
+
+class ChunkRoundTripTest(unittest.TestCase):
+
+    def assertSamePoints(self, expected, decoded):
+        """Compara ts, valor e tipo de cada ponto (NaN é igual a NaN)"""
+        self.assertEqual(len(expected), len(decoded))
+        for (ts, value), (got_ts, got_value) in zip(expected, decoded):
+            self.assertEqual(ts, got_ts)
+            self.assertIs(type(value), type(got_value))
+            if isinstance(value, float) and math.isnan(value):
+                self.assertTrue(math.isnan(got_value))
+            else:
+                self.assertEqual(value, got_value)
+
+    def test_floats(self):
+        rng = random.Random(1)
+        points = [(1_700_000_000 + 60 * i, round(rng.uniform(0, 100), 2)) for i in range(500)]
+        points[10:20] = [(ts, 42.0) for ts, _ in points[10:20]]
+        points += [(points[-1][0] + 60, -0.0), (points[-1][0] + 120, 1e308), (points[-1][0] + 180, 5e-324)]
+        self.assertEqual(encode_chunk(points)[0], FLOAT)
+        self.assertSamePoints(points, roundtrip(points))
+
+    def test_counter64(self):
+        counter, points = 2 ** 64 - 10 ** 9, []
+        for i in range(300):
+            points.append((1_700_000_000 + 60 * i, counter))
+            counter += 1_250_000 * (i % 7)
+        # Reinício do agente: o contador volta a zero no meio do bloco
+        points += [(points[-1][0] + 60, 0), (points[-1][0] + 120, 2 ** 64 - 1), (points[-1][0] + 180, -5)]
+        self.assertEqual(encode_chunk(points)[0], INTEGER)
+        self.assertSamePoints(points, roundtrip(points))
+
+    def test_jittered_timestamps(self):
+        rng = random.Random(2)
+        ts, points = 1_700_000_000, []
+        for i in range(400):
+            ts += 60 + rng.randint(-3, 3) if i % 50 else 3600 * rng.randint(1, 48)
+            points.append((ts, i * 10))
+        self.assertSamePoints(points, roundtrip(points))
+
+    def test_nan_and_inf(self):
+        nan = float('nan')
+        points = [(100, nan), (160, 1.5), (220, nan), (280, nan), (340, math.inf), (400, -math.inf)]
+        self.assertSamePoints(points, roundtrip(points))
+
+    def test_single_point(self):
+        for value in (0.0, 7, 2 ** 64 - 1, float('nan')):
+            with self.subTest(value=value):
+                self.assertSamePoints([(1_700_000_000, value)], roundtrip([(1_700_000_000, value)]))
+
+    def test_empty(self):
+        self.assertEqual(roundtrip([]), [])
+
+    def test_rejects_none(self):
+        with self.assertRaises(ValueError):
+            encode_chunk([(100, 1.0), (160, None)])
+
+    def test_rejects_mixed_types(self):
+        with self.assertRaises(ValueError):
+            encode_chunk([(100, 0.0), (160, 1), (220, 2.5)])
+
+    def test_rejects_non_numeric(self):
+        for value in (True, '1.0', b'\x01'):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                encode_chunk([(100, value)])
+
+    def test_truncated(self):
+        data = encode_chunk([(100 + 60 * i, float(i)) for i in range(50)])
+        with self.assertRaises(ValueError):
+            decode_chunk(data[:len(data) // 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
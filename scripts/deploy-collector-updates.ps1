@@ -35,6 +35,11 @@ Write-Host ""
 Write-Host "[2/4] Enviando arquivos atualizados..." -ForegroundColor Yellow
 # Enviar apenas os arquivos modificados
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\collector-cloud.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_client.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_async.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\polling.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_store.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_chunks.py" "${SSH_HOST}:${REMOTE_DIR}/"
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\entrypoint.sh" "${SSH_HOST}:${REMOTE_DIR}/"
 Write-Host "Arquivos atualizados enviados" -ForegroundColor Green
 Write-Host ""
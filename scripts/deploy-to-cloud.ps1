@@ -49,6 +49,11 @@ scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\entrypoint.sh" "${SSH_HOST}:${REMOTE_DI
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\api.py" "${SSH_HOST}:${REMOTE_DIR}/"
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\collector.py" "${SSH_HOST}:${REMOTE_DIR}/"
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\collector-cloud.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_client.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_async.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\polling.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_store.py" "${SSH_HOST}:${REMOTE_DIR}/"
+scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\snmp_chunks.py" "${SSH_HOST}:${REMOTE_DIR}/"
 scp -F $SSH_CONFIG "$LOCAL_COLLECTOR_DIR\requirements.txt" "${SSH_HOST}:${REMOTE_DIR}/"
 Write-Host "Arquivos do collector enviados" -ForegroundColor Green
 Write-Host ""